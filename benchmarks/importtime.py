@@ -0,0 +1,94 @@
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+"""
+Import-time budget. Every module below is imported in a fresh interpreter with python -X importtime, its cumulative
+import time has to stay under its budget and it must not import the modules it is forbidden to import. The light modules
+(keys, musicgen and the musicgen submodules that don't build music21 objects) and the conversion, cache, command line and service
+modules must not import music21, so the command line, the service, their workers and the parallel chunk workers only
+pay for music21 when they use it.
+
+The budgets are in milliseconds and leave room for slower machines, a module going over its budget is a regression.
+
+Example, from the root of the repository:
+    python -m benchmarks.importtime
+"""
+
+# Module -> (budget in milliseconds, modules it must not import)
+BUDGETS: Dict[str, Tuple[float, Tuple[str, ...]]] = {
+    'keys': (50, ('music21',)),
+    'musicgen': (50, ('music21', 'numpy')),
+    'musicgen.instrumentation': (50, ('music21', 'cProfile')),
+    'musicgen.midi': (50, ('music21',)),
+    'musicgen.parallel': (50, ('music21', 'concurrent.futures')),
+    'conversion': (1000, ('music21',)),
+    'cache': (1000, ('music21',)),
+    'cli': (1000, ('music21',)),
+    'service': (1000, ('music21',)),
+}
+
+# The modules are imported from the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """
+    Imports a module in a fresh interpreter with python -X importtime
+    :param module: the module to import
+    :return: the cumulative import time in microseconds of every module imported along the way
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], stderr=subprocess.PIPE,
+                             universal_newlines=True, check=True, cwd=ROOT)
+
+    times = {}
+    # Lines look like: "import time:       self [us] |  cumulative | imported package"
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def check(module: str, budget: float, forbidden: Tuple[str, ...]) -> List[str]:
+    """
+    Checks the import of a module against its budget
+    :return: a description of every violation
+    """
+    times = import_times(module)
+    milliseconds = times.get(module, 0) / 1000
+    print(f"{module:>26} {milliseconds:9.1f} ms (budget {budget:g} ms)")
+
+    violations = []
+    if milliseconds > budget:
+        violations.append(f"{module} took {milliseconds:.1f} ms to import, over its {budget:g} ms budget")
+    for name in forbidden:
+        if name in times:
+            violations.append(f"{module} imports {name}")
+
+    return violations
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Checks the import time of the modules against their budget")
+    parser.add_argument('modules', nargs='*', default=list(BUDGETS), help="modules to check (default: all)")
+    parsed = parser.parse_args(args)
+
+    violations = []
+    for module in parsed.modules:
+        budget, forbidden = BUDGETS[module]
+        violations += check(module, budget, forbidden)
+
+    for violation in violations:
+        print(f"Over budget: {violation}", file=sys.stderr)
+
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
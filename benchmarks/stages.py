@@ -0,0 +1,262 @@
+import argparse
+import gc
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import music21
+import numpy as np
+
+import conversion
+import musicgen
+from conversion import CYPHER, NOTES_LIST
+from musicgen.chordcreator import ChordCreator
+
+"""
+Benchmarks every stage of the image <-> music conversion, and the conversions end-to-end, on the sample images of
+images/ at several resolutions and on the reference *.mid files of output/. Each measurement reports its wall time (the
+best of the repeats), its throughput in notes per second and its peak memory (measured by tracemalloc in an extra run),
+and the whole report is written as JSON so that two runs can be compared.
+
+Example, from the root of the repository:
+    python -m benchmarks.stages -o bench.json
+    python -m benchmarks.stages --splits 64 --compare bench.json
+"""
+
+SPLITS = (16, 64, 128, 256)
+BACKENDS = ('music21', 'midi')
+STAGES = ('split_image_transform', 'features', 'create_chords', 'chordify', 'write_midi', 'decode', 'decode_music',
+          'encode_end_to_end', 'decode_end_to_end')
+
+Measurement = Dict[str, Any]
+
+
+def measure(function: Callable[[], Any], repeat: int = 3, memory: bool = True) -> Tuple[float, Optional[int]]:
+    """
+    Times a function, the garbage collector is run before every call
+    :param function: the stage to measure
+    :param repeat: the number of timed calls
+    :param memory: whether to run the stage once more under tracemalloc to get its peak memory
+    :return: the best wall time in seconds and the peak memory in bytes (None if not measured)
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return seconds, peak
+
+
+def _image_stages(path: str, image: np.ndarray, split_number: Tuple[int, int], backend: str,
+                  directory: str) -> Dict[str, Callable[[], Any]]:
+    """
+    The stages of the conversion of one image at one resolution, the inputs of every stage are computed beforehand
+    """
+    music_file = os.path.join(directory, 'music.mid')
+    stages: Dict[str, Callable[[], Any]] = {}
+
+    features = conversion.split_image_transform(image, split_number)
+    batch = conversion.features_to_batch(*features)
+
+    music = musicgen.create_chords(batch, CYPHER, backend)
+    conversion.write_music(music, music_file)
+    decoded = musicgen.decode(music_file, CYPHER, backend)
+
+    if backend == 'music21':
+        notes = list(batch.notes())
+        stages['split_image_transform'] = lambda: conversion.split_image_transform(image, split_number)
+        stages['features'] = lambda: conversion.features_to_batch(*features)
+        stages['chordify'] = lambda: ChordCreator(notes).chordify(CYPHER)
+        stages['decode_music'] = lambda: conversion.notes_to_image(decoded.note_names(), decoded.quarter_lengths,
+                                                                   decoded.velocities, split_number, NOTES_LIST)
+        stages['write_midi'] = lambda: music.write('midi', music_file)
+    else:
+        events = list(ChordCreator(batch).chord_events_compiled(CYPHER))
+        stages['write_midi'] = lambda: musicgen.midi.write_midi(events)
+
+    stages['create_chords'] = lambda: musicgen.create_chords(batch, CYPHER, backend)
+    stages['decode'] = lambda: musicgen.decode(music_file, CYPHER, backend)
+    stages['encode_end_to_end'] = lambda: conversion.write_music(
+        conversion.image_to_music(cv2.imread(path), split_number, CYPHER, NOTES_LIST, backend),
+        music_file)
+    stages['decode_end_to_end'] = lambda: conversion.music_to_image(music_file, split_number, CYPHER, NOTES_LIST,
+                                                                    backend)
+
+    return stages
+
+
+def run_image(path: str, splits: List[int], backends: List[str], stages: List[str], repeat: int,
+              memory: bool) -> List[Measurement]:
+    """
+    Benchmarks the conversion of an image of images/ at every resolution
+    :return: a measurement per stage, resolution and backend
+    """
+    image = cv2.imread(path)
+
+    out = []
+    with tempfile.TemporaryDirectory() as directory:
+        for split in splits:
+            split_number = (split, split)
+            for backend in backends:
+                try:
+                    image_stages = _image_stages(path, image, split_number, backend, directory)
+                except Exception as error:
+                    out.append(_failure(path, split_number, backend, 'setup', error))
+                    continue
+
+                for stage in stages:
+                    if stage in image_stages:
+                        out.append(_run(path, split_number, backend, stage, image_stages[stage], repeat, memory))
+
+    return out
+
+
+def run_reference(path: str, backends: List[str], stages: List[str], repeat: int, memory: bool) -> List[Measurement]:
+    """
+    Benchmarks the decoding of a reference *.mid file of output/, its resolution is the one of the reference image
+    next to it
+    :return: a measurement per decoding stage and backend
+    """
+    reference_image = cv2.imread(os.path.splitext(path)[0] + '.png')
+    split_number = conversion.SPLIT_NUMBER if reference_image is None else reference_image.shape[:2]
+
+    out = []
+    for backend in backends:
+        reference_stages = {
+            'decode': lambda: musicgen.decode(path, CYPHER, backend),
+            'decode_end_to_end': lambda: conversion.music_to_image(path, split_number, CYPHER, NOTES_LIST, backend),
+        }
+        for stage in stages:
+            if stage in reference_stages:
+                out.append(_run(path, split_number, backend, stage, reference_stages[stage], repeat, memory))
+
+    return out
+
+
+def _run(source: str, split_number: Tuple[int, int], backend: str, stage: str, function: Callable[[], Any],
+         repeat: int, memory: bool) -> Measurement:
+    try:
+        seconds, peak = measure(function, repeat, memory)
+    except Exception as error:
+        return _failure(source, split_number, backend, stage, error)
+
+    notes = split_number[0] * split_number[1]
+    print(f"{stage:>22} {backend:>8} {split_number[0]:>4}x{split_number[1]:<4} {seconds:9.4f}s "
+          f"{notes / seconds:12.0f} notes/s  {os.path.basename(source)}", file=sys.stderr)
+
+    return {'source': source, 'split_number': list(split_number), 'backend': backend, 'stage': stage,
+            'seconds': seconds, 'notes': notes, 'notes_per_second': notes / seconds, 'peak_memory': peak}
+
+
+def _failure(source: str, split_number: Tuple[int, int], backend: str, stage: str, error: Exception) -> Measurement:
+    print(f"{stage:>22} {backend:>8} {split_number[0]:>4}x{split_number[1]:<4} failed: {error!r}", file=sys.stderr)
+
+    return {'source': source, 'split_number': list(split_number), 'backend': backend, 'stage': stage,
+            'error': repr(error)}
+
+
+def environment() -> Dict[str, str]:
+    """
+    The versions the benchmark ran with, the timings are only comparable between similar environments
+    """
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+            'music21': str(music21.VERSION_STR), 'opencv': cv2.__version__}
+
+
+def compare(baseline: Dict[str, Any], report: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Finds the measurements that got slower than in a previous report
+    :param baseline: the previous report
+    :param report: the new report
+    :param threshold: the relative slowdown tolerated, 0.1 for 10%
+    :return: a description of every regression
+    """
+    def identify(measurement: Measurement) -> Tuple:
+        return (measurement['source'], tuple(measurement['split_number']), measurement['backend'],
+                measurement['stage'])
+
+    previous = {identify(measurement): measurement for measurement in baseline['results'] if 'seconds' in measurement}
+
+    regressions = []
+    for measurement in report['results']:
+        old = previous.get(identify(measurement))
+        if old is None or 'seconds' not in measurement:
+            continue
+
+        slowdown = measurement['seconds'] / old['seconds'] - 1
+        if slowdown > threshold:
+            regressions.append(f"{measurement['stage']} ({measurement['backend']}, "
+                               f"{'x'.join(map(str, measurement['split_number']))}, {measurement['source']}): "
+                               f"{old['seconds']:.4f}s -> {measurement['seconds']:.4f}s (+{slowdown:.0%})")
+
+    return regressions
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks every stage of the image <-> music conversion")
+    parser.add_argument('--images', nargs='*', default=None, help="images to encode (default: images/*)")
+    parser.add_argument('--references', nargs='*', default=None,
+                        help="reference *.mid files to decode (default: output/*.mid)")
+    parser.add_argument('--splits', nargs='+', type=int, default=list(SPLITS),
+                        help="square resolutions (rows = cols) to benchmark")
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per measurement, the best one is kept")
+    parser.add_argument('--no-memory', action='store_true', help="skip the peak memory measurements")
+    parser.add_argument('-o', '--output', default=None, help="file to write the JSON report to (default: stdout)")
+    parser.add_argument('--compare', default=None, help="previous JSON report to check for slowdowns")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slowdown tolerated by --compare")
+    parsed = parser.parse_args(args)
+
+    images = sorted(glob.glob('images/*')) if parsed.images is None else parsed.images
+    references = sorted(glob.glob('output/*.mid')) if parsed.references is None else parsed.references
+
+    results = []
+    for path in images:
+        results += run_image(path, parsed.splits, parsed.backends, parsed.stages, parsed.repeat,
+                             not parsed.no_memory)
+    for path in references:
+        results += run_reference(path, parsed.backends, parsed.stages, parsed.repeat, not parsed.no_memory)
+
+    report = {'environment': environment(), 'repeat': parsed.repeat, 'results': results}
+
+    if parsed.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(parsed.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if parsed.compare is not None:
+        with open(parsed.compare) as file:
+            regressions = compare(json.load(file), report, parsed.threshold)
+
+        for regression in regressions:
+            print(f"Slower: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
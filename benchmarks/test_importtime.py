@@ -0,0 +1,14 @@
+import pytest
+
+from benchmarks.importtime import BUDGETS, check
+
+"""
+Runs the import-time budget of benchmarks/importtime.py under pytest, from the root of the repository:
+    python -m pytest benchmarks
+"""
+
+
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_import_budget(module: str) -> None:
+    budget, forbidden = BUDGETS[module]
+    assert check(module, budget, forbidden) == []
@@ -0,0 +1,268 @@
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+import conversion
+import musicgen
+from conversion import SPLIT_NUMBER
+
+"""
+Content-addressed on-disk cache of the conversions. An entry is keyed on the hash of the converted file and on every
+parameter that changes the result (the split number, the key, the class and version of the ruleset, the available notes
+and the quantization ranges), so a cached result never has to be invalidated. The least recently used entries are
+evicted once the cache grows past its size cap.
+
+Several processes can share a directory, e.g. the workers of cli.py. Each of them stores entries the others don't know
+about, so the entries and their size are read again from the directory before evicting, one process at a time.
+"""
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'soundsawful')
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # bytes
+
+# File locked by the process evicting entries, it is not an entry
+LOCK_NAME = '.lock'
+
+ImageSource = Union[bytes, np.ndarray]
+
+
+def _ruleset_parameters(ruleset: 'musicgen.rules.Rules') -> Tuple[str, int, Optional[str], Optional[int],
+                                                                 Optional[int]]:
+    """
+    The class, the version, the key, the longest run and the number of voices of a ruleset. The Rules without a secret
+    key guess it from the notes, so their key is already part of the hashed content.
+    """
+    ruleset_class = type(ruleset)
+    key = getattr(ruleset, 'secret_key', None)
+    key_name = None if key is None else f"{key.tonic.nameWithOctave} {key.mode}"
+
+    return (f"{ruleset_class.__module__}.{ruleset_class.__qualname__}", ruleset_class.version, key_name,
+            getattr(ruleset, 'max_run', None), getattr(ruleset, 'voices', None))
+
+
+def cache_key(kind: str, content: bytes, split_number: Tuple[int, int], ruleset: 'musicgen.rules.Rules',
+              notes: List[str]) -> str:
+    """
+    Computes the address of a conversion in the cache
+    :param kind: the direction of the conversion, 'midi' for image to music, 'progressive midi' for image to music in
+    progressive order and 'image' for music to image
+    :param content: the content of the converted file
+    :param split_number: the number of (rows, cols) blocks of the image
+    :param ruleset: the cypher used to convert from the music and back
+    :param notes: the notes available for the audio conversion
+    :return: the hexadecimal digest identifying the conversion
+    """
+    parameters = (kind, tuple(split_number), _ruleset_parameters(ruleset), tuple(notes),
+                  (conversion.min_quarter_length, conversion.max_quarter_length),
+                  (conversion.min_vol, conversion.max_vol))
+
+    digest = hashlib.sha256(repr(parameters).encode())
+    digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        Stores the converted files in a directory, one file per entry named after its cache_key. The recency of the
+        entries is their modification time, so it is kept from one run to the next.
+
+        :param directory: the directory holding the cache entries, it is created if needed
+        :param max_size: the maximum total size of the entries in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Entry name -> size, from the least to the most recently used
+        self._entries: Dict[str, int] = OrderedDict()
+        self.size = 0
+        self._scan()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _scan(self) -> None:
+        """
+        Reads the entries and their total size from the directory, including the ones of the other processes
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or entry.name.endswith('.tmp') or entry.name == LOCK_NAME:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another process since the directory was listed
+                continue
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        self._entries = OrderedDict((name, size) for _, name, size in sorted(files))
+        self.size = sum(self._entries.values())
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Keeps the other processes sharing the directory from evicting entries at the same time
+        """
+        if os.name == 'nt':
+            # No flock on Windows, concurrent evictions may remove a few more entries than needed
+            yield
+            return
+
+        # Only imported when needed, it is only available on POSIX systems
+        import fcntl
+
+        with open(self._path(LOCK_NAME), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get(self, name: str) -> Optional[bytes]:
+        """
+        Looks up an entry and marks it as the most recently used one
+        :param name: the cache_key of the entry
+        :return: the cached content, None on a miss
+        """
+        try:
+            with open(self._path(name), 'rb') as file:
+                content = file.read()
+            os.utime(self._path(name))
+        except FileNotFoundError:
+            # Never stored, or evicted by another process sharing the directory
+            self._discard(name)
+            self.misses += 1
+            return None
+
+        # The entry may have been stored by another process sharing the directory
+        self._discard(name)
+        self._entries[name] = len(content)
+        self.size += len(content)
+        self.hits += 1
+        return content
+
+    def put(self, name: str, content: bytes) -> None:
+        """
+        Stores an entry, then evicts the least recently used entries until the cache fits in its size cap
+        :param name: the cache_key of the entry
+        :param content: the content to cache
+        """
+        if len(content) > self.max_size:
+            return
+
+        # Written to a temporary file first so that a reader never sees a partial entry
+        temporary = self._path(f"{name}.{os.getpid()}.tmp")
+        with open(temporary, 'wb') as file:
+            file.write(content)
+        os.replace(temporary, self._path(name))
+
+        with self._locked():
+            # The size of the entries this process knows about is not the size of the directory
+            self._scan()
+            while self.size > self.max_size:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                try:
+                    os.remove(self._path(oldest))
+                except FileNotFoundError:
+                    pass
+
+    def _discard(self, name: str) -> None:
+        self.size -= self._entries.pop(name, 0)
+
+    def clear(self) -> None:
+        """
+        Removes all the entries, the hit and miss counters are kept
+        """
+        with self._locked():
+            self._scan()
+            for name in list(self._entries):
+                self._discard(name)
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+
+    def encode_image(self, image: ImageSource, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                     cypher: Optional['musicgen.rules.Rules'] = None, available_notes: Optional[List[str]] = None,
+                     workers: int = 1, progressive: bool = False,
+                     progress: Optional[conversion.Progress] = None) -> bytes:
+        """
+        Cached conversion.encode_image
+        :param image: the content of an image file or an already decoded image
+        :param split_number: the number of (rows, cols) blocks to split the image into
+        :param cypher: It is the cypher used to convert from the music and back
+        :param available_notes: the available notes for the audio conversion to use
+        :param workers: the number of processes generating the chord progression on a miss
+        :param progressive: encode the blocks coarse to fine instead of in raster order, see progressive.py
+        :param progress: on a miss, called as the blocks are encoded (see conversion.stream_image_to_music), it can stop
+        the conversion by raising ConversionCancelled. Nothing is cached then. Only when the streamed file is the one of
+        conversion.encode_image (see musicgen.streams_whole_piece), the other cyphers are encoded without it.
+        :return: the content of the *.mid file
+        """
+        cypher = conversion.default_cypher() if cypher is None else cypher
+        available_notes = conversion.default_notes() if available_notes is None else available_notes
+
+        if isinstance(image, np.ndarray):
+            content = repr(image.shape).encode() + np.ascontiguousarray(image).tobytes()
+        else:
+            content = bytes(image)
+
+        name = cache_key('progressive midi' if progressive else 'midi', content, split_number, cypher, available_notes)
+        music = self.get(name)
+        if music is None:
+            if progress is not None and not progressive and musicgen.streams_whole_piece(cypher):
+                # The streamed file is the same as the one of encode_image, it reports its progress as it goes
+                if not isinstance(image, np.ndarray):
+                    image = conversion.read_image_bytes(content)
+                buffer = io.BytesIO()
+                conversion.stream_image_to_music(image, buffer, split_number, cypher, available_notes,
+                                                 progress=progress)
+                music = buffer.getvalue()
+            else:
+                music = conversion.encode_image(image, split_number, cypher, available_notes, workers, progressive)
+            self.put(name, music)
+
+        return music
+
+    def decode_midi(self, data: bytes, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                    cypher: Optional['musicgen.rules.Cypher'] = None, notes_list: Optional[List[str]] = None,
+                    progress: Optional[conversion.Progress] = None) -> np.ndarray:
+        """
+        Cached conversion.decode_midi, the images are stored as *.png files
+        :param data: the content of the *.mid file
+        :param split_number: the number of (rows, cols) blocks the image was split into
+        :param cypher: It is the cypher used to convert from the music and back
+        :param notes_list: the notes that were available for the audio conversion
+        :param progress: on a miss, called as the chords are decoded, see conversion.decode_midi
+        :return: the reconstructed (rows, cols, 3) image
+        """
+        cypher = conversion.default_cypher() if cypher is None else cypher
+        notes_list = conversion.default_notes() if notes_list is None else notes_list
+
+        name = cache_key('image', data, split_number, cypher, notes_list)
+        image = self.get(name)
+        if image is not None:
+            return conversion.read_image_bytes(image)
+
+        new_image = conversion.decode_midi(data, split_number, cypher, notes_list, progress)
+        self.put(name, conversion.image_bytes(new_image))
+        return new_image
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: the hit and miss counters, the number of entries and their total size in bytes
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self), 'size': self.size}
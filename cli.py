@@ -0,0 +1,310 @@
+import argparse
+import copy
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import cv2
+
+import cache
+import conversion
+import incremental
+import ingestion
+import keys
+import musicgen
+import quadtree
+from conversion import DEFAULT_OUTPUT_DIR, IMAGE_EXTENSIONS, MUSIC_EXTENSIONS
+
+if TYPE_CHECKING:
+    from music21.key import Key
+
+"""
+Headless command line that converts images to *.mid files and *.mid files back to images without the GUI. The files
+are converted in parallel over a pool of processes.
+
+Example: python cli.py images/ -o converted/ --rows 64 --cols 64 --key A_MINOR --workers 4
+"""
+
+# Per worker state, built once by _init_worker so that every file converted by the worker reuses it. The files are
+# converted with copies of the cypher, see _convert.
+_worker_cypher: Optional['musicgen.rules.TriadBaroqueCypher'] = None
+_worker_notes: Optional[List[str]] = None
+_worker_cache: Optional[cache.ConversionCache] = None
+
+ConversionResult = Tuple[str, str, float, int, bool]
+
+
+def resolve_key(name: str) -> 'Key':
+    """
+    Finds the key with the given name, either one of the constants of keys.py (A_MINOR, Fs_MAJOR, ...) or a music21
+    key name ('a' for A minor, 'F#' for F# major, ...)
+    :param name: the name of the key
+    :return: the corresponding Key, a ValueError is raised when there is no key with this name
+    """
+    if name in keys.KEY_NAMES:
+        return getattr(keys, name)
+
+    # Only imported when needed, music21 is slow to import
+    from music21.exceptions21 import Music21Exception
+    from music21.key import Key
+
+    try:
+        return Key(name)
+    except Music21Exception as error:
+        raise ValueError(f"Unknown key {name!r}: {error}") from error
+
+
+def collect_files(inputs: List[str]) -> List[str]:
+    """
+    Expands the input directories and glob patterns into the list of images and music files to convert
+    :param inputs: files, directories or glob patterns
+    :return: the sorted supported files
+    """
+    files = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+
+        for candidate in candidates:
+            if os.path.isfile(candidate) and candidate.lower().endswith(IMAGE_EXTENSIONS + MUSIC_EXTENSIONS):
+                files.add(candidate)
+
+    return sorted(files)
+
+
+def _init_worker(key_name: str, cache_dir: Optional[str] = None, cache_size: int = cache.DEFAULT_MAX_SIZE,
+                 run_length: bool = False, voices: int = 1) -> None:
+    """
+    Builds the cypher of a worker process, this is only done once per worker
+    :param key_name: the name of the key used by the cypher
+    :param cache_dir: the directory of the conversion cache, None to disable the cache
+    :param cache_size: the maximum size of the conversion cache in bytes
+    :param run_length: whether to fold the runs of identical blocks, see musicgen.rules.RunLengthTriadBaroqueCypher
+    :param voices: the number of voices played at the same time, see musicgen.rules.MultiVoiceTriadBaroqueCypher
+    """
+    global _worker_cypher, _worker_notes, _worker_cache
+
+    key = resolve_key(key_name)
+    if run_length:
+        _worker_cypher = musicgen.rules.RunLengthTriadBaroqueCypher(key)
+    elif voices > 1:
+        _worker_cypher = musicgen.rules.MultiVoiceTriadBaroqueCypher(key, voices)
+    else:
+        _worker_cypher = musicgen.rules.CompiledTriadBaroqueCypher(key)
+    _worker_notes = conversion.key_notes(key)
+    _worker_cache = None if cache_dir is None else cache.ConversionCache(cache_dir, cache_size)
+
+
+def _convert_cached(path: str, out: str, split_number: Tuple[int, int], cypher: 'musicgen.rules.TriadBaroqueCypher',
+                    progressive: bool = False) -> bool:
+    """
+    Converts a single file through the conversion cache of the worker
+    :param cypher: the cypher of this file, see _convert
+    :param progressive: whether to encode the images coarse to fine, see progressive.py
+    :return: whether the conversion was found in the cache
+    """
+    hits = _worker_cache.hits
+
+    with open(path, 'rb') as file:
+        content = file.read()
+
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        conversion.write_music(_worker_cache.encode_image(content, split_number, cypher, _worker_notes,
+                                                          progressive=progressive), out)
+    else:
+        cv2.imwrite(out, _worker_cache.decode_midi(content, split_number, cypher, _worker_notes))
+
+    return _worker_cache.hits > hits
+
+
+def _convert(path: str, output_dir: str, split_number: Tuple[int, int], backend: str, stream: bool = False,
+             reduced_decode: bool = False, incremental_encode: bool = False,
+             quadtree_threshold: Optional[float] = None, progressive: bool = False) -> ConversionResult:
+    """
+    Converts a single file inside of a worker process
+    :param path: the image or music file to convert
+    :param output_dir: the directory to write the converted file in
+    :param split_number: the number of (rows, cols) blocks of the image
+    :param backend: the backend writing and reading the *.mid files, see conversion.image_to_music
+    :param stream: whether to encode the images a row of blocks at a time, see conversion.stream_image_to_music
+    :param reduced_decode: whether to decode the images at a reduced resolution, see ingestion.read_image_for_grid
+    :param incremental_encode: whether to re-encode the images from the sidecar of their previous *.mid file, see
+    incremental.convert_image_file
+    :param quadtree_threshold: the threshold of the adaptive subdivision of the images, see quadtree.py, None to convert
+    the full grid
+    :param progressive: whether to encode the images coarse to fine, see progressive.py
+    :return: the input file, the output file, the conversion time in seconds, the number of blocks converted and
+    whether the conversion was found in the cache
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    start = time.perf_counter()
+    out = os.path.join(output_dir, name + ('.mid' if path.lower().endswith(IMAGE_EXTENSIONS) else '.png'))
+    blocks = split_number[0] * split_number[1]
+    # The first chord can move the tonic of the key of the cypher, every file starts from a copy of the one of the
+    # worker so that its conversion doesn't depend on the files the worker converted before
+    cypher = copy.deepcopy(_worker_cypher)
+
+    if _worker_cache is not None:
+        cached = _convert_cached(path, out, split_number, cypher, progressive)
+        return path, out, time.perf_counter() - start, blocks, cached
+
+    if quadtree_threshold is not None:
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            image = cv2.imread(path)
+            conversion.write_music(quadtree.encode_image(image, split_number, cypher, _worker_notes,
+                                                         quadtree_threshold), out)
+        else:
+            with open(path, 'rb') as file:
+                cv2.imwrite(out, quadtree.decode_midi(file.read(), split_number, cypher, _worker_notes))
+    elif path.lower().endswith(IMAGE_EXTENSIONS) and incremental_encode:
+        incremental.convert_image_file(path, out, split_number, cypher, _worker_notes)
+    elif path.lower().endswith(IMAGE_EXTENSIONS) and (stream or reduced_decode):
+        image = ingestion.read_image_for_grid(path, split_number) if reduced_decode else cv2.imread(path)
+        if stream:
+            conversion.stream_image_to_music(image, out, split_number, cypher, _worker_notes)
+        else:
+            conversion.write_music(conversion.image_to_music(image, split_number, cypher, _worker_notes,
+                                                             backend, progressive=progressive), out)
+    elif path.lower().endswith(IMAGE_EXTENSIONS):
+        conversion.convert_image_file(path, out, split_number, cypher, _worker_notes, backend, progressive)
+    else:
+        conversion.convert_music_file(path, out, split_number, cypher, _worker_notes, backend)
+
+    return path, out, time.perf_counter() - start, blocks, False
+
+
+def convert_files(files: List[str], output_dir: str, split_number: Tuple[int, int] = conversion.SPLIT_NUMBER,
+                  key_name: str = 'A_MINOR', workers: Optional[int] = None,
+                  backend: str = 'music21', cache_dir: Optional[str] = None,
+                  cache_size: int = cache.DEFAULT_MAX_SIZE, stream: bool = False,
+                  reduced_decode: bool = False, run_length: bool = False,
+                  incremental_encode: bool = False, voices: int = 1,
+                  quadtree_threshold: Optional[float] = None, progressive: bool = False) -> List[ConversionResult]:
+    """
+    Converts all the files over a pool of worker processes. Images are converted to *.mid files and *.mid files are
+    converted to *.png images.
+    :param files: the images and music files to convert
+    :param output_dir: the directory to write the converted files in
+    :param split_number: the number of (rows, cols) blocks of the images
+    :param key_name: the name of the key used by the cypher, see resolve_key
+    :param workers: the number of worker processes, defaults to the number of CPUs
+    :param backend: the backend writing and reading the *.mid files, see conversion.image_to_music. The cached
+    conversions always go through the 'midi' backend.
+    :param cache_dir: the directory of the conversion cache shared by the workers (see cache.ConversionCache), None to
+    disable the cache. The cached conversions ignore stream, reduced_decode, incremental_encode and quadtree_threshold.
+    :param cache_size: the maximum size of the conversion cache in bytes
+    :param stream: whether to encode the images a row of blocks at a time, writing the chords of each row before the
+    next one, see conversion.stream_image_to_music. Not with voices.
+    :param reduced_decode: whether to decode the images at the lowest resolution suited to the grid, for images much
+    larger than the grid, see ingestion.read_image_for_grid. Not with quadtree_threshold.
+    :param run_length: whether to encode the runs of identical blocks as single chords, the *.mid files have to be
+    decoded with the same option
+    :param incremental_encode: whether to keep a sidecar of checkpoints next to each *.mid file and re-encode only the
+    chords of the blocks that changed since, see incremental.py. Only with the default cypher, not with run_length or
+    voices.
+    :param voices: the number of voices the blocks are split between, one track each, the *.mid files have to be
+    decoded with the same number of voices
+    :param quadtree_threshold: subdivide the images only where their pixels vary more than this threshold, see
+    quadtree.py. The *.mid files have to be decoded with a threshold too (any value), None to convert the full grid
+    :param progressive: whether to encode the blocks of the images coarse to fine so that the start of a *.mid file
+    already decodes to the whole image, see progressive.py. The order is recognized when decoding.
+    :return: the result of each successful conversion in the order they finished. The files that fail to convert are
+    reported and skipped.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(key_name, cache_dir, cache_size, run_length, voices)) as executor:
+        futures = {executor.submit(_convert, path, output_dir, split_number, backend, stream,
+                                   reduced_decode, incremental_encode, quadtree_threshold, progressive): path
+                   for path in files}
+
+        for future in as_completed(futures):
+            try:
+                path, out, seconds, blocks, cached = future.result()
+            except Exception as error:
+                # One bad file must not stop the conversion of the others
+                print(f"{futures[future]}: failed to convert: {type(error).__name__}: {error}", file=sys.stderr)
+                continue
+            print(f"{path} -> {out}: {seconds:.2f}s, {blocks / seconds:.0f} blocks/s{' (cached)' if cached else ''}")
+            results.append((path, out, seconds, blocks, cached))
+
+    return results
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Converts images to *.mid files and *.mid files back to images")
+    parser.add_argument('inputs', nargs='+', help="image or *.mid files, directories or glob patterns to convert")
+    parser.add_argument('-o', '--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help=f"directory to write the converted files in (default: {DEFAULT_OUTPUT_DIR})")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--rows', type=int, default=conversion.SPLIT_NUMBER[0], help="number of block rows")
+    parser.add_argument('--cols', type=int, default=conversion.SPLIT_NUMBER[1], help="number of block columns")
+    parser.add_argument('--key', default='A_MINOR', help="key of the cypher, e.g. A_MINOR or 'a'")
+    parser.add_argument('--backend', choices=['music21', 'midi'], default='midi',
+                        help="write and read the *.mid files through music21 or directly (default: midi)")
+    parser.add_argument('--cache-dir', default=None,
+                        help=f"cache the conversions in this directory, e.g. {cache.DEFAULT_DIRECTORY}")
+    parser.add_argument('--cache-size', type=int, default=cache.DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help="maximum size of the conversion cache in MiB")
+    parser.add_argument('--stream', action='store_true',
+                        help="encode the images a row of blocks at a time, writing each row before the next")
+    parser.add_argument('--reduced-decode', action='store_true',
+                        help="decode large images at the lowest resolution (1/2, 1/4 or 1/8) suited to the grid")
+    parser.add_argument('--run-length', action='store_true',
+                        help="encode the runs of identical blocks as single chords, decode with the same option")
+    parser.add_argument('--incremental', action='store_true',
+                        help="keep checkpoints next to the *.mid files and only re-encode the blocks that changed")
+    parser.add_argument('--voices', type=int, default=1,
+                        help="split the blocks between voices played at the same time, decode with the same number")
+    parser.add_argument('--quadtree', type=float, default=None, metavar='THRESHOLD',
+                        help="only subdivide the image where the standard deviation of its pixels is above THRESHOLD "
+                             f"(e.g. {quadtree.DEFAULT_THRESHOLD:g}), decode with any threshold")
+    parser.add_argument('--progressive', action='store_true',
+                        help="encode the blocks coarse to fine, the start of a *.mid file decodes to the whole image")
+    parsed = parser.parse_args(args)
+    if parsed.run_length and parsed.voices > 1:
+        parser.error("--run-length and --voices can't be combined")
+    if parsed.incremental and (parsed.run_length or parsed.voices > 1):
+        parser.error("--incremental can't be combined with --run-length or --voices")
+    if parsed.stream and parsed.voices > 1:
+        parser.error("--stream can't be combined with --voices")
+    if parsed.reduced_decode and parsed.quadtree is not None:
+        parser.error("--reduced-decode can't be combined with --quadtree")
+    if parsed.progressive and (parsed.stream or parsed.incremental or parsed.quadtree is not None):
+        parser.error("--progressive can't be combined with --stream, --incremental or --quadtree")
+    if parsed.cache_dir is not None and (parsed.stream or parsed.reduced_decode or parsed.incremental or
+                                         parsed.quadtree is not None):
+        parser.error("--cache-dir can't be combined with --stream, --reduced-decode, --incremental or --quadtree")
+
+    files = collect_files(parsed.inputs)
+    if not files:
+        parser.error("no image or *.mid files found")
+
+    start = time.perf_counter()
+    results = convert_files(files, parsed.output_dir, (parsed.rows, parsed.cols), parsed.key, parsed.workers,
+                             parsed.backend, parsed.cache_dir, parsed.cache_size * 1024 * 1024, parsed.stream,
+                             parsed.reduced_decode, parsed.run_length, parsed.incremental, parsed.voices,
+                             parsed.quadtree, parsed.progressive)
+    elapsed = time.perf_counter() - start
+
+    blocks = sum(result[3] for result in results)
+    print(f"Converted {len(results)} files in {elapsed:.2f}s ({len(results) / elapsed:.2f} files/s, "
+          f"{blocks / elapsed:.0f} blocks/s)")
+    if parsed.cache_dir is not None:
+        hits = sum(result[4] for result in results)
+        print(f"Cache: {hits} hits, {len(results) - hits} misses")
+    if len(results) < len(files):
+        print(f"Failed to convert {len(files) - len(results)} of {len(files)} files", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
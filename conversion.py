@@ -0,0 +1,550 @@
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+import keys
+import musicgen
+from musicgen.instrumentation import span
+from progressive import PROGRESSIVE_VELOCITY, fill_blocks, is_progressive, order_batch
+from quantization import Quantizer
+
+if TYPE_CHECKING:
+    from music21.key import Key
+    from music21.stream import Stream
+
+"""
+GUI-free image <-> music conversion logic. Used by the GUI (ui.py) and by the headless command line (cli.py)
+
+The default key, notes and cypher (KEY, NOTES_LIST and CYPHER) are only built on first access, see __getattr__, so
+importing this module does not import music21. The functions use them when their cypher or notes are None.
+"""
+
+SPLIT_NUMBER = (64, 64)  # (rows, cols)
+
+# Extensions of the files converted from images and from music, by cli.py and frames.py
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+MUSIC_EXTENSIONS = ('.mid', '.midi')
+
+# Where cli.py and frames.py write the converted files by default. Not output/, it holds the reference conversions
+# shown in the README
+DEFAULT_OUTPUT_DIR = 'converted'
+
+# Name in keys.py of the default key, KEY
+KEY_NAME = 'A_MINOR'
+min_quarter_length = .25
+max_quarter_length = 2
+
+min_vol = 20
+max_vol = 127
+
+
+def key_notes(key: 'Key') -> List[str]:
+    """
+    Lists the note letters of a key, these are the notes that the blocks of an image get mapped to
+    :param key: the key to get the notes from
+    :return: the letter name of each pitch of the key
+    """
+    return musicgen.key_letters(key)
+
+
+def default_notes() -> List[str]:
+    """
+    The notes of KEY, NOTES_LIST, built on first use
+    """
+    if 'NOTES_LIST' not in globals():
+        globals()['NOTES_LIST'] = key_notes(getattr(keys, KEY_NAME))
+    return globals()['NOTES_LIST']
+
+
+def default_cypher() -> 'musicgen.rules.CompiledTriadBaroqueCypher':
+    """
+    The cypher of KEY, CYPHER, built on first use
+    """
+    if 'CYPHER' not in globals():
+        globals()['CYPHER'] = musicgen.rules.CompiledTriadBaroqueCypher(getattr(keys, KEY_NAME))
+    return globals()['CYPHER']
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Builds KEY, NOTES_LIST or CYPHER on first access, they are then cached in the module
+    """
+    if name == 'KEY':
+        return getattr(keys, KEY_NAME)
+    if name == 'NOTES_LIST':
+        return default_notes()
+    if name == 'CYPHER':
+        return default_cypher()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# (notes, quarter_length range, volume range) -> the lookup tables of the normalization, see quantizer
+_quantizers: Dict[Tuple, Quantizer] = {}
+
+# Called with the number of blocks converted so far and the total number of blocks
+Progress = Callable[[int, int], None]
+
+# Number of chords decoded between two images of preview_images
+PREVIEW_INTERVAL = 1024
+
+
+class ConversionCancelled(Exception):
+    """
+    Raised by a Progress callback to stop the conversion reporting to it
+    """
+    pass
+
+
+def block_statistics(image: np.ndarray, split_number: Tuple[int, int], statistic: str = 'median') -> Tuple[
+    np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes a statistic of every block of the image for each of the three channels at once. The image is viewed as a
+    (rows, block_height, cols, block_width, 3) array so that every block is reduced in a single NumPy call per channel
+    instead of looping over the blocks in Python.
+    :param image: the input image, its height and width have to be multiples of the split_number
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param statistic: either 'median' or 'mean', the reduction used for each block
+    :return: the three raw extracted features in raster order: the notes, the quarter_length and the volume
+    """
+    rows, cols = split_number
+    d_height = image.shape[0] // rows
+    d_width = image.shape[1] // cols
+
+    reducer = {'median': np.median, 'mean': np.mean}[statistic]
+
+    # (rows, d_height, cols, d_width, 3) -> (rows * cols, 3, d_height * d_width), the blocks stay in raster order
+    blocks = image.reshape(rows, d_height, cols, d_width, image.shape[2])
+    blocks = blocks.transpose(0, 2, 4, 1, 3).reshape(rows * cols, image.shape[2], d_height * d_width)
+
+    note = reducer(blocks[:, 0], axis=1)
+    quarter_length = reducer(blocks[:, 1], axis=1)
+    volume = reducer(blocks[:, 2], axis=1)
+
+    return note, quarter_length, volume
+
+
+def split_image_transform(image: np.ndarray, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                          workers: Optional[int] = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Splits the image into blocks and then averages each channel to get wanted data
+    :param image: the input image to retrieve the features from
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param workers: the number of processes reducing stripes of the blocks of large images, see striped.py. None for
+    the number of CPUs, 1 to always reduce them in the calling process
+    :return: the three raw extracted features: the notes, the quarter_length and the volume
+    """
+    if workers != 1:
+        # Only imported when needed, striped.py imports this module
+        import striped
+        return striped.split_image_transform(image, split_number, workers)
+
+    image = fit_to_grid(image, split_number)
+
+    with span('image.block_statistics'):
+        return block_statistics(image, split_number)
+
+
+def grid_size(shape: Tuple[int, ...], split_number: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    The (height, width) an image of this shape is resized to, the largest multiples of the split_number that fit in it
+    """
+    d_height = shape[0] / split_number[0]
+    d_width = shape[1] / split_number[1]
+
+    ratio_h = np.floor(d_height) * split_number[0]
+    ratio_w = np.floor(d_width) * split_number[1]
+
+    return int(ratio_h), int(ratio_w)
+
+
+def fit_to_grid(image: np.ndarray, split_number: Tuple[int, int], dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Resizes the image so that its height and width are multiples of the split_number, see grid_size
+    :param image: the image to resize
+    :param split_number: the number of (rows, cols) blocks the image is split into
+    :param dst: the array of the grid_size of the image to write the resized image in, a new one by default
+    :return: the resized image, dst if it is given
+    """
+    height, width = grid_size(image.shape, split_number)
+
+    # Resises the image if it is too large and causes issues in the splitting
+    with span('image.resize'):
+        return cv2.resize(image, (width, height), dst=dst)
+
+
+def block_rows(image: np.ndarray, split_number: Tuple[int, int] = SPLIT_NUMBER, rows_per_chunk: int = 1) -> Iterator[
+    Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Same as split_image_transform, but the features are extracted a few rows of blocks at a time
+    :param image: the input image to retrieve the features from
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param rows_per_chunk: the number of rows of blocks of each chunk
+    :return: the three raw extracted features of the blocks of each chunk, in raster order
+    """
+    image = fit_to_grid(image, split_number)
+    d_height = image.shape[0] // split_number[0]
+
+    for row in range(0, split_number[0], rows_per_chunk):
+        rows = min(rows_per_chunk, split_number[0] - row)
+        with span('image.block_statistics'):
+            yield block_statistics(image[row * d_height:(row + rows) * d_height], (rows, split_number[1]))
+
+
+def quantizer(notes: Optional[List[str]] = None) -> Quantizer:
+    """
+    Gets the lookup tables of the normalization for some available notes and the current ranges, they are only built
+    the first time
+    :param notes: the available notes for the audio conversion to use
+    :return: the Quantizer of these notes
+    """
+    notes = default_notes() if notes is None else notes
+
+    ranges = ((min_quarter_length, max_quarter_length), (min_vol, max_vol))
+    key = (tuple(notes),) + ranges
+    if key not in _quantizers:
+        _quantizers[key] = Quantizer(notes, *ranges)
+    return _quantizers[key]
+
+
+def features_to_notes(notes: np.ndarray, quarter_length: np.ndarray, volume: np.ndarray,
+                      available_notes: Optional[List[str]] = None) -> List['musicgen.NoteIdentifier']:
+    """
+    Normalizes the raw block features (0-255) into note identifiers that can be turned into chords
+    :param notes: the raw note feature of each block
+    :param quarter_length: the raw quarter_length feature of each block
+    :param volume: the raw volume feature of each block
+    :param available_notes: the available notes for the audio conversion to use
+    :return: a list of (note, quarter_length, volume) note identifiers
+    """
+    available_notes = default_notes() if available_notes is None else available_notes
+
+    return list(features_to_batch(notes, quarter_length, volume, available_notes))
+
+
+def features_to_batch(notes: np.ndarray, quarter_length: np.ndarray, volume: np.ndarray,
+                      available_notes: Optional[List[str]] = None) -> 'musicgen.NoteBatch':
+    """
+    Same normalization as features_to_notes, but the notes stay NumPy arrays
+    :param notes: the raw note feature of each block
+    :param quarter_length: the raw quarter_length feature of each block
+    :param volume: the raw volume feature of each block
+    :param available_notes: the available notes for the audio conversion to use
+    :return: the NoteBatch of the blocks, its degrees index available_notes
+    """
+    available_notes = default_notes() if available_notes is None else available_notes
+
+    with span('notes.normalize'):
+        return quantizer(available_notes).quantize(notes, quarter_length, volume)
+
+
+def notes_to_image(notes: np.ndarray, quarter_lengths: np.ndarray, volumes: np.ndarray,
+                   split_number: Tuple[int, int] = SPLIT_NUMBER, notes_list: Optional[List[str]] = None) -> np.ndarray:
+    """
+    Main logic to convert the music to an image again
+    :param notes: the string representation of the notes
+    :param quarter_lengths: the duration of each note
+    :param volumes: the volume of each note
+    :param split_number: the number of (rows, cols) blocks the image was split into
+    :param notes_list: the notes that were available for the audio conversion
+    :return: the reconstructed (rows, cols, 3) image
+    """
+    notes_list = default_notes() if notes_list is None else notes_list
+
+    tables = quantizer(notes_list)
+    return tables.dequantize(tables.note_indices(notes), quarter_lengths, volumes, split_number)
+
+
+def raster_batch(batch: 'musicgen.NoteBatch', split_number: Tuple[int, int] = SPLIT_NUMBER) -> 'musicgen.NoteBatch':
+    """
+    Puts decoded notes back in the raster order of the blocks, see progressive.py
+    :param batch: the decoded notes
+    :param split_number: the number of (rows, cols) blocks the image was split into
+    :return: the notes of the blocks in raster order, batch itself if it wasn't encoded in progressive order. The blocks
+    missing from a truncated progressive piece take the value of their parent.
+    """
+    if not is_progressive(batch):
+        return batch
+    if len(batch) < 2:
+        raise ValueError("The piece ends before its first block")
+    return batch[1:][fill_blocks(len(batch) - 1, split_number)]
+
+
+def batch_to_image(batch: 'musicgen.NoteBatch', split_number: Tuple[int, int] = SPLIT_NUMBER) -> np.ndarray:
+    """
+    Same as notes_to_image for a decoded NoteBatch, the note indices are already its degrees
+    :param batch: the decoded notes, their names have to be the notes that were available for the audio conversion.
+    Notes in progressive order are put back in raster order first, see raster_batch
+    :param split_number: the number of (rows, cols) blocks the image was split into
+    :return: the reconstructed (rows, cols, 3) image
+    """
+    with span('image.reconstruct'):
+        batch = raster_batch(batch, split_number)
+        return quantizer(batch.names).dequantize(batch.degrees, batch.quarter_lengths, batch.velocities, split_number)
+
+
+def preview_images(music_in: musicgen.midi.MidiSource, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                   cypher: Optional['musicgen.rules.Cypher'] = None, notes_list: Optional[List[str]] = None,
+                   chords_per_preview: int = PREVIEW_INTERVAL) -> Iterator[np.ndarray]:
+    """
+    Decodes a *.mid file into an image refined as its chords are parsed. With a piece in progressive order, every
+    preview is the whole image at the resolution of the blocks received so far, in raster order the blocks that were
+    not received yet are black.
+    :param music_in: the music file to decode, its path or its content
+    :param split_number: the number of (rows, cols) blocks the image was split into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param notes_list: the notes that were available for the audio conversion
+    :param chords_per_preview: the number of chords decoded between two previews
+    :return: the reconstructed (rows, cols, 3) image after every chords_per_preview chords, the last one is the image
+    of decode_midi
+    """
+    cypher = default_cypher() if cypher is None else cypher
+    notes_list = default_notes() if notes_list is None else notes_list
+
+    blocks = split_number[0] * split_number[1]
+    # The blocks that were not received have the notes of black pixels, one more note for the header
+    degrees = np.zeros(blocks + 1, dtype=np.uint8)
+    quarter_lengths = np.full(blocks + 1, float(min_quarter_length))
+    velocities = np.full(blocks + 1, float(min_vol))
+    received = 0
+
+    for chunk in musicgen.decode_batches(music_in, cypher, notes_list, chords_per_preview):
+        if received + len(chunk) > len(degrees):
+            raise ValueError("The piece has more notes than the blocks of the image")
+        degrees[received:received + len(chunk)] = chunk.degrees
+        quarter_lengths[received:received + len(chunk)] = chunk.quarter_lengths
+        velocities[received:received + len(chunk)] = chunk.velocities
+        received += len(chunk)
+
+        batch = musicgen.NoteBatch(degrees, quarter_lengths, velocities, chunk.names)
+        if is_progressive(batch):
+            if received > 1:
+                yield batch_to_image(batch[:received], split_number)
+        else:
+            yield batch_to_image(batch[:blocks], split_number)
+
+
+def image_to_music(image: np.ndarray, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                   cypher: Optional['musicgen.rules.Rules'] = None, available_notes: Optional[List[str]] = None,
+                   backend: str = 'music21', workers: int = 1, progressive: bool = False) -> Union['Stream', bytes]:
+    """
+    Converts an image into a chord progression
+    :param image: the image to convert
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param available_notes: the available notes for the audio conversion to use
+    :param backend: 'music21' to get a Stream, 'midi' to get the content of the *.mid file without building a Stream
+    :param workers: the number of processes reducing the blocks of large images (see split_image_transform) and, with
+    the 'midi' backend and a cypher that supports it, serializing the chord progression (see musicgen.parallel_chords)
+    :param progressive: encode the blocks coarse to fine instead of in raster order, see progressive.py
+    :return: the Stream of generated chords, or the bytes of the *.mid file with the 'midi' backend
+    """
+    cypher = default_cypher() if cypher is None else cypher
+    available_notes = default_notes() if available_notes is None else available_notes
+
+    # Gets the split data channels
+    notes, quarter_length, volume = split_image_transform(image, split_number, workers)
+
+    batch = features_to_batch(notes, quarter_length, volume, available_notes)
+    if progressive:
+        if min_vol <= PROGRESSIVE_VELOCITY:
+            raise ValueError(f"The volumes have to stay above the velocity of the progressive header "
+                             f"({PROGRESSIVE_VELOCITY})")
+        batch = order_batch(batch, split_number, min_quarter_length)
+
+    # Converts the list of notes into a chord progression
+    return musicgen.create_chords(batch, cypher, backend, workers if musicgen.parallel_chords(cypher, backend) else 1)
+
+
+def stream_image_to_music(image: np.ndarray, music_out: Union[str, BinaryIO],
+                          split_number: Tuple[int, int] = SPLIT_NUMBER, cypher: Optional['musicgen.rules.Rules'] = None,
+                          available_notes: Optional[List[str]] = None, rows_per_chunk: int = 1,
+                          progress: Optional[Progress] = None) -> int:
+    """
+    Converts an image into a *.mid file a few rows of blocks at a time: the features of a chunk are extracted, turned
+    into chords and written before the next chunk is read, so that the chords and events held do not grow with the
+    number of blocks. The image itself is still resized to the grid as a whole, see block_rows. The file is the same
+    as the one written with the 'midi' backend of image_to_music.
+    :param image: the image to convert
+    :param music_out: where to write the *.mid file, its path or a seekable binary file
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param cypher: It is the cypher used to convert from the music and back, it can't be a Rules object guessing the key
+    :param available_notes: the available notes for the audio conversion to use
+    :param rows_per_chunk: the number of rows of blocks converted at once
+    :param progress: called once the chords of each chunk are written, it can stop the conversion by raising
+    ConversionCancelled
+    :return: the number of bytes written
+    """
+    cypher = default_cypher() if cypher is None else cypher
+    available_notes = default_notes() if available_notes is None else available_notes
+
+    def batches() -> Iterator['musicgen.NoteBatch']:
+        blocks = 0
+        for features in block_rows(image, split_number, rows_per_chunk):
+            batch = features_to_batch(*features, available_notes)
+            yield batch
+
+            # The next chunk is only requested once the chords of this one are written
+            blocks += len(batch)
+            if progress is not None:
+                progress(blocks, split_number[0] * split_number[1])
+
+    events = musicgen.stream_chord_events(batches(), cypher)
+
+    if isinstance(music_out, str):
+        with open(music_out, 'wb') as file:
+            return musicgen.midi.write_midi_file(events, file)
+    return musicgen.midi.write_midi_file(events, music_out)
+
+
+def write_music(music: Union['Stream', bytes], music_out: str) -> None:
+    """
+    Writes the output of image_to_music to a *.mid file, whichever backend generated it
+    :param music: the Stream of chords or the bytes of the *.mid file
+    :param music_out: where to write the *.mid file
+    """
+    if isinstance(music, bytes):
+        with open(music_out, 'wb') as file:
+            file.write(music)
+    else:
+        with span('midi.write'):
+            music.write("midi", music_out)
+
+
+def music_to_image(music_in: str, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                   cypher: Optional['musicgen.rules.Cypher'] = None, notes_list: Optional[List[str]] = None,
+                   backend: str = 'music21', workers: int = 1) -> np.ndarray:
+    """
+    Converts a music file (*.mid) back into the image it was generated from
+    :param music_in: the input music file to decode
+    :param split_number: the number of (rows, cols) blocks the image was split into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param notes_list: the notes that were available for the audio conversion
+    :param backend: 'music21' to parse the file with music21, 'midi' to stream its note events (see musicgen.midi)
+    :param workers: with the 'midi' backend, the number of processes decoding the voices of a
+    MultiVoiceTriadBaroqueCypher, see musicgen.decode
+    :return: the reconstructed (rows, cols, 3) image
+    """
+    cypher = default_cypher() if cypher is None else cypher
+    notes_list = default_notes() if notes_list is None else notes_list
+
+    return batch_to_image(musicgen.decode(music_in, cypher, backend, notes_list, workers=workers), split_number)
+
+
+def convert_image_file(image_in: str, music_out: str, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                       cypher: Optional['musicgen.rules.Rules'] = None, available_notes: Optional[List[str]] = None,
+                       backend: str = 'music21', progressive: bool = False) -> int:
+    """
+    Converts an image file (*.png or *.jpeg) to a music file (*.mid)
+    :param image_in: the image file to read
+    :param music_out: where to write the generated *.mid file
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param available_notes: the available notes for the audio conversion to use
+    :param backend: the backend writing the *.mid file, see image_to_music
+    :param progressive: encode the blocks coarse to fine instead of in raster order, see progressive.py
+    :return: the number of encoded blocks
+    """
+    cypher = default_cypher() if cypher is None else cypher
+    available_notes = default_notes() if available_notes is None else available_notes
+
+    with span('image.read'):
+        image = cv2.imread(image_in)
+
+    write_music(image_to_music(image, split_number, cypher, available_notes, backend, progressive=progressive),
+                music_out)
+
+    return split_number[0] * split_number[1]
+
+
+def convert_music_file(music_in: str, image_out: str, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                       cypher: Optional['musicgen.rules.Cypher'] = None, notes_list: Optional[List[str]] = None,
+                       backend: str = 'music21') -> int:
+    """
+    Converts a music file (*.mid) to an image file (*.png or *.jpeg)
+    :param music_in: the input music file to decode
+    :param image_out: where to write the reconstructed image
+    :param split_number: the number of (rows, cols) blocks the image was split into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param notes_list: the notes that were available for the audio conversion
+    :param backend: the backend reading the *.mid file, see music_to_image
+    :return: the number of decoded blocks
+    """
+    cypher = default_cypher() if cypher is None else cypher
+    notes_list = default_notes() if notes_list is None else notes_list
+
+    cv2.imwrite(image_out, music_to_image(music_in, split_number, cypher, notes_list, backend))
+
+    return split_number[0] * split_number[1]
+
+
+def read_image_bytes(data: bytes) -> np.ndarray:
+    """
+    Decodes an encoded image (*.png, *.jpeg, ...) held in memory
+    :param data: the content of the image file
+    :return: the decoded BGR image
+    """
+    with span('image.read'):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode the image")
+    return image
+
+
+def image_bytes(image: np.ndarray, extension: str = '.png') -> bytes:
+    """
+    Encodes an image in memory
+    :param image: the image to encode
+    :param extension: the format of the encoded image, '.png' or '.jpg'
+    :return: the content of the image file
+    """
+    success, buffer = cv2.imencode(extension, image)
+    if not success:
+        raise ValueError(f"Could not encode the image as {extension}")
+    return buffer.tobytes()
+
+
+def encode_image(image: Union[bytes, np.ndarray], split_number: Tuple[int, int] = SPLIT_NUMBER,
+                 cypher: Optional['musicgen.rules.Rules'] = None, available_notes: Optional[List[str]] = None,
+                 workers: int = 1, progressive: bool = False) -> bytes:
+    """
+    Converts an image to the content of a *.mid file without touching the disk
+    :param image: the content of an image file or an already decoded image
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param available_notes: the available notes for the audio conversion to use
+    :param workers: the number of processes converting the image, see image_to_music
+    :param progressive: encode the blocks coarse to fine instead of in raster order, see progressive.py
+    :return: the content of the *.mid file
+    """
+    cypher = default_cypher() if cypher is None else cypher
+    available_notes = default_notes() if available_notes is None else available_notes
+
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = read_image_bytes(bytes(image))
+
+    return image_to_music(image, split_number, cypher, available_notes, 'midi', workers, progressive)
+
+
+def decode_midi(data: bytes, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                cypher: Optional['musicgen.rules.Cypher'] = None, notes_list: Optional[List[str]] = None,
+                progress: Optional[Progress] = None, workers: int = 1) -> np.ndarray:
+    """
+    Converts the content of a *.mid file back into the image it was generated from without touching the disk
+    :param data: the content of the *.mid file
+    :param split_number: the number of (rows, cols) blocks the image was split into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param notes_list: the notes that were available for the audio conversion
+    :param progress: called as the chords are decoded, it can stop the conversion by raising ConversionCancelled
+    :param workers: the number of processes decoding the voices of a MultiVoiceTriadBaroqueCypher, see musicgen.decode
+    :return: the reconstructed (rows, cols, 3) image, see image_bytes to encode it
+    """
+    cypher = default_cypher() if cypher is None else cypher
+    notes_list = default_notes() if notes_list is None else notes_list
+
+    chord_progress = None
+    if progress is not None:
+        def chord_progress(chords: int) -> None:
+            progress(chords, split_number[0] * split_number[1])
+
+    return batch_to_image(musicgen.decode(data, cypher, 'midi', notes_list, chord_progress, workers), split_number)
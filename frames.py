@@ -0,0 +1,245 @@
+import argparse
+import os
+import time
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+
+import conversion
+import musicgen
+from conversion import DEFAULT_OUTPUT_DIR, IMAGE_EXTENSIONS, MUSIC_EXTENSIONS, SPLIT_NUMBER
+from musicgen import midi
+from musicgen.instrumentation import span
+
+"""
+Encoding of image sequences (animation frames, or the frames of a video read with cv2.VideoCapture) and decoding back to
+the frame stack. The frames are read as a stream and their block features are extracted frames_per_batch frames at a
+time: the frames of a batch are stacked on top of each other and reduced by a single block_statistics call, then
+normalized by a single Quantizer call. Every frame is still encoded as its own piece (first chord, progression and end
+cadence), with the same cypher for all of them, so the chords of a frame are the ones of conversion.image_to_music.
+
+The frames are written either as one *.mid file per frame or as the tracks of a single format 1 *.mid file.
+
+Example: python frames.py animation.mp4 -o animation.mid --multi-track
+"""
+
+# Number of frames reduced by a single block_statistics call
+FRAMES_PER_BATCH = 8
+
+FrameSource = Union[str, Sequence[str]]
+
+
+class FrameStats(NamedTuple):
+    """
+    Throughput of an encoded or decoded frame sequence
+    """
+    frames: int
+    blocks: int
+    seconds: float
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.frames / self.seconds if self.seconds else 0.
+
+
+def _sorted_files(directory: str, extensions: Tuple[str, ...]) -> List[str]:
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(extensions))
+
+
+def read_frames(source: FrameSource) -> Iterator[np.ndarray]:
+    """
+    Streams the frames of a video or of a sequence of images, a single frame is decoded at a time
+    :param source: the path of a video file (anything cv2.VideoCapture opens), a directory of images read in name
+    order, or the list of the image files
+    :return: the BGR frames in order
+    """
+    if isinstance(source, str) and os.path.isdir(source):
+        source = _sorted_files(source, IMAGE_EXTENSIONS)
+
+    if not isinstance(source, str):
+        for path in source:
+            with span('image.read'):
+                frame = cv2.imread(path)
+            if frame is None:
+                raise ValueError(f"Could not decode the image {path}")
+            yield frame
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open the video {source}")
+    try:
+        while True:
+            with span('image.read'):
+                success, frame = capture.read()
+            if not success:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def _batch_features(frames: List[np.ndarray], split_number: Tuple[int, int]) -> Tuple[
+        np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Extracts the block features of frames of the same size at once, the frames are stacked vertically so that their
+    blocks come out frame after frame in raster order
+    """
+    stack = np.concatenate([conversion.fit_to_grid(frame, split_number) for frame in frames])
+
+    with span('image.block_statistics'):
+        return conversion.block_statistics(stack, (split_number[0] * len(frames), split_number[1]))
+
+
+def frame_batches(frames: Iterable[np.ndarray], split_number: Tuple[int, int] = SPLIT_NUMBER,
+                  available_notes: Optional[List[str]] = None,
+                  frames_per_batch: int = FRAMES_PER_BATCH) -> Iterator['musicgen.NoteBatch']:
+    """
+    Converts a stream of frames to the notes of each frame, the same as conversion.features_to_batch on the features of
+    each frame
+    :param frames: the frames to convert
+    :param split_number: the number of (rows, cols) blocks to split each frame into
+    :param available_notes: the available notes for the audio conversion to use
+    :param frames_per_batch: the number of frames whose features are extracted at once, a batch is cut short when the
+    size of the frames changes
+    :return: the NoteBatch of each frame, in order
+    """
+    available_notes = conversion.default_notes() if available_notes is None else available_notes
+
+    quantizer = conversion.quantizer(available_notes)
+    blocks = split_number[0] * split_number[1]
+
+    def flush(batch: List[np.ndarray]) -> Iterator['musicgen.NoteBatch']:
+        with span('notes.normalize'):
+            notes = quantizer.quantize(*_batch_features(batch, split_number))
+        for index in range(len(batch)):
+            yield notes[index * blocks:(index + 1) * blocks]
+
+    batch = []
+    for frame in frames:
+        if batch and (len(batch) == frames_per_batch or frame.shape != batch[0].shape):
+            yield from flush(batch)
+            batch = []
+        batch.append(frame)
+
+    if batch:
+        yield from flush(batch)
+
+
+def encode_frames(frames: Iterable[np.ndarray], music_out: str, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                  cypher: Optional['musicgen.rules.Rules'] = None, available_notes: Optional[List[str]] = None,
+                  multi_track: bool = False, frames_per_batch: int = FRAMES_PER_BATCH,
+                  progress: Optional[Callable[[int], None]] = None) -> FrameStats:
+    """
+    Converts a sequence of frames to *.mid files
+    :param frames: the frames to convert, see read_frames
+    :param music_out: the directory to write the frame_00000.mid, frame_00001.mid, ... files in, or the path of the
+    *.mid file with multi_track
+    :param split_number: the number of (rows, cols) blocks to split each frame into
+    :param cypher: It is the cypher used to convert from the music and back, it can't be a Rules object guessing the key
+    :param available_notes: the available notes for the audio conversion to use
+    :param multi_track: write a single *.mid file with one track per frame instead of one file per frame
+    :param frames_per_batch: the number of frames whose features are extracted at once
+    :param progress: called with the number of frames encoded so far
+    :return: the number of frames and blocks encoded and the time it took
+    """
+    cypher = conversion.default_cypher() if cypher is None else cypher
+    available_notes = conversion.default_notes() if available_notes is None else available_notes
+
+    start = time.perf_counter()
+    count = 0
+
+    def tracks() -> Iterator[Iterator[midi.ChordEvent]]:
+        nonlocal count
+        for notes in frame_batches(frames, split_number, available_notes, frames_per_batch):
+            yield musicgen.stream_chord_events([notes], cypher)
+            count += 1
+            if progress is not None:
+                progress(count)
+
+    if multi_track:
+        with open(music_out, 'wb') as file:
+            midi.write_tracks_file(tracks(), file)
+    else:
+        os.makedirs(music_out, exist_ok=True)
+        for index, events in enumerate(tracks()):
+            with open(os.path.join(music_out, f'frame_{index:05d}.mid'), 'wb') as file:
+                midi.write_midi_file(events, file)
+
+    return FrameStats(count, count * split_number[0] * split_number[1], time.perf_counter() - start)
+
+
+def _music_tracks(music_in: FrameSource) -> Iterator[Iterator[midi.ChordEvent]]:
+    """
+    The tracks of every *.mid file of a frame sequence, one track per frame
+    """
+    if isinstance(music_in, str):
+        music_in = _sorted_files(music_in, MUSIC_EXTENSIONS) if os.path.isdir(music_in) else [music_in]
+
+    for path in music_in:
+        yield from midi.read_tracks(path)
+
+
+def decode_frames(music_in: FrameSource, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                  cypher: Optional['musicgen.rules.Cypher'] = None,
+                  notes_list: Optional[List[str]] = None) -> Iterator[np.ndarray]:
+    """
+    Converts the *.mid files written by encode_frames back into the frames they were generated from
+    :param music_in: a multi-track *.mid file, a directory of per frame *.mid files read in name order, or the list of
+    the *.mid files
+    :param split_number: the number of (rows, cols) blocks the frames were split into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param notes_list: the notes that were available for the audio conversion
+    :return: the reconstructed (rows, cols, 3) frames in order, see np.stack to get the frame stack
+    """
+    cypher = conversion.default_cypher() if cypher is None else cypher
+    notes_list = conversion.default_notes() if notes_list is None else notes_list
+
+    quantizer = conversion.quantizer(notes_list)
+
+    for track in _music_tracks(music_in):
+        with span('chords.decode'):
+            events = list(cypher.decode_events(track))
+
+        with span('image.reconstruct'):
+            degrees = quantizer.note_indices([midi.bass_name(event) for event in events])
+            quarter_lengths = np.array([event.quarter_length for event in events], dtype=float)
+            volumes = np.array([event.velocity for event in events], dtype=float)
+            yield quantizer.dequantize(degrees, quarter_lengths, volumes, split_number)
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Converts image sequences and videos to *.mid files and back")
+    parser.add_argument('input', help="video file, directory of images, or with --decode the *.mid file or directory")
+    parser.add_argument('-o', '--output', default=os.path.join(DEFAULT_OUTPUT_DIR, 'frames'),
+                        help="directory of the per frame files, or the *.mid file with --multi-track")
+    parser.add_argument('--decode', action='store_true', help="decode *.mid files back to the frame images")
+    parser.add_argument('--multi-track', action='store_true', help="write a single *.mid file with a track per frame")
+    parser.add_argument('--rows', type=int, default=SPLIT_NUMBER[0], help="number of block rows")
+    parser.add_argument('--cols', type=int, default=SPLIT_NUMBER[1], help="number of block columns")
+    parser.add_argument('--frames-per-batch', type=int, default=FRAMES_PER_BATCH,
+                        help="number of frames whose features are extracted at once")
+    parsed = parser.parse_args(args)
+    split_number = (parsed.rows, parsed.cols)
+
+    if parsed.decode:
+        start = time.perf_counter()
+        os.makedirs(parsed.output, exist_ok=True)
+        count = 0
+        for count, frame in enumerate(decode_frames(parsed.input, split_number), 1):
+            cv2.imwrite(os.path.join(parsed.output, f'frame_{count - 1:05d}.png'), frame)
+        stats = FrameStats(count, count * split_number[0] * split_number[1], time.perf_counter() - start)
+        verb = "Decoded"
+    else:
+        stats = encode_frames(read_frames(parsed.input), parsed.output, split_number, multi_track=parsed.multi_track,
+                              frames_per_batch=parsed.frames_per_batch)
+        verb = "Encoded"
+
+    print(f"{verb} {stats.frames} frames in {stats.seconds:.2f}s ({stats.frames_per_second:.2f} frames/s, "
+          f"{stats.blocks / max(stats.seconds, 1e-9):.0f} blocks/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+import copy
+import os
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import conversion
+import musicgen
+from conversion import SPLIT_NUMBER
+from musicgen import midi
+from musicgen.instrumentation import span
+
+if TYPE_CHECKING:
+    from musicgen.rules import CompiledTriadBaroqueCypher
+
+"""
+Incremental re-encoding of images where only a region changed. Next to the *.mid file, a sidecar keeps the normalized
+notes of every block and, every CHECKPOINT_INTERVAL blocks, the state of the chord progression (the degree of the
+previous chord, all a CompiledTriadBaroqueCypher carries from one chord to the next) and the offset of the chord of the
+block in the MIDI track.
+
+A re-encode compares the new notes with the ones of the sidecar and restarts the progression from the last checkpoint
+before the first changed block. Once past the last changed block, the progression is back on the old path as soon as its
+state is the old one at a checkpoint: the rest of the old track, including its end cadence, is then spliced in as is.
+The *.mid file is the same as the one of a full encode.
+
+Example:
+    music, sidecar = encode_with_sidecar(image)
+    music, sidecar, regenerated = reencode(edited_image, music, sidecar)
+"""
+
+CHECKPOINT_INTERVAL = 256
+
+# Bytes before the body of the track: the MThd chunk and the header of the MTrk chunk
+TRACK_OFFSET = 22
+
+
+class Sidecar:
+    def __init__(self, parameters: str, interval: int, degrees: np.ndarray, quarters: np.ndarray,
+                 velocities: np.ndarray, states: np.ndarray, offsets: np.ndarray):
+        """
+        The checkpoints of an encoded image
+
+        :param parameters: the conversion parameters the *.mid file was encoded with, see conversion_parameters
+        :param interval: the number of blocks between two checkpoints
+        :param degrees: the note index of every block
+        :param quarters: the quarter_length of every block in quarters
+        :param velocities: the MIDI velocity of every block
+        :param states: for every checkpoint, the degree of the chord of the block before it (0 for the first block)
+        :param offsets: for every checkpoint, the offset of the chord of its block in the body of the MIDI track
+        """
+        self.parameters = parameters
+        self.interval = interval
+        self.degrees = np.asarray(degrees, dtype=np.uint8)
+        self.quarters = np.asarray(quarters, dtype=np.uint8)
+        self.velocities = np.asarray(velocities, dtype=np.uint8)
+        self.states = np.asarray(states, dtype=np.uint8)
+        self.offsets = np.asarray(offsets, dtype=np.uint32)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the sidecar to a compressed *.npz file
+        """
+        with open(path, 'wb') as file:
+            np.savez_compressed(file, parameters=np.array(self.parameters), interval=np.array(self.interval),
+                                degrees=self.degrees, quarters=self.quarters, velocities=self.velocities,
+                                states=self.states, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path: str) -> 'Sidecar':
+        """
+        Reads a sidecar written by save
+        """
+        with np.load(path) as data:
+            return cls(str(data['parameters']), int(data['interval']), data['degrees'], data['quarters'],
+                       data['velocities'], data['states'], data['offsets'])
+
+
+def conversion_parameters(split_number: Tuple[int, int], cypher: 'CompiledTriadBaroqueCypher',
+                          available_notes: List[str]) -> str:
+    """
+    Identifies the parameters a sidecar is only valid for
+    """
+    key = cypher.secret_key
+    return repr((tuple(split_number), type(cypher).__qualname__, cypher.version,
+                 f"{key.tonic.nameWithOctave} {key.mode}", tuple(available_notes),
+                 (conversion.min_quarter_length, conversion.max_quarter_length),
+                 (conversion.min_vol, conversion.max_vol)))
+
+
+def _check_cypher(cypher: 'musicgen.rules.Rules') -> None:
+    # Only imported when needed, music21 is slow to import
+    from musicgen.rules import CompiledTriadBaroqueCypher, MultiVoiceTriadBaroqueCypher, RunLengthTriadBaroqueCypher
+
+    if (not isinstance(cypher, CompiledTriadBaroqueCypher) or
+            isinstance(cypher, (RunLengthTriadBaroqueCypher, MultiVoiceTriadBaroqueCypher))):
+        raise ValueError(f"{type(cypher).__name__} can't be re-encoded incrementally, its chords aren't a single "
+                         f"progression whose state is the degree of the previous chord")
+
+
+def _block_notes(image: np.ndarray, split_number: Tuple[int, int], available_notes: List[str]) -> Tuple[
+        'musicgen.NoteBatch', np.ndarray, np.ndarray]:
+    """
+    The notes of every block, with their quarter_lengths in quarters and their MIDI velocities
+    """
+    batch = conversion.features_to_batch(*conversion.split_image_transform(image, split_number), available_notes)
+    quarters = np.rint(batch.quarter_lengths * 4).astype(np.uint8)
+    velocities = np.array(batch.midi_velocities(), dtype=np.uint8)
+    return batch, quarters, velocities
+
+
+def _progression(batch: 'musicgen.NoteBatch', quarters: np.ndarray, velocities: np.ndarray,
+                 cypher: 'CompiledTriadBaroqueCypher', interval: int, start: int, state: int,
+                 old: Optional[Sidecar] = None, last_changed: int = -1) -> Tuple[bytearray, List[int], List[int], int]:
+    """
+    Serializes the chords from the start block (a checkpoint) until the end of the piece, or until the state converges
+    with the old checkpoints past last_changed
+    :param cypher: the cypher of the piece, it is left as it is
+    :param state: the degree of the chord before the start block, unused for the first block
+    :return: the serialized chords (with the end cadence and the end of the track if the state didn't converge), the
+    states and the offsets (relative to the start block) of the checkpoints that were passed, and the index of the
+    checkpoint the state converged on or -1
+    """
+    # The first chord can move the tonic of the key and select another table, like in a full encode. It is computed on
+    # a copy so that the same cypher always gives the same chords.
+    cypher = copy.deepcopy(cypher)
+    first_chord = cypher.first_chord(None, batch.note(0))
+    table = cypher.compiled_table()
+    steps = batch.steps()
+    quarter_lengths = (quarters / 4).tolist()
+    velocities = velocities.tolist()
+
+    out = bytearray()
+    states = []
+    offsets = []
+    degree = state
+    for index in range(start, len(steps)):
+        if index % interval == 0:
+            checkpoint = index // interval
+            if old is not None and index > last_changed and index > start and old.states[checkpoint] == degree:
+                return out, states, offsets, checkpoint
+            states.append(degree if index else 0)
+            offsets.append(len(out))
+
+        if index == 0:
+            event = midi.chord_event(first_chord)
+            degree = cypher.degree(first_chord)
+        else:
+            compiled = table.next_chords[degree - 1][steps[index]]
+            event = midi.ChordEvent(tuple(pitch.midi for pitch in compiled.pitches), quarter_lengths[index],
+                                    velocities[index])
+            degree = compiled.degree
+        midi.append_event(out, event)
+
+    for pitches in table.cadences[degree - 1]:
+        midi.append_event(out, midi.ChordEvent(tuple(pitch.midi for pitch in pitches), 2.0, midi.DEFAULT_VELOCITY))
+    out += midi.track_end()
+
+    return out, states, offsets, -1
+
+
+def encode_with_sidecar(image: np.ndarray, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                        cypher: Optional['CompiledTriadBaroqueCypher'] = None,
+                        available_notes: Optional[List[str]] = None,
+                        interval: int = CHECKPOINT_INTERVAL) -> Tuple[bytes, Sidecar]:
+    """
+    Converts an image to the content of a *.mid file, the same as conversion.encode_image, and records its checkpoints
+    :param image: the image to convert
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param available_notes: the available notes for the audio conversion to use
+    :param interval: the number of blocks between two checkpoints
+    :return: the content of the *.mid file and its sidecar
+    """
+    cypher = conversion.default_cypher() if cypher is None else cypher
+    available_notes = conversion.default_notes() if available_notes is None else available_notes
+
+    _check_cypher(cypher)
+    batch, quarters, velocities = _block_notes(image, split_number, available_notes)
+
+    with span('chords.events'):
+        body, states, offsets, _ = _progression(batch, quarters, velocities, cypher, interval, 0, 0)
+
+    start = midi.track_start()
+    sidecar = Sidecar(conversion_parameters(split_number, cypher, available_notes), interval, batch.degrees, quarters,
+                      velocities, states, np.array(offsets, dtype=np.int64) + len(start))
+
+    return midi.midi_header(1) + midi.track_chunk(start + bytes(body)), sidecar
+
+
+def reencode(image: np.ndarray, music: bytes, sidecar: Sidecar, split_number: Tuple[int, int] = SPLIT_NUMBER,
+             cypher: Optional['CompiledTriadBaroqueCypher'] = None,
+             available_notes: Optional[List[str]] = None) -> Tuple[bytes, Sidecar, int]:
+    """
+    Converts a modified image to the content of a *.mid file, reusing the chords of the blocks that didn't change. The
+    content is the same as the one of encode_with_sidecar.
+    :param image: the image to convert
+    :param music: the content of the *.mid file of the previous version of the image, written by encode_with_sidecar or
+    reencode
+    :param sidecar: the sidecar of the previous *.mid file
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param available_notes: the available notes for the audio conversion to use
+    :return: the content of the *.mid file, its sidecar and the number of blocks whose chords were generated again
+    """
+    cypher = conversion.default_cypher() if cypher is None else cypher
+    available_notes = conversion.default_notes() if available_notes is None else available_notes
+
+    _check_cypher(cypher)
+    if sidecar.parameters != conversion_parameters(split_number, cypher, available_notes):
+        music, sidecar = encode_with_sidecar(image, split_number, cypher, available_notes, sidecar.interval)
+        return music, sidecar, split_number[0] * split_number[1]
+
+    batch, quarters, velocities = _block_notes(image, split_number, available_notes)
+
+    changed = np.flatnonzero((batch.degrees != sidecar.degrees) | (quarters != sidecar.quarters) |
+                             (velocities != sidecar.velocities))
+    if not len(changed):
+        return music, sidecar, 0
+
+    interval = sidecar.interval
+    first = changed[0] // interval
+    start = first * interval
+    old_body = music[TRACK_OFFSET:]
+
+    with span('chords.events'):
+        body, states, offsets, converged = _progression(batch, quarters, velocities, cypher, interval, start,
+                                                        int(sidecar.states[first]), sidecar, int(changed[-1]))
+
+    prefix = int(sidecar.offsets[first])
+    new_offsets = np.array(offsets, dtype=np.int64) + prefix
+    if converged >= 0:
+        # The offsets of the spliced chords move by the difference in length of the regenerated ones
+        shift = prefix + len(body) - int(sidecar.offsets[converged])
+        body += old_body[sidecar.offsets[converged]:]
+        states += sidecar.states[converged:].tolist()
+        new_offsets = np.concatenate((new_offsets, sidecar.offsets[converged:].astype(np.int64) + shift))
+        regenerated = converged * interval - start
+    else:
+        regenerated = len(batch) - start
+
+    sidecar = Sidecar(sidecar.parameters, interval, batch.degrees, quarters, velocities,
+                      np.concatenate((sidecar.states[:first], states)),
+                      np.concatenate((sidecar.offsets[:first].astype(np.int64), new_offsets)))
+
+    return midi.midi_header(1) + midi.track_chunk(old_body[:prefix] + bytes(body)), sidecar, regenerated
+
+
+def sidecar_path(music_path: str) -> str:
+    """
+    Where the sidecar of a *.mid file is written
+    """
+    return music_path + '.checkpoints.npz'
+
+
+def convert_image_file(image_in: str, music_out: str, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                       cypher: Optional['CompiledTriadBaroqueCypher'] = None,
+                       available_notes: Optional[List[str]] = None, interval: int = CHECKPOINT_INTERVAL) -> int:
+    """
+    Same as conversion.convert_image_file, but when music_out and its sidecar already exist, the image is re-encoded
+    incrementally from them. The sidecar is written next to music_out.
+    :param image_in: the image file to read
+    :param music_out: where to write the generated *.mid file
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param cypher: It is the cypher used to convert from the music and back
+    :param available_notes: the available notes for the audio conversion to use
+    :param interval: the number of blocks between two checkpoints of a new sidecar
+    :return: the number of blocks whose chords were generated
+    """
+    cypher = conversion.default_cypher() if cypher is None else cypher
+    available_notes = conversion.default_notes() if available_notes is None else available_notes
+
+    with span('image.read'):
+        image = cv2.imread(image_in)
+
+    if os.path.exists(music_out) and os.path.exists(sidecar_path(music_out)):
+        with open(music_out, 'rb') as file:
+            music = file.read()
+        music, sidecar, regenerated = reencode(image, music, Sidecar.load(sidecar_path(music_out)), split_number,
+                                               cypher, available_notes)
+    else:
+        music, sidecar = encode_with_sidecar(image, split_number, cypher, available_notes, interval)
+        regenerated = split_number[0] * split_number[1]
+
+    conversion.write_music(music, music_out)
+    sidecar.save(sidecar_path(music_out))
+
+    return regenerated
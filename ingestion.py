@@ -0,0 +1,135 @@
+import io
+import struct
+from typing import BinaryIO, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+import conversion
+from conversion import SPLIT_NUMBER
+from musicgen.instrumentation import span
+
+"""
+Ingestion of images much larger than the grid they are converted with. The size of the image is read from its header,
+and the image is decoded at the smallest of the reduced resolutions of OpenCV (1/2, 1/4 or 1/8, IMREAD_REDUCED_*) that
+still leaves min_block_size pixels per block in each direction. JPEG images are decoded straight at the reduced
+resolution (DCT scaling), so their decode time and memory depend on the reduced resolution only. PNG images are decoded
+in full by OpenCV and only then reduced, the reduced decode saves them nothing but the block statistics.
+
+The memory is not bounded by the bands either: the decoded image is resized to the grid as a whole (see
+conversion.block_rows), so the reduced image and its resized copy are both held, only the block statistics are
+computed a band of block rows at a time.
+
+The features are not the same as the ones of conversion.split_image_transform on the full image, see
+read_image_for_grid, so the reduced decode is opt-in.
+"""
+
+# Minimum number of pixels per block, in each direction, kept by the reduced decode
+MIN_BLOCK_SIZE = 8
+
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+ImageSource = Union[str, bytes]
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG start of frame markers, the ones holding the size of the image
+JPEG_FRAMES = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(file: BinaryIO) -> Optional[Tuple[int, int]]:
+    """
+    Walks the segments of a JPEG file up to its start of frame
+    """
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:  # Segments without a length
+            continue
+
+        length = struct.unpack('>H', file.read(2))[0]
+        if marker[1] in JPEG_FRAMES:
+            _, height, width = struct.unpack('>BHH', file.read(5))
+            return height, width
+        file.seek(length - 2, io.SEEK_CUR)
+
+
+def image_size(source: ImageSource) -> Optional[Tuple[int, int]]:
+    """
+    Reads the size of a PNG or JPEG image from its header, without decoding it
+    :param source: the path of the image or its content
+    :return: the (height, width) of the image, None for the other formats
+    """
+    file = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else open(source, 'rb')
+    with file:
+        start = file.read(24)
+        if start.startswith(PNG_SIGNATURE) and start[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', start[16:24])
+            return height, width
+        if start.startswith(b'\xff\xd8'):
+            file.seek(0)
+            try:
+                return _jpeg_size(file)
+            except struct.error:
+                return None
+    return None
+
+
+def reduction_factor(size: Tuple[int, int], split_number: Tuple[int, int] = SPLIT_NUMBER,
+                     min_block_size: int = MIN_BLOCK_SIZE) -> int:
+    """
+    Picks the strongest reduction of the decode that keeps min_block_size pixels per block
+    :param size: the (height, width) of the full image
+    :param split_number: the number of (rows, cols) blocks the image is split into
+    :param min_block_size: the minimum number of pixels per block in each direction
+    :return: 8, 4, 2 or 1 for the full resolution
+    """
+    for factor, _ in REDUCED_FLAGS:
+        if (size[0] // factor // split_number[0] >= min_block_size and
+                size[1] // factor // split_number[1] >= min_block_size):
+            return factor
+    return 1
+
+
+def read_image_for_grid(source: ImageSource, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                        min_block_size: int = MIN_BLOCK_SIZE) -> np.ndarray:
+    """
+    Decodes an image at the lowest resolution suited to the grid it is converted with. The features of the blocks
+    differ from the ones of the full image by a few units on average, but by much more on some blocks with fine detail:
+    at 16x16 blocks (decoded at 1/4), the mean difference is 1-1.4 out of 255 (max 12) on images/Mona_Lisa.jpg and
+    2.3-3.6 (max 173) on images/7efe398a7a931b2a4e0298285492b1d0.png.
+    :param source: the path of the image or its content
+    :param split_number: the number of (rows, cols) blocks the image is split into
+    :param min_block_size: the minimum number of pixels per block in each direction
+    :return: the decoded BGR image
+    """
+    size = image_size(source)
+    factor = 1 if size is None else reduction_factor(size, split_number, min_block_size)
+    flag = dict(REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+
+    with span('image.read'):
+        if isinstance(source, (bytes, bytearray)):
+            image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+        else:
+            image = cv2.imread(source, flag)
+
+    if image is None:
+        raise ValueError("Could not decode the image")
+    return image
+
+
+def ingest_features(source: ImageSource, split_number: Tuple[int, int] = SPLIT_NUMBER, rows_per_chunk: int = 8,
+                    min_block_size: int = MIN_BLOCK_SIZE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Same as conversion.split_image_transform for an image file, decoded with read_image_for_grid. The block statistics
+    are computed a band of rows_per_chunk block rows at a time, but the whole decoded image is resized to the grid first
+    :param source: the path of the image or its content
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param rows_per_chunk: the number of rows of blocks reduced at once
+    :param min_block_size: the minimum number of pixels per block in each direction
+    :return: the three raw extracted features: the notes, the quarter_length and the volume
+    """
+    image = read_image_for_grid(source, split_number, min_block_size)
+    chunks = list(conversion.block_rows(image, split_number, rows_per_chunk))
+
+    return tuple(np.concatenate([chunk[channel] for chunk in chunks]) for channel in range(3))
@@ -1,33 +1,60 @@
-from music21.key import Key
-
-Cb_MAJOR = Key("C-")
-Gb_MAJOR = Key("G-")
-Db_MAJOR = Key("D-")
-Ab_MAJOR = Key("A-")
-Eb_MAJOR = Key("E-")
-Bb_MAJOR = Key("B-")
-F_MAJOR = Key("F")
-C_MAJOR = Key("C")
-G_MAJOR = Key("G")
-D_MAJOR = Key("D")
-A_MAJOR = Key("A")
-E_MAJOR = Key("E")
-B_MAJOR = Key("B")
-Fs_MAJOR = Key("F#")
-Cs_MAJOR = Key("C#")
-
-Ab_MINOR = Key("a-")
-Eb_MINOR = Key("e-")
-Bb_MINOR = Key("b-")
-F_MINOR = Key("f")
-C_MINOR = Key("c")
-G_MINOR = Key("g")
-D_MINOR = Key("d")
-A_MINOR = Key("a")
-E_MINOR = Key("e")
-B_MINOR = Key("b")
-Fs_MINOR = Key("f#")
-Cs_MINOR = Key("c#")
-Gs_MINOR = Key("g#")
-Ds_MINOR = Key("d#")
-As_MINOR = Key("a#")
+from typing import Any, Dict, List
+
+"""
+The major and minor keys by name (A_MINOR, Fs_MAJOR, ...). The music21 Keys are only built on first access, see
+__getattr__, so importing this module does not import music21.
+"""
+
+# Key name -> music21 name of the key (upper case tonic for the major keys, lower case for the minor ones)
+KEY_NAMES: Dict[str, str] = {
+    'Cb_MAJOR': 'C-',
+    'Gb_MAJOR': 'G-',
+    'Db_MAJOR': 'D-',
+    'Ab_MAJOR': 'A-',
+    'Eb_MAJOR': 'E-',
+    'Bb_MAJOR': 'B-',
+    'F_MAJOR': 'F',
+    'C_MAJOR': 'C',
+    'G_MAJOR': 'G',
+    'D_MAJOR': 'D',
+    'A_MAJOR': 'A',
+    'E_MAJOR': 'E',
+    'B_MAJOR': 'B',
+    'Fs_MAJOR': 'F#',
+    'Cs_MAJOR': 'C#',
+
+    'Ab_MINOR': 'a-',
+    'Eb_MINOR': 'e-',
+    'Bb_MINOR': 'b-',
+    'F_MINOR': 'f',
+    'C_MINOR': 'c',
+    'G_MINOR': 'g',
+    'D_MINOR': 'd',
+    'A_MINOR': 'a',
+    'E_MINOR': 'e',
+    'B_MINOR': 'b',
+    'Fs_MINOR': 'f#',
+    'Cs_MINOR': 'c#',
+    'Gs_MINOR': 'g#',
+    'Ds_MINOR': 'd#',
+    'As_MINOR': 'a#',
+}
+
+__all__ = list(KEY_NAMES)
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Builds a Key on first access, it is then cached in the module
+    """
+    if name not in KEY_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    from music21.key import Key
+
+    key = globals()[name] = Key(KEY_NAMES[name])
+    return key
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(KEY_NAMES))
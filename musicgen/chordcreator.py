@@ -1,29 +1,68 @@
-from typing import List
+from typing import Iterator, List, Optional, Tuple, Union
 
 from music21.chord import Chord
 from music21.key import Key
 from music21.note import Note
 from music21.stream import Stream
 
-from musicgen.rules import Rules, TriadBaroque
+from musicgen.instrumentation import span
+from musicgen.keyanalysis import analyze_key
+from musicgen.midi import ChordEvent, DEFAULT_VELOCITY, append_event, chord_event, midi_velocity, track_end, track_start
+from musicgen.notebatch import NoteBatch
+from musicgen.parallel import degree_path, serialize_progression
+from musicgen.rules import CompiledTriadBaroqueCypher, Rules, STEPS, TriadBaroque
 
 
 class ChordCreator:
-    def __init__(self, input_notes: List[Note]):
+    def __init__(self, input_notes: Union[List[Note], NoteBatch]):
         """
         ChordCreator is a utility class that can supply a Rules instance with a key and notes to create chords out of.
 
-        :param input_notes: A list of music21.note.Note objects. Chords get fitted to these Notes.
+        :param input_notes: A list of music21.note.Note objects or a NoteBatch. Chords get fitted to these Notes. The
+        Notes of a NoteBatch are only created if the Rules need them.
         """
-        self.input_notes: List[Note] = input_notes
+        self.batch: Optional[NoteBatch] = input_notes if isinstance(input_notes, NoteBatch) else None
+        self._input_notes: Optional[List[Note]] = None if self.batch is not None else input_notes
 
-        self.input_stream: Stream = Stream()
-        for note in input_notes:
-            self.input_stream.append(note)
-        self.key: Key = self.input_stream.analyze('key')
+        # The key is only analyzed if a Rules object needs it, see the key property
+        self._key: Optional[Key] = None
 
-        # print(
-        #     f"Guessed key: {self.key}, Confidence: {self.key.correlationCoefficient}, Other possible keys: {self.key.alternateInterpretations}")
+    @property
+    def input_notes(self) -> List[Note]:
+        """
+        The input Notes, created on first access when the input is a NoteBatch.
+        """
+        if self._input_notes is None:
+            self._input_notes = list(self.batch.notes())
+        return self._input_notes
+
+    @property
+    def input_stream(self) -> Stream:
+        """
+        A Stream of the input notes.
+        """
+        stream = Stream()
+        for note in self.input_notes:
+            stream.append(note)
+        return stream
+
+    @property
+    def key(self) -> Key:
+        """
+        The guessed key of the input notes. It is analyzed on first access, with musicgen.keyanalysis.
+        """
+        if self._key is None:
+            with span('chords.key_analysis'):
+                self._key = analyze_key(self.input_notes)
+        return self._key
+
+    def _key_for(self, rules: Rules) -> Optional[Key]:
+        """
+        The key to hand to the Rules object, None if it doesn't use it (Cyphers use their own secret key).
+        """
+        if rules.uses_key:
+            return self.key
+        return None
 
     def chordify(self, rules: Rules = TriadBaroque()) -> Stream:
         """
@@ -32,12 +71,126 @@ class ChordCreator:
         generates triads based on the rules from the Baroque period.
         :return: A flat music21.stream.Stream that contains the Chords.
         """
-        stream = Stream()
-        prev_chord: Chord = rules.first_chord(self.key, self.input_notes[0])
-        stream.append(prev_chord)
-        for note in self.input_notes[1:]:
-            prev_chord = rules.next_chord(self.key, prev_chord, note)
+        key = self._key_for(rules)
+
+        with span('chords.chordify'):
+            stream = Stream()
+            prev_chord: Chord = rules.first_chord(key, self.input_notes[0])
             stream.append(prev_chord)
-        stream.append(rules.end_cadence(self.key, prev_chord))
+            for note in self.input_notes[1:]:
+                prev_chord = rules.next_chord(key, prev_chord, note)
+                stream.append(prev_chord)
+            stream.append(rules.end_cadence(key, prev_chord))
+
+            return stream.flat
+
+    def chord_events(self, rules: Rules = TriadBaroque()) -> Iterator[ChordEvent]:
+        """
+        Same as chordify, but the Chords are reduced to ChordEvents as they are generated instead of being collected
+        into a Stream. Used to write *.mid files directly, without building a music21 Stream.
+        :param rules: A Rules object that determines how the Chords are fitted.
+        :return: The ChordEvents of the generated Chords, followed by the ones of the end cadence.
+        """
+        key = self._key_for(rules)
+
+        prev_chord: Chord = rules.first_chord(key, self.input_notes[0])
+        yield chord_event(prev_chord)
+        for note in self.input_notes[1:]:
+            prev_chord = rules.next_chord(key, prev_chord, note)
+            yield chord_event(prev_chord)
+        for chord in rules.end_cadence(key, prev_chord).getElementsByClass(Chord):
+            yield chord_event(chord)
+
+    def _compiled_progression(self, rules: CompiledTriadBaroqueCypher) -> Tuple[Chord, bytes, bytes, int]:
+        """
+        Generates the first Chord and walks the table of the compiled cypher over the following notes, see
+        musicgen.parallel.
+        :return: The first Chord, the degree of the Chord before each following note, the step of each following note
+        and the degree of the last Chord.
+        """
+        if self.batch is not None:
+            first_chord = rules.first_chord(None, self.batch.note(0))
+            steps = self.batch.steps()[1:]
+        else:
+            first_chord = rules.first_chord(None, self.input_notes[0])
+            steps = bytes(STEPS.index(note.step) for note in self.input_notes[1:])
+        first_degree = rules.degree(first_chord)
+
+        with span('chords.progression'):
+            path = degree_path(rules.compiled_table().next_degrees, first_degree, steps)
+
+        return first_chord, bytes([first_degree]) + path[:-1], steps, path[-1] if path else first_degree
+
+    def _following_notes(self) -> Tuple[List[float], List[int]]:
+        """
+        The quarter_lengths and the MIDI velocities of the notes following the first one
+        """
+        if self.batch is not None:
+            return self.batch.quarter_lengths[1:].tolist(), self.batch.midi_velocities()[1:]
+        return ([float(note.quarterLength) for note in self.input_notes[1:]],
+                [midi_velocity(note.volume) for note in self.input_notes[1:]])
+
+    def chordify_compiled(self, rules: CompiledTriadBaroqueCypher) -> Stream:
+        """
+        Same as chordify, but the Chords after the first one are built straight from the table of the compiled cypher.
+        Only the CompiledTriadBaroqueCypher can be used, as its state is only the degree of the previous Chord.
+        :param rules: The compiled cypher that determines how the Chords are fitted.
+        :return: A flat music21.stream.Stream that contains the Chords, identical to the one of chordify.
+        """
+        first_chord, previous_degrees, steps, _ = self._compiled_progression(rules)
+        table = rules.compiled_table()
+
+        with span('chords.chordify'):
+            stream = Stream()
+            stream.append(first_chord)
+            prev_chord = first_chord
+            for index, (degree, step) in enumerate(zip(previous_degrees, steps), 1):
+                note = self.batch.note(index) if self.batch is not None else self.input_notes[index]
+                prev_chord = rules.chord_from(table.next_chords[degree - 1][step], note)
+                stream.append(prev_chord)
+            stream.append(rules.end_cadence(None, prev_chord))
+
+            return stream.flat
+
+    def chord_events_compiled(self, rules: CompiledTriadBaroqueCypher) -> Iterator[ChordEvent]:
+        """
+        Same as chord_events, with the Chords following the first one looked up in the table of the compiled cypher like
+        in chordify_compiled. No Chord is built after the first one, the ChordEvents come straight from the table.
+        :param rules: The compiled cypher that determines how the Chords are fitted.
+        :return: The ChordEvents of the generated Chords, followed by the ones of the end cadence.
+        """
+        first_chord, previous_degrees, steps, last_degree = self._compiled_progression(rules)
+        pitches = rules.compiled_table().next_pitches
+        quarter_lengths, velocities = self._following_notes()
+
+        yield chord_event(first_chord)
+        for degree, step, quarter_length, velocity in zip(previous_degrees, steps, quarter_lengths, velocities):
+            yield ChordEvent(pitches[degree - 1][step], quarter_length, velocity)
+        for cadence in rules.compiled_table().cadences[last_degree - 1]:
+            yield ChordEvent(tuple(pitch.midi for pitch in cadence), 2.0, DEFAULT_VELOCITY)
+
+    def track_body(self, rules: CompiledTriadBaroqueCypher, workers: Optional[int] = 1,
+                   chunk_size: int = 16384) -> bytes:
+        """
+        Serializes the events of chord_events_compiled as the body of a MIDI track, the chords are serialized over a
+        pool of worker processes (see musicgen.parallel.serialize_progression).
+        :param rules: The compiled cypher that determines how the Chords are fitted.
+        :param workers: The number of worker processes, None for the number of CPUs, 1 to serialize the Chords in the
+        calling process.
+        :param chunk_size: The number of notes serialized by a worker at once.
+        :return: The track body, the same as midi.track_events of chord_events_compiled.
+        """
+        first_chord, previous_degrees, steps, last_degree = self._compiled_progression(rules)
+        table = rules.compiled_table()
+        quarter_lengths, velocities = self._following_notes()
+
+        with span('midi.write'):
+            out = bytearray(track_start())
+            append_event(out, chord_event(first_chord))
+            out += serialize_progression(table.next_pitches, previous_degrees, steps, quarter_lengths, velocities,
+                                         workers, chunk_size)
+            for cadence in table.cadences[last_degree - 1]:
+                append_event(out, ChordEvent(tuple(pitch.midi for pitch in cadence), 2.0, DEFAULT_VELOCITY))
+            out += track_end()
 
-        return stream.flat
+        return bytes(out)
@@ -0,0 +1,280 @@
+from itertools import repeat
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from music21 import converter
+from music21.key import Key
+from music21.note import Note
+from music21.stream import Part, Score, Stream
+
+from musicgen import instrumentation, midi
+from musicgen.chordcreator import ChordCreator
+from musicgen.instrumentation import span
+from musicgen.notebatch import NoteBatch, key_letters
+from musicgen.rules import (Rules, TriadBaroque, TriadBaroqueCypher, CompiledTriadBaroqueCypher, Cypher,
+                            MultiVoiceTriadBaroqueCypher, RunLengthTriadBaroqueCypher)
+
+"""
+Fits chord progressions to notes (create_chords) and recovers the notes from the chords (decode), the functions exported
+by the musicgen package.
+"""
+
+# Number of chords between two progress reports
+PROGRESS_INTERVAL = 1024
+
+NoteIdentifier = Union[Tuple[str, Union[float, int]], Tuple[str, Union[float, int], float]]
+
+
+def create_chords(notes_in: Union[List[NoteIdentifier], NoteBatch], ruleset: Rules = TriadBaroque(),
+                  backend: str = 'music21', workers: int = 1) -> Union[Stream, bytes]:
+    """
+    Creates the Stream of Chords made with the input notes. Notes are represented as (name, quarterLength) or
+    (name, quarterLength, volumes) pairs, or by a NoteBatch.
+
+    By default, the key is guessed.
+    :param notes_in: A list of note identifiers or a NoteBatch that will be converted into
+    :param ruleset: A Rules object that determines how the Chords are fitted. Defaults to a Rules object that generates
+    triads based on the rules from the Baroque period.
+    :param backend: 'music21' to return a Stream of the Chords, 'midi' to directly return the content of the *.mid file
+    without building a Stream (see musicgen.midi).
+    :param workers: The number of processes serializing the chords to the *.mid file. The chords are always chosen in
+    the calling process, only their serialization with the 'midi' backend runs in parallel (see musicgen.parallel), for
+    a CompiledTriadBaroqueCypher or a MultiVoiceTriadBaroqueCypher. More than one worker raises a ValueError otherwise,
+    see parallel_chords. The output is the same as with a single worker.
+    :return: A Stream containing the generated Chords, or the bytes of the *.mid file with the 'midi' backend.
+    """
+    if workers != 1 and not parallel_chords(ruleset, backend):
+        raise ValueError(f"The chords of a {type(ruleset).__name__} with the {backend!r} backend are only created in "
+                         f"the calling process, use a single worker")
+
+    if isinstance(ruleset, RunLengthTriadBaroqueCypher):
+        return _create_runs(notes_in, ruleset, backend)
+    if isinstance(ruleset, MultiVoiceTriadBaroqueCypher):
+        return _create_voices(notes_in, ruleset, backend, workers)
+
+    if isinstance(notes_in, NoteBatch):
+        chord_creator = ChordCreator(notes_in)
+    else:
+        with span('chords.notes'):
+            notes_out: List[Note] = []
+            for note in notes_in:
+                note_out = Note(note[0])
+                note_out.quarterLength = note[1]
+                if len(note) == 3:
+                    note_out.volume = note[2]
+
+                notes_out.append(note_out)
+
+        chord_creator = ChordCreator(notes_out)
+
+    if isinstance(ruleset, CompiledTriadBaroqueCypher):
+        # A NoteBatch written directly to midi never creates a Note object past the first one
+        if backend == 'midi' and (workers != 1 or chord_creator.batch is not None):
+            return midi.midi_header(1) + midi.track_chunk(chord_creator.track_body(ruleset, workers))
+
+    if backend == 'midi':
+        return _write_events(chord_creator.chord_events(ruleset))
+
+    return chord_creator.chordify(ruleset)
+
+
+def parallel_chords(ruleset: Rules, backend: str) -> bool:
+    """
+    Whether create_chords can use more than one worker
+    :param ruleset: the Rules the Chords are fitted with
+    :param backend: the backend of create_chords
+    :return: whether the chords are serialized over the workers, only for the 'midi' backend and a
+    CompiledTriadBaroqueCypher (but not a RunLengthTriadBaroqueCypher, whose runs are folded serially) or a
+    MultiVoiceTriadBaroqueCypher
+    """
+    return (backend == 'midi' and isinstance(ruleset, CompiledTriadBaroqueCypher) and
+            not isinstance(ruleset, RunLengthTriadBaroqueCypher))
+
+
+def _create_runs(notes_in: Union[List[NoteIdentifier], NoteBatch], ruleset: RunLengthTriadBaroqueCypher,
+                 backend: str) -> Union[Stream, bytes]:
+    """
+    create_chords for a RunLengthTriadBaroqueCypher, the chords are only generated for the first note of each run
+    """
+    if not isinstance(notes_in, NoteBatch):
+        notes_in = NoteBatch.from_identifiers(notes_in)
+
+    with span('chords.runs'):
+        heads, counts = notes_in.runs(ruleset.max_run)
+    chord_creator = ChordCreator(heads)
+
+    if backend == 'midi':
+        return _write_events(ruleset.mark_runs(chord_creator.chord_events_compiled(ruleset), iter(counts.tolist())))
+
+    return ruleset.mark_chords(chord_creator.chordify(ruleset), counts.tolist())
+
+
+def _create_voices(notes_in: Union[List[NoteIdentifier], NoteBatch], ruleset: MultiVoiceTriadBaroqueCypher,
+                   backend: str, workers: int) -> Union[Stream, bytes]:
+    """
+    create_chords for a MultiVoiceTriadBaroqueCypher, every voice is generated like a piece of its own
+    """
+    if not isinstance(notes_in, NoteBatch):
+        notes_in = NoteBatch.from_identifiers(notes_in)
+    voices = [ChordCreator(notes_in[start:end]) for start, end in ruleset.voice_bounds(len(notes_in))]
+
+    if backend == 'midi':
+        bodies = [voice.track_body(ruleset, workers) for voice in voices]
+        return midi.midi_header(len(bodies)) + b''.join(midi.track_chunk(body) for body in bodies)
+
+    score = Score()
+    for voice in voices:
+        chords = voice.chordify(ruleset)
+        part = Part()
+        part.append(list(chords.elements))
+        score.insert(0, part)
+
+    return score
+
+
+def _write_events(events: Iterable[midi.ChordEvent]) -> bytes:
+    """
+    Serializes the chord events as they are generated. When the spans are timed, all the events are generated first so
+    that the two stages are timed separately.
+    """
+    if instrumentation.enabled():
+        with span('chords.events'):
+            events = list(events)
+    with span('midi.write'):
+        return midi.write_midi(events)
+
+
+def decode(music_in: midi.MidiSource, cypher: Cypher, backend: str = 'music21', names: Optional[List[str]] = None,
+           progress: Optional[Callable[[int], None]] = None, workers: int = 1) -> NoteBatch:
+    """
+    Extracts from a *.md file the notes and it's associated information
+    :param music_in: the music file to extract the infromation from
+    :param cypher: the cypher to use to decode the file
+    :param backend: 'music21' to parse the file with music21, 'midi' to stream its note events (see decode_arrays)
+    :param names: the note names the NoteBatch refers to, the notes are matched on their letter. Defaults to the letters
+    of the secret key of the cypher.
+    :param progress: with the 'midi' backend, called with the number of chords decoded so far, see decode_arrays
+    :param workers: with the 'midi' backend, the number of processes decoding the voices of a
+    MultiVoiceTriadBaroqueCypher, see decode_arrays
+    :return: a NoteBatch of the associated note, quarter_length and volume
+    """
+    if names is None:
+        names = key_letters(cypher.secret_key)
+
+    if backend == 'midi':
+        note_names, quarter_lengths, volumes = decode_arrays(music_in, cypher, progress, workers)
+    else:
+        with span('midi.parse'):
+            stream: Stream = converter.parse(music_in)
+        with span('chords.decode'):
+            # The voices are the Parts of the Score, they can't be flattened together
+            notes = cypher.decode(stream if isinstance(cypher, MultiVoiceTriadBaroqueCypher) else stream.flat)
+
+        note_names = [note.name for note in notes]
+        quarter_lengths = [float(note.quarterLength) for note in notes]
+        volumes = [float(note.volume.velocity) for note in notes]
+
+    return _note_batch(note_names, quarter_lengths, volumes, names)
+
+
+def _note_batch(note_names: Iterable[str], quarter_lengths: Iterable[float], volumes: Iterable[float],
+                names: List[str]) -> NoteBatch:
+    # A letter listed twice maps to its first index, like list.index
+    index = {name: degree for degree, name in reversed(list(enumerate(names)))}
+    degrees = [index[name[0]] for name in note_names]
+
+    return NoteBatch(degrees, quarter_lengths, volumes, names)
+
+
+def decode_batches(music_in: midi.MidiSource, cypher: TriadBaroqueCypher, names: Optional[List[str]] = None,
+                   chunk_size: int = PROGRESS_INTERVAL) -> Iterator[NoteBatch]:
+    """
+    Streaming version of decode with the 'midi' backend, the notes are returned as soon as their chords are parsed
+    :param music_in: the music file to extract the information from, its path or its content
+    :param cypher: the cypher to use to decode the file
+    :param names: the note names the NoteBatches refer to, see decode
+    :param chunk_size: the number of notes of each NoteBatch, the last one can be shorter
+    :return: the NoteBatch of each chunk of notes, in order
+    """
+    if names is None:
+        names = key_letters(cypher.secret_key)
+
+    def flush(events: List[midi.ChordEvent]) -> NoteBatch:
+        return _note_batch([midi.bass_name(event) for event in events], [event.quarter_length for event in events],
+                           [event.velocity for event in events], names)
+
+    chunk = []
+    for event in cypher.decode_tracks(midi.read_tracks(music_in)):
+        chunk.append(event)
+        if len(chunk) == chunk_size:
+            yield flush(chunk)
+            chunk = []
+
+    if chunk:
+        yield flush(chunk)
+
+
+def _voice_events(data: bytes, track: int, cypher: MultiVoiceTriadBaroqueCypher) -> List[midi.ChordEvent]:
+    """
+    Decodes a single track of a *.mid file, in a worker process
+    """
+    return list(cypher.decode_events(midi.read_tracks(data)[track]))
+
+
+def _parallel_events(music_in: midi.MidiSource, cypher: MultiVoiceTriadBaroqueCypher,
+                     workers: int) -> Iterable[midi.ChordEvent]:
+    """
+    Decodes the voices of a *.mid file over a pool of worker processes, in track order
+    """
+    # Only imported when needed, like in musicgen.parallel
+    from concurrent.futures import ProcessPoolExecutor
+
+    data = midi.read_source(music_in)
+    tracks = len(midi.read_tracks(data))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for events in executor.map(_voice_events, repeat(data), range(tracks), repeat(cypher)):
+            yield from events
+
+
+def decode_arrays(music_in: midi.MidiSource, cypher: TriadBaroqueCypher,
+                  progress: Optional[Callable[[int], None]] = None,
+                  workers: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Faster version of decode that streams the note events of the *.mid file instead of parsing it with music21. Works
+    with any *.mid file, including the ones written through music21.
+    :param music_in: the music file to extract the information from, its path or its content
+    :param cypher: the cypher to use to decode the file
+    :param progress: called with the number of chords decoded so far every PROGRESS_INTERVAL chords and at the end,
+    it can stop the decoding by raising an exception
+    :param workers: the number of processes decoding the voices of a MultiVoiceTriadBaroqueCypher, one track each. The
+    other cyphers are decoded in the calling process.
+    :return: the note names, the quarter_lengths and the volumes of the encoded notes
+    """
+    names = []
+    quarter_lengths = []
+    volumes = []
+    # The file is read and decoded in a single streaming pass
+    if workers > 1 and isinstance(cypher, MultiVoiceTriadBaroqueCypher):
+        events = _parallel_events(music_in, cypher, workers)
+    else:
+        events = cypher.decode_tracks(midi.read_tracks(music_in))
+
+    with span('chords.decode'):
+        for event in events:
+            names.append(midi.bass_name(event))
+            quarter_lengths.append(event.quarter_length)
+            volumes.append(event.velocity)
+            if progress is not None and len(names) % PROGRESS_INTERVAL == 0:
+                progress(len(names))
+
+    if progress is not None:
+        progress(len(names))
+
+    return np.array(names), np.array(quarter_lengths, dtype=float), np.array(volumes, dtype=float)
+
+
+if __name__ == '__main__':
+    test_cypher = TriadBaroqueCypher(Key('a'))
+    test = create_chords([("B", 1, 10), ("F", 1), ("A", 1), ("G#", 1), ("D", 1, 10), ("C", 1.0), ("B", 1), ("E", 1)],
+                         TriadBaroqueCypher(Key('a')))
+    print(test_cypher.decode(test))
@@ -0,0 +1,159 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Sequence
+
+if TYPE_CHECKING:
+    import cProfile
+
+"""
+Named timing spans around the stages of a conversion (reading the image, extracting its features, analyzing the key,
+generating the chords, writing the *.mid file, ...). The durations are sent to the listeners registered with
+add_listener, for instance a LatencyHistogram per stage. Without any listener, span returns a shared no-op context
+manager, so the spans can stay in the code.
+
+    histograms = LatencyHistogram()
+    add_listener(histograms)
+    ...
+    histograms.snapshot()['chords.chordify']
+
+profile runs a single conversion under cProfile.
+"""
+
+Listener = Callable[[str, float], None]
+
+_listeners: List[Listener] = []
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *_) -> None:
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_) -> None:
+        duration = time.perf_counter() - self.start
+        for listener in tuple(_listeners):
+            listener(self.name, duration)
+
+
+def span(name: str):
+    """
+    Times the code of a with block
+    :param name: the name of the stage, dotted names group the stages ('image.resize', 'chords.chordify', ...)
+    :return: the context manager of the span
+    """
+    if not _listeners:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def add_listener(listener: Listener) -> None:
+    """
+    Registers a callback called with the name and the duration in seconds of every span that ends
+    :param listener: the callback, it is called from the thread that ran the span
+    """
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Listener) -> None:
+    """
+    Unregisters a callback registered with add_listener, the spans stop being timed once there are no listeners left
+    """
+    _listeners.remove(listener)
+
+
+def enabled() -> bool:
+    """
+    :return: whether the spans are timed
+    """
+    return bool(_listeners)
+
+
+# Upper bounds of the latency buckets in seconds, the last bucket is unbounded
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        A listener that counts the durations of each span in latency buckets, the cumulative layout used by the
+        Prometheus histograms.
+
+        :param buckets: the increasing upper bounds of the buckets in seconds
+        """
+        self.buckets = tuple(buckets)
+        self._counts: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, name: str, duration: float) -> None:
+        with self._lock:
+            if name not in self._counts:
+                self._counts[name] = [0] * (len(self.buckets) + 1)
+                self._sums[name] = 0.
+            self._counts[name][bisect.bisect_left(self.buckets, duration)] += 1
+            self._sums[name] += duration
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        :return: for every span name, its count, the sum of its durations and the cumulative count of each bucket
+        keyed by upper bound ('+Inf' for the last one)
+        """
+        with self._lock:
+            out = {}
+            for name, counts in self._counts.items():
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    buckets['+Inf' if bound == float('inf') else str(bound)] = cumulative
+                out[name] = {'count': cumulative, 'sum': self._sums[name], 'buckets': buckets}
+            return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+            self._sums.clear()
+
+
+@contextmanager
+def profile(output: Optional[str] = None, sort: str = 'cumulative', lines: int = 30) -> Iterator['cProfile.Profile']:
+    """
+    Runs the code of a with block under cProfile, meant for a single conversion
+    :param output: the file to dump the statistics to (readable by pstats or snakeviz), None to print them instead
+    :param sort: the order of the printed statistics
+    :param lines: the number of printed functions
+    :return: the profiler
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output is None:
+            pstats.Stats(profiler).sort_stats(sort).print_stats(lines)
+        else:
+            profiler.dump_stats(output)
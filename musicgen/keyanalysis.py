@@ -0,0 +1,88 @@
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+from music21.key import Key
+from music21.note import Note
+
+"""
+NumPy implementation of the Krumhansl-Schmuckler key finding algorithm with the Aarden-Essen weightings, the algorithm
+used by music21's Stream.analyze('key'). The results are cached on the pitch class histogram of the notes.
+"""
+
+MAJOR_WEIGHTS = np.array([17.7661, 0.145624, 14.9265, 0.160186, 19.8049, 11.3587,
+                          0.291248, 22.062, 0.145624, 8.15494, 0.232998, 4.95122])
+MINOR_WEIGHTS = np.array([18.2648, 0.737619, 14.0499, 16.8599, 0.702494, 14.4362,
+                          0.702494, 18.6161, 4.56621, 1.93186, 7.37619, 1.75623])
+
+# Spelling of the tonic of each pitch class, the same one music21 picks for the analyzed key
+MAJOR_TONICS = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'A-', 'A', 'B-', 'B']
+MINOR_TONICS = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+
+
+def _profiles(weights: np.ndarray) -> np.ndarray:
+    """
+    The weights rotated to every tonic: row i weights pitch class j with weights[(j - i) % 12]
+    """
+    indices = (np.arange(12)[np.newaxis, :] - np.arange(12)[:, np.newaxis]) % 12
+    profiles = weights[indices]
+    return profiles - profiles.mean(axis=1, keepdims=True)
+
+
+MAJOR_PROFILES = _profiles(MAJOR_WEIGHTS)
+MINOR_PROFILES = _profiles(MINOR_WEIGHTS)
+
+
+def pitch_class_histogram(notes: List[Note]) -> np.ndarray:
+    """
+    The pitch class distribution of the notes, every note is weighted by its duration in quarter lengths
+    :param notes: the notes to analyze
+    :return: the 12 bins of the histogram
+    """
+    pitch_classes = np.fromiter((note.pitch.pitchClass for note in notes), dtype=int, count=len(notes))
+    durations = np.fromiter((note.quarterLength for note in notes), dtype=float, count=len(notes))
+    return np.bincount(pitch_classes, weights=durations, minlength=12)
+
+
+def _correlations(profiles: np.ndarray, histogram: np.ndarray) -> np.ndarray:
+    centered = histogram - histogram.mean()
+    denominator = np.sqrt((profiles ** 2).sum(axis=1) * (centered ** 2).sum())
+    if denominator.all():
+        return profiles @ centered / denominator
+    return np.zeros(12)
+
+
+@lru_cache(maxsize=1024)
+def _best_key(histogram: Tuple[float, ...]) -> Tuple[str, str, float]:
+    """
+    Correlates the histogram with the 24 major and minor profiles
+    :return: the tonic, the mode and the correlation coefficient of the best key
+    """
+    histogram = np.array(histogram)
+    correlations = np.concatenate((_correlations(MAJOR_PROFILES, histogram),
+                                   _correlations(MINOR_PROFILES, histogram)))
+
+    # Ties are broken like music21 does, favoring the higher pitch class and then the minor mode
+    candidates = [(correlation, index % 12, index // 12) for index, correlation in enumerate(correlations)]
+    correlation, pitch_class, minor = max(candidates)
+
+    if minor:
+        return MINOR_TONICS[pitch_class], 'minor', float(correlation)
+    return MAJOR_TONICS[pitch_class], 'major', float(correlation)
+
+
+def analyze_key(notes: List[Note]) -> Key:
+    """
+    Guesses the key of the notes
+    :param notes: the notes to analyze, they can't all be rests
+    :return: a new Key, with its correlationCoefficient set
+    """
+    histogram = pitch_class_histogram(notes)
+    if not histogram.any():
+        raise ValueError("Can't analyze the key of an empty piece")
+
+    tonic, mode, correlation = _best_key(tuple(np.round(histogram, 6)))
+
+    key = Key(tonic, mode)
+    key.correlationCoefficient = correlation
+    return key
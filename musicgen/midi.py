@@ -0,0 +1,346 @@
+import struct
+from collections import deque
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+if TYPE_CHECKING:
+    from music21.chord import Chord
+    from music21.stream import Stream
+    from music21.volume import Volume
+
+"""
+Standard MIDI File (*.mid) serialization of chord sequences that does not go through music21 Streams. The files have
+the same layout as the ones written by music21 (Stream.write('midi')): a single track on channel 1, 1024 ticks per
+quarter note, a note on event for every pitch of a chord followed by the note off events once the chord ends.
+
+The reader streams the note events of any *.mid file and groups the notes starting at the same time into chords.
+
+music21 is only imported by the functions converting its objects, reading and writing the files does not need it.
+"""
+
+TICKS_PER_QUARTER = 1024
+DEFAULT_VELOCITY = 90
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+PITCH_BEND = 0xE0
+
+# Names music21 gives to MIDI pitches when parsing a *.mid file, indexed by pitch class
+PITCH_CLASS_NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+
+MidiSource = Union[str, bytes, BinaryIO]
+
+
+class ChordEvent(NamedTuple):
+    """
+    A Chord reduced to what ends up in the *.mid file: the MIDI numbers of its pitches (in the order of the Chord), its
+    quarter length and its velocity.
+    """
+    pitches: Tuple[int, ...]
+    quarter_length: float
+    velocity: int
+
+
+def midi_velocity(volume: 'Volume') -> int:
+    """
+    The velocity music21 writes for a Volume
+    """
+    velocity = volume.velocity
+    return DEFAULT_VELOCITY if velocity is None else int(round(velocity))
+
+
+def chord_event(chord: 'Chord') -> ChordEvent:
+    """
+    Reduces a music21 Chord to a ChordEvent
+    :param chord: the Chord to convert
+    :return: the equivalent ChordEvent
+    """
+    return ChordEvent(tuple(pitch.midi for pitch in chord.pitches), float(chord.quarterLength),
+                      midi_velocity(chord.volume))
+
+
+def stream_events(stream: 'Stream') -> List[ChordEvent]:
+    """
+    Lists the ChordEvents of all the Chords of a Stream
+    :param stream: the Stream containing the Chords
+    :return: the ChordEvent of each Chord
+    """
+    from music21.chord import Chord
+
+    return [chord_event(chord) for chord in stream.recurse().getElementsByClass(Chord)]
+
+
+def _variable_length(value: int) -> bytes:
+    """
+    Encodes an integer as a MIDI variable length quantity
+    """
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def track_start() -> bytes:
+    """
+    The events music21 writes at the start of every track: an empty track name and a centered pitch bend
+    """
+    return b'\x00\xff\x03\x00' + b'\x00' + bytes([PITCH_BEND, 0x00, 0x40])
+
+
+def track_end() -> bytes:
+    """
+    The end of a track: music21 pads it with a quarter note before the end of track meta event
+    """
+    return _variable_length(TICKS_PER_QUARTER) + b'\xff\x2f\x00'
+
+
+def track_events(events: Iterable[ChordEvent]) -> bytes:
+    """
+    Serializes the chords as the body of a MIDI track (without the track header)
+    :param events: the chords in playing order
+    :return: the track body
+    """
+    out = bytearray(track_start())
+
+    for event in events:
+        append_event(out, event)
+
+    out += track_end()
+
+    return bytes(out)
+
+
+def append_event(out: bytearray, event: ChordEvent) -> None:
+    """
+    Serializes a chord at the end of a track body. The bytes of a chord don't depend on the chords before it, so parts
+    of a track body can be spliced at chord boundaries.
+    """
+    for pitch in event.pitches:
+        out += b'\x00' + bytes([NOTE_ON, pitch, event.velocity])
+
+    delta = _variable_length(int(round(event.quarter_length * TICKS_PER_QUARTER)))
+    for pitch in event.pitches:
+        out += delta + bytes([NOTE_OFF, pitch, 0])
+        delta = b'\x00'
+
+
+def midi_header(tracks: int) -> bytes:
+    """
+    The MThd chunk of a format 1 file
+    """
+    return b'MThd' + struct.pack('>IHHH', 6, 1, tracks, TICKS_PER_QUARTER)
+
+
+def track_chunk(body: bytes) -> bytes:
+    """
+    Wraps a track body into a MTrk chunk
+    """
+    return b'MTrk' + struct.pack('>I', len(body)) + body
+
+
+def write_midi(events: Iterable[ChordEvent]) -> bytes:
+    """
+    Serializes a chord sequence straight to the bytes of a Standard MIDI File
+    :param events: the chords in playing order, including the end cadence
+    :return: the content of the *.mid file
+    """
+    return midi_header(1) + track_chunk(track_events(events))
+
+
+def write_midi_tracks(tracks: Iterable[Iterable[ChordEvent]]) -> bytes:
+    """
+    Same as write_midi for a format 1 file with one track per chord sequence, the tracks are played at the same time
+    :param tracks: the chords of each track in playing order, including their end cadence
+    :return: the content of the *.mid file
+    """
+    chunks = [track_chunk(track_events(events)) for events in tracks]
+    return midi_header(len(chunks)) + b''.join(chunks)
+
+
+def write_midi_file(events: Iterable[ChordEvent], file: BinaryIO, buffer_size: int = 1 << 16) -> int:
+    """
+    Same as write_midi, but the track is written to the file as the chords come in, so that only buffer_size bytes of
+    it are held in memory. The length of the track is only known at the end, it is patched in the track header once the
+    track is written.
+    :param events: the chords in playing order, including the end cadence
+    :param file: a seekable binary file, the *.mid file is written from its current position
+    :param buffer_size: the number of bytes buffered before each write
+    :return: the number of bytes written
+    """
+    start = file.tell()
+    file.write(midi_header(1) + b'MTrk' + struct.pack('>I', 0))
+
+    length = 0
+    out = bytearray(track_start())
+    for event in events:
+        append_event(out, event)
+        if len(out) >= buffer_size:
+            file.write(out)
+            length += len(out)
+            out.clear()
+
+    out += track_end()
+    file.write(out)
+    length += len(out)
+
+    end = file.tell()
+    file.seek(start + 18)  # The length field of the MTrk chunk, after the 14 bytes of the MThd chunk
+    file.write(struct.pack('>I', length))
+    file.seek(end)
+
+    return end - start
+
+
+def write_tracks_file(tracks: Iterable[Iterable[ChordEvent]], file: BinaryIO) -> int:
+    """
+    Writes a format 1 file with one track per chord sequence, the tracks are serialized and written one at a time. The
+    number of tracks is only known at the end, it is patched in the file header once the tracks are written.
+    :param tracks: the chords of each track in playing order, including their end cadence
+    :param file: a seekable binary file, the *.mid file is written from its current position
+    :return: the number of bytes written
+    """
+    start = file.tell()
+    file.write(midi_header(0))
+
+    count = 0
+    for events in tracks:
+        file.write(track_chunk(track_events(events)))
+        count += 1
+
+    end = file.tell()
+    file.seek(start + 10)  # The number of tracks of the MThd chunk, after its length and format fields
+    file.write(struct.pack('>H', count))
+    file.seek(end)
+
+    return end - start
+
+
+def read_source(source: MidiSource) -> bytes:
+    """
+    The content of a *.mid file given as a path, bytes or a binary file object
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if isinstance(source, str):
+        with open(source, 'rb') as file:
+            return file.read()
+    return source.read()
+
+
+def _read_variable_length(data: bytes, position: int) -> Tuple[int, int]:
+    """
+    Decodes a MIDI variable length quantity
+    :return: the value and the position after it
+    """
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, position
+
+
+def _track_chords(data: bytes, start: int, end: int, ticks_per_quarter: int) -> Iterator[ChordEvent]:
+    """
+    Streams the chords of one track. The notes starting on the same tick form a chord, a chord is yielded as soon as
+    all its notes, and all the notes of the chords before it, have ended.
+    """
+    # Chords that are still sounding, in start order: [start tick, pitches, velocity, end tick, sounding notes]
+    pending: deque = deque()
+    sounding: Dict[int, list] = {}
+
+    tick = 0
+    status = 0
+    position = start
+    try:
+        while position < end:
+            delta, position = _read_variable_length(data, position)
+            tick += delta
+
+            if data[position] & 0x80:
+                status = data[position]
+                position += 1
+
+            if status == 0xFF:  # Meta event
+                length, position = _read_variable_length(data, position + 1)
+                position += length
+                continue
+            if status in (0xF0, 0xF7):  # System exclusive event
+                length, position = _read_variable_length(data, position)
+                position += length
+                continue
+
+            kind = status & 0xF0
+            if kind in (0xC0, 0xD0):  # Program change and channel pressure have a single data byte
+                position += 1
+                continue
+
+            pitch, velocity = data[position], data[position + 1]
+            position += 2
+
+            if kind == NOTE_ON and velocity > 0:
+                if not pending or pending[-1][0] != tick:
+                    pending.append([tick, [], velocity, tick, 0])
+                chord = pending[-1]
+                chord[1].append(pitch)
+                chord[4] += 1
+                sounding[pitch] = chord
+            elif kind in (NOTE_ON, NOTE_OFF) and pitch in sounding:
+                chord = sounding.pop(pitch)
+                chord[3] = max(chord[3], tick)
+                chord[4] -= 1
+
+                while pending and pending[0][4] == 0:
+                    chord_start, pitches, chord_velocity, chord_end, _ = pending.popleft()
+                    yield ChordEvent(tuple(pitches), (chord_end - chord_start) / ticks_per_quarter, chord_velocity)
+    except IndexError:
+        # Truncated file, the last event is incomplete
+        pass
+
+    # Notes that never received a note off (truncated files) end with the track
+    for chord_start, pitches, chord_velocity, chord_end, _ in pending:
+        yield ChordEvent(tuple(pitches), (max(chord_end, tick) - chord_start) / ticks_per_quarter, chord_velocity)
+
+
+def read_tracks(source: MidiSource) -> List[Iterator[ChordEvent]]:
+    """
+    Streams the chords of each track of a *.mid file without building music21 objects
+    :param source: the path of the *.mid file, its content or a binary file object
+    :return: a generator of the ChordEvents of each track, in playing order
+    """
+    data = read_source(source)
+    if data[:4] != b'MThd':
+        raise ValueError("Not a Standard MIDI File")
+
+    header_length, _, tracks, ticks_per_quarter = struct.unpack('>IHHH', data[4:14])
+    if ticks_per_quarter & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+
+    out = []
+    position = 8 + header_length
+    while len(out) < tracks and position + 8 <= len(data):
+        length = struct.unpack('>I', data[position + 4:position + 8])[0]
+        if data[position:position + 4] == b'MTrk':
+            out.append(_track_chords(data, position + 8, min(position + 8 + length, len(data)), ticks_per_quarter))
+        position += 8 + length
+
+    return out
+
+
+def read_chords(source: MidiSource) -> Iterator[ChordEvent]:
+    """
+    Streams the chords of all the tracks of a *.mid file, one track after the other
+    :param source: the path of the *.mid file, its content or a binary file object
+    :return: the ChordEvents in playing order
+    """
+    for track in read_tracks(source):
+        yield from track
+
+
+def bass_name(event: ChordEvent) -> str:
+    """
+    The name of the lowest pitch of a chord, spelled the way music21 spells parsed MIDI pitches
+    """
+    return PITCH_CLASS_NAMES[min(event.pitches) % 12]
@@ -0,0 +1,138 @@
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from music21.key import Key
+from music21.note import Note
+
+from musicgen.midi import midi_velocity
+from musicgen.rules import STEPS
+
+
+def key_letters(key: Key) -> List[str]:
+    """
+    Lists the note letters of a key, in scale degree order (the tonic is repeated at the end)
+    :param key: the key to get the notes from
+    :return: the letter name of each pitch of the key
+    """
+    return [pitch.name[0] for pitch in key.getPitches()]
+
+
+class NoteBatch:
+    def __init__(self, degrees: np.ndarray, quarter_lengths: np.ndarray, velocities: np.ndarray,
+                 names: Sequence[str]):
+        """
+        A sequence of notes stored as NumPy arrays instead of one Python object per note. The notes are represented by
+        their index in a list of note names (for instance the letters of a key).
+        :param degrees: The index in names of each note, as uint8.
+        :param quarter_lengths: The quarter length of each note.
+        :param velocities: The volume of each note.
+        :param names: The note names the degrees refer to.
+        """
+        self.degrees: np.ndarray = np.asarray(degrees, dtype=np.uint8)
+        self.quarter_lengths: np.ndarray = np.asarray(quarter_lengths, dtype=float)
+        self.velocities: np.ndarray = np.asarray(velocities, dtype=float)
+        self.names: List[str] = list(names)
+
+    @classmethod
+    def from_identifiers(cls, identifiers: Sequence[tuple], names: Optional[Sequence[str]] = None) -> 'NoteBatch':
+        """
+        Builds a NoteBatch from (name, quarterLength) or (name, quarterLength, volume) note identifiers.
+        :param identifiers: The note identifiers, the ones without a volume get a NaN velocity.
+        :param names: The note names the degrees refer to, defaults to the sorted names of the identifiers.
+        """
+        if names is None:
+            names = sorted({identifier[0] for identifier in identifiers})
+        # A name listed twice maps to its first index, like list.index
+        index = {name: degree for degree, name in reversed(list(enumerate(names)))}
+
+        degrees = [index[identifier[0]] for identifier in identifiers]
+        quarter_lengths = [identifier[1] for identifier in identifiers]
+        velocities = [identifier[2] if len(identifier) == 3 else np.nan for identifier in identifiers]
+
+        return cls(degrees, quarter_lengths, velocities, names)
+
+    def __len__(self) -> int:
+        return len(self.degrees)
+
+    def __getitem__(self, item: Union[slice, np.ndarray]) -> 'NoteBatch':
+        return NoteBatch(self.degrees[item], self.quarter_lengths[item], self.velocities[item], self.names)
+
+    def __iter__(self) -> Iterator[tuple]:
+        """
+        Iterates over the notes as note identifiers, so a NoteBatch can be used where a list of them is expected.
+        """
+        for name, quarter_length, velocity in zip(self.note_names().tolist(), self.quarter_lengths.tolist(),
+                                                  self.velocities.tolist()):
+            if np.isnan(velocity):
+                yield name, quarter_length
+            else:
+                yield name, quarter_length, velocity
+
+    def note_names(self) -> np.ndarray:
+        """
+        The name of each note.
+        """
+        return np.array(self.names)[self.degrees]
+
+    def steps(self) -> bytes:
+        """
+        The index in rules.STEPS of the letter of each note, what the compiled cyphers work with.
+        """
+        lookup = bytes(STEPS.index(name[0]) for name in self.names)
+        return self.degrees.tobytes().translate(lookup.ljust(256, b'\0'))
+
+    def note(self, index: int) -> Note:
+        """
+        Creates the music21 Note at an index.
+        """
+        note = Note(self.names[self.degrees[index]])
+        note.quarterLength = float(self.quarter_lengths[index])
+        if not np.isnan(self.velocities[index]):
+            note.volume = float(self.velocities[index])
+        return note
+
+    def notes(self) -> Iterator[Note]:
+        """
+        Creates the music21 Notes, only for the rulesets that need them.
+        """
+        for index in range(len(self)):
+            yield self.note(index)
+
+    def midi_velocities(self) -> List[int]:
+        """
+        The velocity music21 writes for each note. music21 converts every distinct volume once.
+        """
+        distinct, inverse = np.unique(self.velocities, return_inverse=True)
+
+        velocities = []
+        for volume in distinct.tolist():
+            note = Note()
+            if not np.isnan(volume):
+                note.volume = volume
+            velocities.append(midi_velocity(note.volume))
+
+        return np.array(velocities, dtype=int)[inverse.ravel()].tolist()
+
+    def runs(self, max_run: int) -> Tuple['NoteBatch', np.ndarray]:
+        """
+        Folds the runs of consecutive notes that end up the same in the *.mid file (same note, quarter length and MIDI
+        velocity) into their first note.
+        :param max_run: The longest run, the longer ones are split.
+        :return: The first note of each run and the length of each run.
+        """
+        if not len(self):
+            return self, np.zeros(0, dtype=int)
+
+        velocities = np.array(self.midi_velocities())
+        changes = ((self.degrees[1:] != self.degrees[:-1]) | (self.quarter_lengths[1:] != self.quarter_lengths[:-1]) |
+                   (velocities[1:] != velocities[:-1]))
+        starts = np.flatnonzero(np.concatenate(([True], changes)))
+        lengths = np.diff(np.append(starts, len(self)))
+
+        # Splits the runs longer than max_run into runs of max_run notes and a shorter one
+        pieces = -(-lengths // max_run)
+        offsets = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        heads = np.repeat(starts, pieces) + offsets * max_run
+        counts = np.minimum(np.repeat(starts + lengths, pieces) - heads, max_run)
+
+        return self[heads], counts
@@ -0,0 +1,76 @@
+from itertools import repeat
+from typing import List, Optional, Sequence, Tuple
+
+from musicgen.midi import ChordEvent, append_event
+
+"""
+Parallel serialization of the chord progression of a CompiledTriadBaroqueCypher. The only state carried from one chord
+to the next is the scale degree of the previous chord (7 possible values), walking this state machine over the notes is
+a table lookup per note, so it runs in the calling process. What costs is turning every note into the bytes of its
+chord: once the degree before every note is known, the chords of a chunk of notes don't depend on the other chunks, and
+their bytes don't depend on the bytes before them (see midi.append_event). The chunks are serialized in worker processes
+and concatenated.
+"""
+
+Transitions = Tuple[Tuple[int, ...], ...]
+
+# MIDI pitches of every entry of a transition table, pitches[previous degree - 1][step index]
+PitchTable = Sequence[Sequence[Tuple[int, ...]]]
+
+
+def degree_path(transitions: Transitions, first_degree: int, steps: bytes) -> bytes:
+    """
+    Runs the state machine over the steps from the degree of the first chord
+    :param transitions: transitions[degree - 1][step] is the degree following degree for the step
+    :param first_degree: the degree of the first chord
+    :param steps: the index of the letter (see rules.STEPS) of each note following the first one
+    :return: the degree of the chord of each step
+    """
+    path = bytearray(len(steps))
+    degree = first_degree
+    for index, step in enumerate(steps):
+        degree = transitions[degree - 1][step]
+        path[index] = degree
+    return bytes(path)
+
+
+def serialize_chunk(pitches: PitchTable, previous_degrees: bytes, steps: bytes, quarter_lengths: List[float],
+                    velocities: List[int]) -> bytes:
+    """
+    Serializes the chords of a chunk of notes as a part of a track body
+    :param pitches: the MIDI pitches of every entry of the transition table
+    :param previous_degrees: the degree of the chord before each note
+    :param steps: the index of the letter of each note
+    :param quarter_lengths: the quarter_length of each note
+    :param velocities: the MIDI velocity of each note
+    :return: the bytes of the chords, see midi.append_event
+    """
+    out = bytearray()
+    for degree, step, quarter_length, velocity in zip(previous_degrees, steps, quarter_lengths, velocities):
+        append_event(out, ChordEvent(pitches[degree - 1][step], quarter_length, velocity))
+    return bytes(out)
+
+
+def serialize_progression(pitches: PitchTable, previous_degrees: bytes, steps: bytes, quarter_lengths: List[float],
+                          velocities: List[int], workers: Optional[int] = 1, chunk_size: int = 16384) -> bytes:
+    """
+    Same as serialize_chunk, with the notes split in chunks serialized over a pool of worker processes
+    :param workers: the number of worker processes, None for the number of CPUs. With 1 worker the chords are
+    serialized in the calling process.
+    :param chunk_size: the number of notes per chunk
+    :return: the bytes of the chords, the same as the ones of serialize_chunk
+    """
+    bounds = range(0, len(steps), chunk_size)
+    if len(bounds) <= 1 or workers == 1:
+        return serialize_chunk(pitches, previous_degrees, steps, quarter_lengths, velocities)
+
+    # Only imported when needed, the chunk workers import this module
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(serialize_chunk, repeat(pitches),
+                              [previous_degrees[start:start + chunk_size] for start in bounds],
+                              [steps[start:start + chunk_size] for start in bounds],
+                              [quarter_lengths[start:start + chunk_size] for start in bounds],
+                              [velocities[start:start + chunk_size] for start in bounds])
+        return b''.join(chunks)
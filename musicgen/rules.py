@@ -1,13 +1,26 @@
+import copy
+import itertools
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from collections import deque
+from typing import List, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
 
 from music21.chord import Chord
 from music21.key import Key
 from music21.note import Note
+from music21.pitch import Pitch
 from music21.stream import Stream
 
+from musicgen.midi import ChordEvent
+
+STEPS = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+
 
 class Rules(ABC):
+    # Whether the Rules fit the chords to the guessed key of the piece, it is only analyzed for the Rules that need it
+    uses_key = True
+    # Changes whenever the chords generated by the Rules change, the cached conversions of the older versions are unused
+    version = 1
+
     def __init__(self):
         """
         Rules determine how chords are generated.
@@ -226,6 +239,9 @@ class TriadBaroque(Rules):
 
 
 class TriadBaroqueCypher(TriadBaroque, Cypher):
+    # The chords always fit to the secret key
+    uses_key = False
+
     def __init__(self, secret_key: Key):
         """
         Functionally the same to the TriadBaroque Rules, with the only exception being that the input note is the bass
@@ -275,3 +291,297 @@ class TriadBaroqueCypher(TriadBaroque, Cypher):
             out_notes.append(note)
 
         return out_notes
+
+    def decode_events(self, events: Iterable[ChordEvent]) -> Iterator[ChordEvent]:
+        """
+        Streaming version of decode for ChordEvents read with musicgen.midi. The encoded Note of each chord is its
+        bass, so the chords are returned as they are, the last two (the cadence) are dropped like in decode.
+        :param events: The chords of the piece, in playing order.
+        :return: The chords that encode a Note.
+        """
+        buffer = deque()
+        for event in events:
+            buffer.append(event)
+            if len(buffer) > 2:
+                yield buffer.popleft()
+
+    def decode_tracks(self, tracks: Iterable[Iterable[ChordEvent]]) -> Iterator[ChordEvent]:
+        """
+        decode_events for all the tracks of a *.mid file, the tracks are read one after the other as a single piece.
+        :param tracks: The chords of each track, see musicgen.midi.read_tracks.
+        :return: The chords that encode a Note.
+        """
+        return self.decode_events(itertools.chain.from_iterable(tracks))
+
+
+class CompiledChord(NamedTuple):
+    """
+    A precomputed Chord of a TransitionTable: the scale degree of its root, its pitches (already inverted) and its
+    inversion.
+    """
+    degree: int
+    pitches: Tuple[Pitch, ...]
+    inversion: int
+
+
+class TransitionTable:
+    def __init__(self, rules: TriadBaroqueCypher):
+        """
+        Precomputes every Chord that a TriadBaroqueCypher can generate in its secret key. For a fixed key, next_chord
+        only depends on the scale degree of the previous Chord and on the letter of the incoming Note, so it is a 7x7
+        table. The end cadence only depends on the scale degree of the last Chord.
+        :param rules: The ruleset to compile, its (uncompiled) methods are only called while building the table.
+        """
+        self.key = rules.secret_key
+        self.next_chords: List[List[CompiledChord]] = []
+        self.cadences: List[List[Tuple[Pitch, ...]]] = []
+
+        for degree in range(1, 8):
+            previous_chord = rules.build_major_triad(self.key.pitchFromDegree(degree))
+
+            row = []
+            for step in STEPS:
+                chord = TriadBaroqueCypher.next_chord(rules, self.key, previous_chord, Note(step))
+                row.append(CompiledChord(self.key.getScaleDegreeFromPitch(chord.root()), tuple(chord.pitches),
+                                         chord.inversion()))
+            self.next_chords.append(row)
+
+            cadence = TriadBaroqueCypher.end_cadence(rules, self.key, previous_chord)
+            self.cadences.append([tuple(chord.pitches) for chord in cadence])
+
+        # The table as a pure state machine: next_degrees[previous degree - 1][step index] is the next degree
+        self.next_degrees: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(compiled.degree for compiled in row) for row in self.next_chords)
+        # The MIDI numbers of the pitches of every entry, what the *.mid files are written from
+        self.next_pitches: Tuple[Tuple[Tuple[int, ...], ...], ...] = tuple(
+            tuple(tuple(pitch.midi for pitch in compiled.pitches) for compiled in row) for row in self.next_chords)
+
+
+_transition_tables: Dict[Tuple[str, Optional[int], str], TransitionTable] = {}
+
+
+def compile_transition_table(rules: TriadBaroqueCypher) -> TransitionTable:
+    """
+    Returns the TransitionTable of a ruleset's secret key. Tables are built once per key and then shared.
+
+    The octave of the tonic is part of the identifier: TriadBaroque.first_chord inverts a chord built on the tonic
+    object of the key itself, which can move the tonic (and so every following Chord) up an octave.
+    """
+    key = rules.secret_key
+    identifier = (key.tonic.name, key.tonic.octave, key.mode)
+    if identifier not in _transition_tables:
+        _transition_tables[identifier] = TransitionTable(rules)
+    return _transition_tables[identifier]
+
+
+class CompiledTriadBaroqueCypher(TriadBaroqueCypher):
+    def __init__(self, secret_key: Key):
+        """
+        Generates exactly the same Chords as TriadBaroqueCypher, but next_chord and end_cadence are lookups in a
+        TransitionTable that is precomputed for the secret_key, instead of recomputing the scale degrees and
+        transposing a new triad for every Note. first_chord runs once per piece and keeps the original logic, it selects
+        the table to use for the rest of the piece.
+        :param secret_key: The Key that the chords will fit to. This is to make sure the encoding process is reversible.
+        """
+        super().__init__(secret_key)
+        self.table: Optional[TransitionTable] = None
+
+        # The last generated Chord and the degree of its root, saves calling root() on the previous chord
+        self._last_chord: Optional[Chord] = None
+        self._last_degree = -1
+
+    def degree(self, chord: Chord) -> int:
+        """
+        The scale degree of the root of a Chord in the secret key, the state carried from one Chord to the next.
+        """
+        if chord is self._last_chord:
+            return self._last_degree
+        return self.secret_key.getScaleDegreeFromPitch(chord.root())
+
+    def compiled_table(self) -> TransitionTable:
+        """
+        The TransitionTable in use, the one selected by the last first_chord.
+        """
+        if self.table is None:
+            self.table = compile_transition_table(self)
+        return self.table
+
+    def chord_from(self, compiled: CompiledChord, note: Note) -> Chord:
+        """
+        Builds the Chord of a table entry for a Note.
+        """
+        chord = Chord([copy.deepcopy(pitch) for pitch in compiled.pitches])
+        chord.quarterLength = note.quarterLength
+        chord.volume = note.volume
+
+        self._last_chord = chord
+        self._last_degree = compiled.degree
+
+        return chord
+
+    def next_chord(self, key: Key, previous_chord: Chord, next_note: Note) -> Chord:
+        compiled = self.compiled_table().next_chords[self.degree(previous_chord) - 1][STEPS.index(next_note.step)]
+        return self.chord_from(compiled, next_note)
+
+    def first_chord(self, key: Key, note: Note) -> Chord:
+        chord = super().first_chord(key, note)
+        self.table = compile_transition_table(self)
+
+        return chord
+
+    def end_cadence(self, key: Key, previous_chord: Chord) -> Stream:
+        out = Stream()
+        for pitches in self.compiled_table().cadences[self.degree(previous_chord) - 1]:
+            chord = Chord([copy.deepcopy(pitch) for pitch in pitches])
+            chord.quarterLength = 2
+            out.append(chord)
+
+        return out
+
+
+# The repeat count of a run is encoded by a note RUN_INTERVAL + (count - 2) semitones above the top of its chord
+RUN_INTERVAL = 12
+# Longest run folded into a single chord, the count note of the highest chords of the tables stays a valid MIDI pitch
+MAX_RUN = 16
+
+
+class RunLengthTriadBaroqueCypher(CompiledTriadBaroqueCypher):
+    def __init__(self, secret_key: Key, max_run: int = MAX_RUN):
+        """
+        Same as CompiledTriadBaroqueCypher, but a run of consecutive Notes that are the same (note, quarter length and
+        velocity) is encoded by a single Chord: the Chord of the first Note of the run, with an extra note above it whose
+        interval with the top of the Chord gives the length of the run. Flat regions of an image become a few Chords
+        instead of one per block. The chord progression only moves on the first Note of each run.
+        :param secret_key: The Key that the chords will fit to. This is to make sure the encoding process is reversible.
+        :param max_run: The longest run encoded by a single Chord, from 2 to MAX_RUN.
+        """
+        super().__init__(secret_key)
+        if not 2 <= max_run <= MAX_RUN:
+            raise ValueError(f"max_run has to be between 2 and {MAX_RUN}")
+        self.max_run = max_run
+
+    @staticmethod
+    def count_pitch(pitches: Iterable[int], count: int) -> int:
+        """
+        The MIDI pitch of the note encoding the length of a run.
+        :param pitches: The MIDI pitches of the Chord of the first Note of the run.
+        :param count: The length of the run, at least 2.
+        """
+        pitch = max(pitches) + RUN_INTERVAL + count - 2
+        if pitch > 127:
+            raise ValueError(f"A run of {count} notes can't be encoded above pitch {max(pitches)}")
+        return pitch
+
+    @staticmethod
+    def run_length(pitches: Iterable[int]) -> int:
+        """
+        The number of Notes encoded by a Chord, 1 for the triads.
+        :param pitches: The MIDI pitches of the Chord.
+        """
+        pitches = sorted(pitches)
+        if len(pitches) <= 3:
+            return 1
+        return pitches[-1] - pitches[-2] - RUN_INTERVAL + 2
+
+    def mark_runs(self, events: Iterable[ChordEvent], counts: Iterator[int]) -> Iterator[ChordEvent]:
+        """
+        Adds the count notes to the ChordEvents generated for the first Note of each run.
+        :param events: The ChordEvents generated for the first Note of each run, followed by the end cadence.
+        :param counts: The length of each run, the ChordEvents past the last count (the cadence) are left as they are.
+        :return: The encoded ChordEvents.
+        """
+        for event in events:
+            count = next(counts, 1)
+            if count > 1:
+                event = event._replace(pitches=event.pitches + (self.count_pitch(event.pitches, count),))
+            yield event
+
+    def mark_chords(self, stream: Stream, counts: Iterable[int]) -> Stream:
+        """
+        Same as mark_runs for a Stream of Chords.
+        """
+        for chord, count in zip(stream.getElementsByClass(Chord), counts):
+            if count > 1:
+                chord.add(Pitch(midi=self.count_pitch([pitch.midi for pitch in chord.pitches], int(count))))
+
+        return stream
+
+    def decode(self, input_stream: Stream) -> List[Note]:
+        out_notes: List[Note] = []
+
+        for chord in input_stream.getElementsByClass(Chord)[:-2]:
+            note: Note = chord.bass()
+            note.quarterLength = chord.quarterLength
+            note.volume = chord.volume
+            out_notes.append(note)
+            for _ in range(self.run_length(pitch.midi for pitch in chord.pitches) - 1):
+                out_notes.append(copy.deepcopy(note))
+
+        return out_notes
+
+    def decode_events(self, events: Iterable[ChordEvent]) -> Iterator[ChordEvent]:
+        """
+        Same as TriadBaroqueCypher.decode_events, the Chord of a run is returned once per Note of the run, without its
+        count note.
+        """
+        for event in super().decode_events(events):
+            count = self.run_length(event.pitches)
+            if count > 1:
+                top = max(event.pitches)
+                event = event._replace(pitches=tuple(pitch for pitch in event.pitches if pitch != top))
+            for _ in range(count):
+                yield event
+
+
+class MultiVoiceTriadBaroqueCypher(CompiledTriadBaroqueCypher):
+    def __init__(self, secret_key: Key, voices: int = 4):
+        """
+        Same as CompiledTriadBaroqueCypher, but the Notes are split into consecutive parts played at the same time, one
+        voice per part (a band of rows of the image). Each voice is its own piece with its own chord progression and
+        end cadence, written to its own track. The piece is voices times shorter, and the voices can be decoded
+        independently.
+        :param secret_key: The Key that the chords will fit to. This is to make sure the encoding process is reversible.
+        :param voices: The number of voices.
+        """
+        super().__init__(secret_key)
+        if voices < 1:
+            raise ValueError("There has to be at least one voice")
+        self.voices = voices
+
+    def voice_bounds(self, length: int) -> List[Tuple[int, int]]:
+        """
+        Splits the Notes between the voices, the first voices get one more Note when they can't all get as many.
+        :param length: The number of Notes.
+        :return: The (start, end) indices of the Notes of each voice, without the empty voices.
+        """
+        size, extra = divmod(length, self.voices)
+        bounds = []
+        start = 0
+        for voice in range(self.voices):
+            end = start + size + (voice < extra)
+            if end > start:
+                bounds.append((start, end))
+            start = end
+
+        return bounds
+
+    def decode(self, input_stream: Stream) -> List[Note]:
+        """
+        Decodes the Stream of a Score, every Part is a voice. A Stream without Parts is decoded as a single voice.
+        """
+        parts = list(input_stream.parts) if hasattr(input_stream, 'parts') else []
+        if not parts:
+            return super().decode(input_stream)
+
+        out_notes: List[Note] = []
+        for part in parts:
+            out_notes += super().decode(part.flat)
+
+        return out_notes
+
+    def decode_tracks(self, tracks: Iterable[Iterable[ChordEvent]]) -> Iterator[ChordEvent]:
+        """
+        Every track is a voice with its own end cadence, the voices are decoded one after the other.
+        """
+        for track in tracks:
+            yield from self.decode_events(track)
@@ -0,0 +1,120 @@
+from collections import deque
+from typing import Iterable, Iterator
+
+from music21.chord import Chord
+
+from musicgen.midi import ChordEvent, DEFAULT_VELOCITY, chord_event
+from musicgen.notebatch import NoteBatch
+from musicgen.parallel import degree_path
+from musicgen.rules import CompiledTriadBaroqueCypher, MultiVoiceTriadBaroqueCypher, Rules, RunLengthTriadBaroqueCypher
+
+"""
+Chord generation over a stream of NoteBatches, for pieces too large to be held in memory. Only the state of the
+progression is carried from one batch to the next: the previous Chord, or just its degree with a
+CompiledTriadBaroqueCypher. The ChordEvents are the same as the ones of ChordCreator.chord_events for the whole piece.
+"""
+
+
+def _compiled_events(batches: Iterator[NoteBatch], rules: CompiledTriadBaroqueCypher,
+                     first_chord: Chord, first: NoteBatch) -> Iterator[ChordEvent]:
+    table = rules.compiled_table()
+    pitches = table.next_pitches
+    degree = rules.degree(first_chord)
+
+    yield chord_event(first_chord)
+
+    batch = first[1:]
+    while True:
+        steps = batch.steps()
+        path = degree_path(table.next_degrees, degree, steps)
+
+        previous_degree = degree
+        for step, next_degree, quarter_length, velocity in zip(steps, path, batch.quarter_lengths.tolist(),
+                                                               batch.midi_velocities()):
+            yield ChordEvent(pitches[previous_degree - 1][step], quarter_length, velocity)
+            previous_degree = next_degree
+        if path:
+            degree = path[-1]
+
+        batch = next(batches, None)
+        if batch is None:
+            break
+
+    for cadence in table.cadences[degree - 1]:
+        yield ChordEvent(tuple(pitch.midi for pitch in cadence), 2.0, DEFAULT_VELOCITY)
+
+
+def _rules_events(batches: Iterator[NoteBatch], rules: Rules, first_chord: Chord,
+                  first: NoteBatch) -> Iterator[ChordEvent]:
+    yield chord_event(first_chord)
+
+    prev_chord = first_chord
+    batch = first[1:]
+    while batch is not None:
+        for note in batch.notes():
+            prev_chord = rules.next_chord(None, prev_chord, note)
+            yield chord_event(prev_chord)
+        batch = next(batches, None)
+
+    for chord in rules.end_cadence(None, prev_chord).getElementsByClass(Chord):
+        yield chord_event(chord)
+
+
+def _run_events(batches: Iterable[NoteBatch], rules: RunLengthTriadBaroqueCypher) -> Iterator[ChordEvent]:
+    """
+    The runs are folded batch by batch, a run spanning two batches is encoded as two runs
+    """
+    counts = deque()
+
+    def heads() -> Iterator[NoteBatch]:
+        for batch in batches:
+            head, batch_counts = batch.runs(rules.max_run)
+            counts.extend(batch_counts.tolist())
+            yield head
+
+    # The counts of a batch are queued when the batch is requested, before the ChordEvents of its notes are generated,
+    # so they only run out at the end cadence
+    def run_counts() -> Iterator[int]:
+        while counts:
+            yield counts.popleft()
+
+    head_batches = heads()
+    first = next(head_batches)
+    first_chord = rules.first_chord(None, first.note(0))
+
+    return rules.mark_runs(_compiled_events(head_batches, rules, first_chord, first), run_counts())
+
+
+def streams_whole_piece(rules: Rules) -> bool:
+    """
+    Whether stream_chord_events generates the same ChordEvents as the whole piece, wherever the batches are cut
+    :param rules: the Rules the Chords are fitted with
+    :return: False for the Rules that can't be streamed and for a RunLengthTriadBaroqueCypher, whose runs are cut at
+    the end of each batch
+    """
+    return not (rules.uses_key or isinstance(rules, (MultiVoiceTriadBaroqueCypher, RunLengthTriadBaroqueCypher)))
+
+
+def stream_chord_events(batches: Iterable[NoteBatch], rules: Rules) -> Iterator[ChordEvent]:
+    """
+    Generates the ChordEvents of a piece given as a sequence of NoteBatches, the batches are consumed one at a time
+    :param batches: the consecutive parts of the piece, the first one can't be empty
+    :param rules: Rules that don't need the key of the whole piece, such as the Cyphers (they use their secret key). The
+    runs of a RunLengthTriadBaroqueCypher are folded batch by batch.
+    :return: the ChordEvents of the generated Chords, followed by the ones of the end cadence
+    """
+    if rules.uses_key:
+        raise ValueError(f"{type(rules).__name__} needs the key of the whole piece, it can't be streamed")
+    if isinstance(rules, MultiVoiceTriadBaroqueCypher):
+        raise ValueError(f"{type(rules).__name__} writes several tracks, it can't be streamed as a single one")
+
+    if isinstance(rules, RunLengthTriadBaroqueCypher):
+        return _run_events(batches, rules)
+
+    batches = iter(batches)
+    first = next(batches)
+    first_chord = rules.first_chord(None, first.note(0))
+
+    if isinstance(rules, CompiledTriadBaroqueCypher):
+        return _compiled_events(batches, rules, first_chord, first)
+    return _rules_events(batches, rules, first_chord, first)
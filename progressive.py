@@ -0,0 +1,101 @@
+from typing import Tuple
+
+import numpy as np
+
+import musicgen
+
+"""
+Progressive (coarse to fine) ordering of the blocks. In raster order, the first chords of a piece only hold the top rows
+of the image. In progressive order, the blocks come level by level like the levels of a mipmap: first the block at the
+top left corner, then the new blocks on every 32nd row and column, on every 16th row and column... down to the remaining
+blocks. Each level doubles the resolution of the image, so the first chords already cover the whole image.
+
+A block that has not been received yet takes the value of its parent: the block at the corner of the square of the
+previous level it lies in, which always comes before it. The preview of the first N chords is then a complete image,
+refined as more chords are decoded.
+
+The order is recorded in the piece by a header note before the blocks, played at the reserved PROGRESSIVE_VELOCITY
+(below conversion.min_vol and distinct from quadtree.MARKER_VELOCITY). The header is encoded by the cypher like any
+other note, so every cypher and backend carries it.
+"""
+
+# Velocity of the header note of a piece in progressive order, the notes of the blocks are at least conversion.min_vol
+PROGRESSIVE_VELOCITY = 2
+
+
+def _steps(split_number: Tuple[int, int]) -> Tuple[np.ndarray, int]:
+    """
+    The spacing, in blocks, of the level of every block in raster order, and the spacing of the first level
+    """
+    top = 1 << max(max(split_number) - 1, 0).bit_length()
+    rows, cols = np.indices(split_number).reshape(2, -1)
+    # The largest power of two dividing both coordinates, 0 is divided by all of them
+    lowest = np.where(rows > 0, rows & -rows, top), np.where(cols > 0, cols & -cols, top)
+    return np.minimum(np.minimum(*lowest), top), top
+
+
+def progressive_order(split_number: Tuple[int, int]) -> np.ndarray:
+    """
+    Lists the blocks in progressive order
+    :param split_number: the number of (rows, cols) blocks of the grid
+    :return: the raster index of each block, in the order they are encoded
+    """
+    steps, _ = _steps(split_number)
+    # Coarse levels first, the blocks of a level stay in raster order
+    return np.argsort(-steps, kind='stable')
+
+
+def parents(split_number: Tuple[int, int]) -> np.ndarray:
+    """
+    The block each block takes its value from while it hasn't been received
+    :param split_number: the number of (rows, cols) blocks of the grid
+    :return: the raster index of the parent of each block in raster order, the first block is its own parent
+    """
+    steps, top = _steps(split_number)
+    rows, cols = np.indices(split_number).reshape(2, -1)
+    mask = ~(np.minimum(steps * 2, top) - 1)
+    return (rows & mask) * split_number[1] + (cols & mask)
+
+
+def order_batch(batch: 'musicgen.NoteBatch', split_number: Tuple[int, int],
+                header_quarter_length: float) -> 'musicgen.NoteBatch':
+    """
+    Puts the notes of the blocks in progressive order, after the header note
+    :param batch: the notes of the blocks in raster order
+    :param split_number: the number of (rows, cols) blocks of the grid
+    :param header_quarter_length: the quarter_length of the header note
+    :return: the notes to encode
+    """
+    ordered = batch[progressive_order(split_number)]
+    return musicgen.NoteBatch(np.concatenate(([0], ordered.degrees)),
+                              np.concatenate(([header_quarter_length], ordered.quarter_lengths)),
+                              np.concatenate(([PROGRESSIVE_VELOCITY], ordered.velocities)), batch.names)
+
+
+def is_progressive(batch: 'musicgen.NoteBatch') -> bool:
+    """
+    Whether decoded notes start with the header of the progressive order
+    """
+    return len(batch) > 0 and np.rint(batch.velocities[0]) == PROGRESSIVE_VELOCITY
+
+
+def fill_blocks(received: int, split_number: Tuple[int, int]) -> np.ndarray:
+    """
+    Maps every block to the one whose value it shows once the first blocks are received
+    :param received: the number of blocks received, in progressive order (without the header), at least 1
+    :param split_number: the number of (rows, cols) blocks of the grid
+    :return: the index in the progressive order of the block shown by each block in raster order
+    """
+    steps, _ = _steps(split_number)
+    order = np.argsort(-steps, kind='stable')
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    parent = parents(split_number)
+
+    # The parents are on coarser levels, they are resolved first
+    source = position.copy()
+    missing = position >= received
+    for step in np.unique(steps)[::-1]:
+        level = np.flatnonzero(missing & (steps == step))
+        source[level] = source[parent[level]]
+    return source
@@ -0,0 +1,222 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import conversion
+import musicgen
+from conversion import SPLIT_NUMBER
+from musicgen.instrumentation import span
+
+"""
+Adaptive subdivision of the image. Instead of a note for every block of the SPLIT_NUMBER grid, the grid is covered by
+square root nodes that are split in four (top left, top right, bottom left, bottom right) only where the pixels of the
+node vary more than a threshold, down to single blocks. Uniform areas become a single note.
+
+The tree is written in preorder: a split node is a marker note followed by the notes of its four children, a leaf is the
+note of the median of its pixels. The markers have the reserved MARKER_VELOCITY, below conversion.min_vol, so they are
+told apart from the leaves when decoding. Everything else (chords, cyphers, *.mid files) is unchanged, the decoded image
+is the SPLIT_NUMBER grid with every leaf filling its blocks.
+
+Every split node costs a marker note, so on detailed images the tree can have more notes than the grid has blocks. The
+grid is then written in raster order instead, as conversion.encode_image does. A tree is only written when it has fewer
+notes than the grid has blocks, so a piece with exactly one note per block is always a raster grid.
+
+Example:
+    music = encode_image(image, threshold=16)
+    image = decode_midi(music)
+"""
+
+# Velocity of the notes marking a split node, the notes of the blocks are at least conversion.min_vol
+MARKER_VELOCITY = 1
+
+# Standard deviation of the pixels of a node (in any channel) above which it is split
+DEFAULT_THRESHOLD = 16.
+
+
+def root_size(split_number: Tuple[int, int]) -> int:
+    """
+    The side in blocks of the root nodes, the largest power of two dividing both dimensions of the grid
+    :param split_number: the number of (rows, cols) blocks of the grid
+    """
+    size = 1
+    while split_number[0] % (size * 2) == 0 and split_number[1] % (size * 2) == 0:
+        size *= 2
+    return size
+
+
+def _spreads(image: np.ndarray, split_number: Tuple[int, int], depth: int) -> List[np.ndarray]:
+    """
+    The largest standard deviation of the channels of the nodes of every level, level k has nodes of 2^k blocks. The
+    sums of the pixels of the blocks are added up from one level to the next instead of going over the pixels again.
+    """
+    rows, cols = split_number
+    blocks = image.reshape(rows, image.shape[0] // rows, cols, image.shape[1] // cols, 3).astype(np.float64)
+    sums = blocks.sum(axis=(1, 3))
+    squares = np.square(blocks).sum(axis=(1, 3))
+    count = blocks.shape[1] * blocks.shape[3]
+
+    spreads = []
+    for level in range(depth + 1):
+        if level:
+            shape = (sums.shape[0] // 2, 2, sums.shape[1] // 2, 2, 3)
+            sums = sums.reshape(shape).sum(axis=(1, 3))
+            squares = squares.reshape(shape).sum(axis=(1, 3))
+            count *= 4
+        variance = np.maximum(squares / count - np.square(sums / count), 0)
+        spreads.append(np.sqrt(variance.max(axis=2)))
+
+    return spreads
+
+
+def _leaf_features(image: np.ndarray, split_number: Tuple[int, int], leaves: List[Tuple[int, int, int]]) -> np.ndarray:
+    """
+    The median of every channel of the pixels of each leaf, only the pixels of the leaves of a level are reduced
+    :return: the (3, leaves) raw features of the leaves, in the order of leaves
+    """
+    features = np.empty((3, len(leaves)))
+    nodes = np.array(leaves, dtype=np.intp).reshape(-1, 3)
+
+    for level in np.unique(nodes[:, 0]):
+        selected = np.flatnonzero(nodes[:, 0] == level)
+        rows, cols = split_number[0] >> level, split_number[1] >> level
+        height, width = image.shape[0] // rows, image.shape[1] // cols
+
+        # (rows, cols, 3, height, width) view of the nodes of the level, only the leaves are copied
+        blocks = image.reshape(rows, height, cols, width, 3).transpose(0, 2, 4, 1, 3)
+        pixels = blocks[nodes[selected, 1], nodes[selected, 2]].reshape(len(selected), 3, height * width)
+        features[:, selected] = np.median(pixels, axis=2).T
+
+    return features
+
+
+def quadtree_notes(image: np.ndarray, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                   threshold: float = DEFAULT_THRESHOLD,
+                   available_notes: Optional[List[str]] = None) -> 'musicgen.NoteBatch':
+    """
+    Subdivides the image and lists the notes of the tree in preorder
+    :param image: the image to convert
+    :param split_number: the number of (rows, cols) blocks of the finest subdivision
+    :param threshold: the standard deviation of the pixels of a node above which it is split
+    :param available_notes: the available notes for the audio conversion to use
+    :return: the notes of the tree, the split nodes are the notes with the MARKER_VELOCITY. The notes of the blocks in
+    raster order when the tree isn't smaller than the grid.
+    """
+    available_notes = conversion.default_notes() if available_notes is None else available_notes
+
+    if conversion.min_vol <= MARKER_VELOCITY:
+        raise ValueError(f"The volumes have to stay above the velocity of the split markers ({MARKER_VELOCITY})")
+
+    depth = root_size(split_number).bit_length() - 1
+    image = conversion.fit_to_grid(image, split_number)
+    with span('image.block_statistics'):
+        spreads = _spreads(image, split_number, depth)
+
+    # Preorder traversal, the nodes are (level, row, col) in the blocks of their level
+    leaves = []
+    markers = []
+    stack = [(depth, row, col) for row in range(split_number[0] >> depth) for col in range(split_number[1] >> depth)]
+    stack.reverse()
+    while stack:
+        level, row, col = stack.pop()
+        if level > 0 and spreads[level][row, col] > threshold:
+            markers.append(len(leaves) + len(markers))
+            # Pushed in reverse so that the top left child comes out first
+            for child_row, child_col in ((1, 1), (1, 0), (0, 1), (0, 0)):
+                stack.append((level - 1, 2 * row + child_row, 2 * col + child_col))
+        else:
+            leaves.append((level, row, col))
+
+    if len(leaves) + len(markers) >= split_number[0] * split_number[1]:
+        with span('image.block_statistics'):
+            return conversion.features_to_batch(*conversion.block_statistics(image, split_number), available_notes)
+
+    with span('image.block_statistics'):
+        features = _leaf_features(image, split_number, leaves)
+    leaf_notes = conversion.features_to_batch(*features, available_notes)
+
+    is_leaf = np.ones(len(leaves) + len(markers), dtype=bool)
+    is_leaf[markers] = False
+
+    degrees = np.zeros(len(is_leaf), dtype=np.uint8)
+    quarter_lengths = np.full(len(is_leaf), float(conversion.min_quarter_length))
+    velocities = np.full(len(is_leaf), float(MARKER_VELOCITY))
+    degrees[is_leaf] = leaf_notes.degrees
+    quarter_lengths[is_leaf] = leaf_notes.quarter_lengths
+    velocities[is_leaf] = leaf_notes.velocities
+
+    return musicgen.NoteBatch(degrees, quarter_lengths, velocities, available_notes)
+
+
+def notes_to_image(notes: 'musicgen.NoteBatch', split_number: Tuple[int, int] = SPLIT_NUMBER) -> np.ndarray:
+    """
+    Rebuilds the grid from the notes of the tree
+    :param notes: the decoded notes, in preorder, or in raster order with one note per block
+    :param split_number: the number of (rows, cols) blocks of the finest subdivision
+    :return: the reconstructed (rows, cols, 3) image
+    """
+    if len(notes) == split_number[0] * split_number[1]:
+        return conversion.batch_to_image(notes, split_number)
+
+    size = root_size(split_number)
+    markers = np.rint(notes.velocities) == MARKER_VELOCITY
+
+    # The index of the note of every block
+    blocks = np.empty(split_number, dtype=np.intp)
+    position = 0
+    stack = [(size, row * size, col * size) for row in range(split_number[0] // size)
+             for col in range(split_number[1] // size)]
+    stack.reverse()
+    while stack:
+        side, row, col = stack.pop()
+        if position >= len(markers):
+            raise ValueError("The notes end before the tree does")
+        if markers[position] and side > 1:
+            half = side // 2
+            for child_row, child_col in ((1, 1), (1, 0), (0, 1), (0, 0)):
+                stack.append((half, row + child_row * half, col + child_col * half))
+        else:
+            blocks[row:row + side, col:col + side] = position
+        position += 1
+
+    indices = blocks.ravel()
+    return conversion.quantizer(notes.names).dequantize(notes.degrees[indices], notes.quarter_lengths[indices],
+                                                         notes.velocities[indices], split_number)
+
+
+def encode_image(image: np.ndarray, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                 cypher: Optional['musicgen.rules.Rules'] = None, available_notes: Optional[List[str]] = None,
+                 threshold: float = DEFAULT_THRESHOLD, workers: int = 1) -> bytes:
+    """
+    Same as conversion.encode_image with an adaptive subdivision of the image
+    :param image: the image to convert
+    :param split_number: the number of (rows, cols) blocks of the finest subdivision
+    :param cypher: It is the cypher used to convert from the music and back
+    :param available_notes: the available notes for the audio conversion to use
+    :param threshold: the standard deviation of the pixels of a node above which it is split
+    :param workers: the number of processes serializing the chord progression, only for the cyphers that support it,
+    see musicgen.parallel_chords
+    :return: the content of the *.mid file
+    """
+    cypher = conversion.default_cypher() if cypher is None else cypher
+    available_notes = conversion.default_notes() if available_notes is None else available_notes
+
+    notes = quadtree_notes(image, split_number, threshold, available_notes)
+    return musicgen.create_chords(notes, cypher, 'midi', workers)
+
+
+def decode_midi(data: bytes, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                cypher: Optional['musicgen.rules.Cypher'] = None, notes_list: Optional[List[str]] = None) -> np.ndarray:
+    """
+    Converts the content of a *.mid file written by encode_image back into the image
+    :param data: the content of the *.mid file
+    :param split_number: the number of (rows, cols) blocks of the finest subdivision
+    :param cypher: It is the cypher used to convert from the music and back
+    :param notes_list: the notes that were available for the audio conversion
+    :return: the reconstructed (rows, cols, 3) image
+    """
+    cypher = conversion.default_cypher() if cypher is None else cypher
+    notes_list = conversion.default_notes() if notes_list is None else notes_list
+
+    notes = musicgen.decode(data, cypher, 'midi', notes_list)
+    with span('image.reconstruct'):
+        return notes_to_image(notes, split_number)
@@ -0,0 +1,108 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+import musicgen
+
+"""
+Normalization of the block features into notes and its inverse, configured in one place. A Quantizer is built once from
+the ranges of the conversion (the available notes, the quarter_length and the volume ranges) and precomputes lookup
+tables for the values that are already indices:
+
+    note index -> pixel:  the 0-255 value of the note channel of each available note
+    note letter -> index: the first index of each letter in the available notes, instead of a list.index per note
+
+The note index lookups are single NumPy gathers. Only these two directions have tables: the forward mappings (block
+feature -> degree, quarter_length and volume) and the decoded quarter_lengths and volumes -> pixels are still the
+vectorized formulas. The medians of 0-255 pixels are multiples of .5, so they could index 511 entry tables by 2 *
+median, but the gather itself is slower than the arithmetic it would replace: at 262144 blocks, 2.2 ms per channel for
+table.take((features * 2).astype(np.intp)) against 0.5 ms for the degree or the volume formula and 2.4 ms for the
+quarter_length one, before checking that the features do fall on the entries (1.5-2 ms more, the 'mean' statistic gives
+other values).
+"""
+
+# Value of the letter table for the letters that aren't available notes
+MISSING_NOTE = 255
+
+
+def _note_pixels(degrees: np.ndarray, note_count: int) -> np.ndarray:
+    return degrees / (note_count - 1) * 255
+
+
+class Quantizer:
+    def __init__(self, notes: Sequence[str], quarter_length_range: Tuple[float, float],
+                 volume_range: Tuple[float, float]):
+        """
+        Precomputes the lookup tables of a conversion
+        :param notes: the available notes for the audio conversion to use
+        :param quarter_length_range: the (min, max) quarter_length of the notes
+        :param volume_range: the (min, max) volume of the notes
+        """
+        self.notes: List[str] = list(notes)
+        self.quarter_length_range = quarter_length_range
+        self.volume_range = volume_range
+
+        self.note_pixel_table = _note_pixels(np.arange(len(self.notes)), len(self.notes)).astype(np.uint8)
+
+        self.letter_table = np.full(128, MISSING_NOTE, dtype=np.uint8)
+        for index, note in reversed(list(enumerate(self.notes))):
+            self.letter_table[ord(note[0])] = index
+
+    def quantize(self, notes: np.ndarray, quarter_length: np.ndarray, volume: np.ndarray) -> 'musicgen.NoteBatch':
+        """
+        Normalizes the raw block features (0-255) into notes
+        :param notes: the raw note feature of each block
+        :param quarter_length: the raw quarter_length feature of each block
+        :param volume: the raw volume feature of each block
+        :return: the NoteBatch of the blocks, its degrees index the available notes
+        """
+        min_quarter_length, max_quarter_length = self.quarter_length_range
+        min_vol, max_vol = self.volume_range
+
+        degrees = np.rint(notes / 255 * (len(self.notes) - 1))
+
+        # Makes sure that the quarter-length are increments of 0.25
+        quarter_length = quarter_length / 255
+        quarter_length = quarter_length * (max_quarter_length - min_quarter_length) + min_quarter_length
+        quarter_length = np.rint(quarter_length / .25) * .25
+
+        volume = volume / 255
+        volume = volume * (max_vol - min_vol) + min_vol
+
+        return musicgen.NoteBatch(degrees, quarter_length, volume, self.notes)
+
+    def note_indices(self, notes: Sequence[str]) -> np.ndarray:
+        """
+        Looks up the index of notes from their letter
+        :param notes: the names of the notes ('A', 'C4', ...)
+        :return: the first index in the available notes of the letter of each note
+        """
+        letters = np.array(notes, dtype='U1').view(np.uint32)
+        if letters.size and letters.max() >= len(self.letter_table):
+            raise ValueError("The notes are not all available notes")
+
+        indices = self.letter_table.take(letters)
+        if np.any(indices == MISSING_NOTE):
+            raise ValueError("The notes are not all available notes")
+        return indices
+
+    def dequantize(self, degrees: np.ndarray, quarter_lengths: np.ndarray, volumes: np.ndarray,
+                   split_number: Tuple[int, int]) -> np.ndarray:
+        """
+        Inverse of quantize, converts the notes back to the pixels of the image
+        :param degrees: the index in the available notes of each note
+        :param quarter_lengths: the duration of each note
+        :param volumes: the volume of each note
+        :param split_number: the number of (rows, cols) blocks the image was split into
+        :return: the reconstructed (rows, cols, 3) image
+        """
+        min_quarter_length, max_quarter_length = self.quarter_length_range
+        min_vol, max_vol = self.volume_range
+
+        new_image = np.empty((split_number[0] * split_number[1], 3), dtype=np.uint8)
+        new_image[:, 0] = self.note_pixel_table.take(np.asarray(degrees, dtype=np.intp))
+        new_image[:, 1] = ((quarter_lengths - min_quarter_length) * 255 /
+                           (max_quarter_length - min_quarter_length)).astype(np.uint8)
+        new_image[:, 2] = ((volumes - min_vol) * 255 / (max_vol - min_vol)).astype(np.uint8)
+
+        return new_image.reshape(split_number[0], split_number[1], 3)
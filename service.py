@@ -0,0 +1,411 @@
+import argparse
+import asyncio
+import copy
+import http.client
+import json
+import socket
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import conversion
+import musicgen
+from cli import resolve_key
+from musicgen.instrumentation import LatencyHistogram
+
+"""
+Local conversion service. An asyncio HTTP server (over TCP or a Unix socket) queues the conversions and runs them on a
+pool of warm worker processes, each of them holding pre-built cyphers, so that the callers don't pay for importing
+music21 and building the cypher.
+
+    POST /encode?rows=64&cols=64&key=A_MINOR   image file -> *.mid file
+    POST /decode?rows=64&cols=64&key=A_MINOR   *.mid file -> *.png image
+    GET  /metrics                              queue depth, job counters and latency histograms (JSON)
+
+The job queue is bounded: once it is full the server answers 503 (with a Retry-After header) instead of queuing more
+work, and a job that takes longer than the timeout is answered with 504. A file that can't be converted is answered with
+400, any other failure (e.g. a worker process that died) with 500.
+
+Example: python service.py --port 8765 --workers 4, then ServiceClient('127.0.0.1', 8765).encode(image_bytes)
+"""
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_BODY_SIZE = 64 * 1024 * 1024  # bytes
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+               500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+# The file of a request couldn't be parsed, whatever the parser raised
+class InputError(ValueError):
+    pass
+
+
+# Errors of the conversion caused by the request, answered with 400: a file that can't be parsed (InputError), an
+# unknown key...
+CLIENT_ERRORS = (ValueError, struct.error)
+
+# Per worker cyphers and available notes by key name, see _init_worker. The jobs convert with copies of the cyphers.
+_worker_cyphers: Dict[str, Tuple['musicgen.rules.Rules', List[str]]] = {}
+
+
+def _init_worker(key_names: List[str]) -> None:
+    """
+    Builds the cyphers of the keys served by default, once per worker process
+    """
+    for key_name in key_names:
+        _worker_cypher(key_name)
+
+
+def _worker_cypher(key_name: str) -> Tuple['musicgen.rules.Rules', List[str]]:
+    if key_name not in _worker_cyphers:
+        key = resolve_key(key_name)
+        _worker_cyphers[key_name] = musicgen.rules.CompiledTriadBaroqueCypher(key), conversion.key_notes(key)
+    return _worker_cyphers[key_name]
+
+
+def _ping() -> None:
+    pass
+
+
+def run_job(kind: str, data: bytes, split_number: Tuple[int, int], key_name: str) -> bytes:
+    """
+    Runs a conversion inside of a worker process
+    :param kind: 'encode' for image -> *.mid, 'decode' for *.mid -> *.png
+    :param data: the content of the file to convert
+    :param split_number: the number of (rows, cols) blocks of the image
+    :param key_name: the key of the cypher, see cli.resolve_key
+    :return: the content of the converted file
+    """
+    cypher, notes = _worker_cypher(key_name)
+    # The first chord can move the tonic of the key of the cypher, every job starts from a copy of the pre-built one so
+    # that the same request always gets the same response
+    cypher = copy.deepcopy(cypher)
+    if kind == 'encode':
+        try:
+            image = conversion.read_image_bytes(data)
+        except MemoryError:
+            raise
+        except Exception as error:
+            raise InputError(f"{type(error).__name__}: {error}") from error
+        return conversion.encode_image(image, split_number, cypher, notes)
+
+    try:
+        # The whole decode parses the *.mid file of the request, any error comes from its content
+        image = conversion.decode_midi(data, split_number, cypher, notes)
+    except MemoryError:
+        raise
+    except Exception as error:
+        raise InputError(f"{type(error).__name__}: {error}") from error
+    return conversion.image_bytes(image)
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Job(NamedTuple):
+    kind: str
+    data: bytes
+    split_number: Tuple[int, int]
+    key_name: str
+    queued: float
+    response: asyncio.Future
+
+
+class ConversionService:
+    def __init__(self, workers: int = 2, queue_size: int = 16, timeout: float = 60.,
+                 key_names: Tuple[str, ...] = ('A_MINOR',)):
+        """
+        The job queue and the worker pool behind the HTTP server
+
+        :param workers: the number of worker processes, which is also the number of jobs running at once
+        :param queue_size: the number of jobs that can wait for a worker, the next ones are rejected with a 503
+        :param timeout: the seconds a job can take, queuing included, before it is answered with a 504
+        :param key_names: the keys whose cyphers are built as soon as the workers start
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.key_names = key_names
+
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.dispatchers: List[asyncio.Task] = []
+
+        self.running = 0
+        self.counters = {'completed': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0}
+        self.latencies = LatencyHistogram()
+
+    async def start(self) -> None:
+        """
+        Starts the worker processes and waits for them to be ready
+        """
+        loop = asyncio.get_running_loop()
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(list(self.key_names),))
+        await asyncio.gather(*(loop.run_in_executor(self.executor, _ping) for _ in range(self.workers)))
+
+        self.queue = asyncio.Queue(self.queue_size)
+        self.dispatchers = [asyncio.ensure_future(self._dispatch()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, kind: str, data: bytes, split_number: Tuple[int, int], key_name: str) -> bytes:
+        """
+        Queues a conversion and waits for its result
+        :return: the content of the converted file
+        """
+        job = Job(kind, data, split_number, key_name, time.perf_counter(), asyncio.get_running_loop().create_future())
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counters['rejected'] += 1
+            raise HttpError(503, "The job queue is full", {'Retry-After': '1'})
+
+        try:
+            return await asyncio.wait_for(job.response, self.timeout)
+        except asyncio.TimeoutError:
+            # wait_for cancelled the response: the dispatchers skip the job if it is still queued, and drop it from the
+            # worker pool if no worker picked it up yet
+            self.counters['timed_out'] += 1
+            raise HttpError(504, f"The conversion took more than {self.timeout:g}s")
+
+    async def _dispatch(self) -> None:
+        """
+        Hands the queued jobs to the worker pool, one at a time. A job that a worker already runs can't be stopped, a
+        dispatcher stays busy until its worker is done, even if the caller already timed out, so that no more than one
+        job per worker is running.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            job: Job = await self.queue.get()
+            if job.response.done():
+                continue
+
+            self.latencies('queue.wait', time.perf_counter() - job.queued)
+            self.running += 1
+            future = self.executor.submit(run_job, job.kind, job.data, job.split_number, job.key_name)
+            # Does nothing once a worker runs the job
+            job.response.add_done_callback(lambda response, future=future: future.cancel())
+            try:
+                result = await asyncio.wrap_future(future, loop=loop)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller timed out before a worker picked up the job
+            except CLIENT_ERRORS as error:
+                self.counters['failed'] += 1
+                if not job.response.done():
+                    job.response.set_exception(HttpError(400, f"Could not convert the file: {error}"))
+            except Exception as error:
+                self.counters['failed'] += 1
+                if not job.response.done():
+                    job.response.set_exception(HttpError(500, f"The conversion failed: {type(error).__name__}: "
+                                                              f"{error}"))
+            else:
+                self.counters['completed'] += 1
+                self.latencies(f'job.{job.kind}', time.perf_counter() - job.queued)
+                if not job.response.done():
+                    job.response.set_result(result)
+            finally:
+                self.running -= 1
+
+    def metrics(self) -> Dict:
+        return {'queue_depth': self.queue.qsize(), 'queue_size': self.queue_size, 'running': self.running,
+                'workers': self.workers, **self.counters, 'latency': self.latencies.snapshot()}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serves a single HTTP request per connection
+        """
+        try:
+            status, content_type, body, headers = 200, 'application/json', b'', {}
+            try:
+                method, target, request_headers = await _read_head(reader)
+                length = int(request_headers.get('content-length', 0))
+                if length > MAX_BODY_SIZE:
+                    raise HttpError(413, f"The body can't be larger than {MAX_BODY_SIZE} bytes")
+                data = await reader.readexactly(length)
+
+                content_type, body = await self._route(method, target, data)
+            except HttpError as error:
+                status, headers = error.status, error.headers
+                content_type, body = 'application/json', json.dumps({'error': str(error)}).encode()
+            except (ValueError, asyncio.IncompleteReadError) as error:
+                status = 400
+                content_type, body = 'application/json', json.dumps({'error': str(error)}).encode()
+
+            head = [f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}', f'Content-Type: {content_type}',
+                    f'Content-Length: {len(body)}', 'Connection: close']
+            head += [f'{name}: {value}' for name, value in headers.items()]
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, target: str, data: bytes) -> Tuple[str, bytes]:
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if url.path == '/metrics':
+            if method != 'GET':
+                raise HttpError(405, "Use GET")
+            return 'application/json', json.dumps(self.metrics()).encode()
+
+        if url.path not in ('/encode', '/decode'):
+            raise HttpError(404, f"Unknown path {url.path}")
+        if method != 'POST':
+            raise HttpError(405, "Use POST")
+
+        split_number = (int(query.get('rows', conversion.SPLIT_NUMBER[0])),
+                        int(query.get('cols', conversion.SPLIT_NUMBER[1])))
+        if min(split_number) < 1:
+            raise HttpError(400, "rows and cols have to be positive")
+
+        kind = url.path[1:]
+        result = await self.submit(kind, data, split_number, query.get('key', self.key_names[0]))
+        return ('audio/midi' if kind == 'encode' else 'image/png'), result
+
+
+async def _read_head(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str]]:
+    """
+    Reads the request line and the headers of an HTTP request
+    :return: the method, the request target and the headers with lower case names
+    """
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    parts = request_line.split()
+    if len(parts) != 3:
+        raise ValueError(f"Malformed request line: {request_line!r}")
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    return parts[0], parts[1], headers
+
+
+async def serve(service: ConversionService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                unix_socket: Optional[str] = None) -> None:
+    """
+    Runs the HTTP server until it is cancelled
+    :param service: the service answering the requests
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :param unix_socket: the path of a Unix socket to listen on instead of host and port
+    """
+    await service.start()
+    if unix_socket is not None:
+        server = await asyncio.start_unix_server(service.handle, unix_socket)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+
+    print(f"Serving on {unix_socket or f'http://{host}:{port}'} with {service.workers} workers")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ServiceClient:
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, timeout: Optional[float] = None,
+                 unix_socket: Optional[str] = None):
+        """
+        Client of a local conversion service
+
+        :param host: the address of the service
+        :param port: the port of the service
+        :param timeout: the socket timeout in seconds
+        :param unix_socket: the path of the Unix socket of the service, instead of host and port
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.unix_socket = unix_socket
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        """
+        :return: the status and the body of the response
+        """
+        if self.unix_socket is not None:
+            connection = _UnixConnection(self.unix_socket, self.timeout)
+        else:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request(method, path, body)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def _convert(self, path: str, data: bytes, split_number: Tuple[int, int], key_name: str) -> bytes:
+        query = urlencode({'rows': split_number[0], 'cols': split_number[1], 'key': key_name})
+        status, body = self.request('POST', f"{path}?{query}", data)
+        if status != 200:
+            raise RuntimeError(f"{status}: {json.loads(body)['error']}")
+        return body
+
+    def encode(self, image: bytes, split_number: Tuple[int, int] = conversion.SPLIT_NUMBER,
+               key_name: str = 'A_MINOR') -> bytes:
+        """
+        Converts the content of an image file to the content of a *.mid file
+        """
+        return self._convert('/encode', image, split_number, key_name)
+
+    def decode(self, music: bytes, split_number: Tuple[int, int] = conversion.SPLIT_NUMBER,
+               key_name: str = 'A_MINOR') -> bytes:
+        """
+        Converts the content of a *.mid file to the content of a *.png image
+        """
+        return self._convert('/decode', music, split_number, key_name)
+
+    def metrics(self) -> Dict:
+        return json.loads(self.request('GET', '/metrics')[1])
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local image <-> music conversion service")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument('--unix-socket', default=None, help="listen on this Unix socket instead of host and port")
+    parser.add_argument('-j', '--workers', type=int, default=2, help="number of warm worker processes")
+    parser.add_argument('--queue-size', type=int, default=16, help="number of jobs waiting before rejecting requests")
+    parser.add_argument('--timeout', type=float, default=60., help="seconds before a job is answered with a 504")
+    parser.add_argument('--keys', nargs='+', default=['A_MINOR'],
+                        help="keys whose cyphers are pre-built, the first one is the default key")
+    parsed = parser.parse_args(args)
+
+    service = ConversionService(parsed.workers, parsed.queue_size, parsed.timeout, tuple(parsed.keys))
+    try:
+        asyncio.run(serve(service, parsed.host, parsed.port, parsed.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
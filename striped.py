@@ -0,0 +1,97 @@
+import os
+from itertools import repeat
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import conversion
+from conversion import SPLIT_NUMBER
+from musicgen.instrumentation import span
+
+"""
+Parallel feature extraction of a single large image. The image is resized straight into a multiprocessing.shared_memory
+buffer, and a pool of worker processes reduces horizontal stripes of rows of blocks, each of them viewing its stripe in
+the buffer without copying it. Only the name of the buffer and the bounds of the stripes are sent to the workers, and
+only the three feature arrays of each stripe come back. Every block is reduced by the same block_statistics call as in
+conversion.split_image_transform, so the features are the same bit for bit.
+
+Starting the processes costs more than reducing small images, below MIN_PARALLEL_PIXELS the image is reduced in the
+calling process.
+"""
+
+# Number of pixels of the resized image below which the blocks are reduced in the calling process
+MIN_PARALLEL_PIXELS = 4096 * 4096
+
+# Number of stripes per worker, more stripes than workers evens out the time they take
+STRIPES_PER_WORKER = 2
+
+Features = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def stripes(rows: int, count: int) -> List[Tuple[int, int]]:
+    """
+    Splits the rows of blocks into contiguous stripes of nearly the same number of rows
+    :param rows: the number of rows of blocks of the grid
+    :param count: the number of stripes, there are at most rows stripes
+    :return: the (first row, last row + 1) of each stripe, from top to bottom
+    """
+    bounds = np.linspace(0, rows, min(count, rows) + 1).round().astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _stripe_features(name: str, shape: Tuple[int, ...], dtype: str, split_number: Tuple[int, int],
+                     stripe: Tuple[int, int]) -> Features:
+    """
+    Reduces the blocks of a stripe of the image in the shared memory buffer, in a worker process
+    """
+    buffer = shared_memory.SharedMemory(name=name)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=buffer.buf)
+        d_height = shape[0] // split_number[0]
+        first, last = stripe
+        features = conversion.block_statistics(image[first * d_height:last * d_height], (last - first, split_number[1]))
+        # The views of the buffer have to be gone before it is closed
+        del image
+        return features
+    finally:
+        buffer.close()
+
+
+def split_image_transform(image: np.ndarray, split_number: Tuple[int, int] = SPLIT_NUMBER,
+                          workers: Optional[int] = None,
+                          min_pixels: int = MIN_PARALLEL_PIXELS) -> Features:
+    """
+    Same as conversion.split_image_transform, with the blocks reduced over a pool of worker processes
+    :param image: the input image to retrieve the features from
+    :param split_number: the number of (rows, cols) blocks to split the image into
+    :param workers: the number of worker processes, defaults to the number of CPUs
+    :param min_pixels: the number of pixels of the resized image below which the blocks are reduced in the calling
+    process
+    :return: the three raw extracted features: the notes, the quarter_length and the volume
+    """
+    workers = workers or os.cpu_count() or 1
+    height, width = conversion.grid_size(image.shape, split_number)
+    if workers == 1 or split_number[0] == 1 or height * width < min_pixels:
+        return conversion.split_image_transform(image, split_number, 1)
+
+    shape = (height, width) + image.shape[2:]
+    buffer = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * image.dtype.itemsize)
+    try:
+        resized = np.ndarray(shape, dtype=image.dtype, buffer=buffer.buf)
+        conversion.fit_to_grid(image, split_number, resized)
+        del resized
+
+        bounds = stripes(split_number[0], workers * STRIPES_PER_WORKER)
+
+        # Only imported when needed, the stripe workers import this module
+        from concurrent.futures import ProcessPoolExecutor
+
+        with span('image.block_statistics'), ProcessPoolExecutor(max_workers=min(workers, len(bounds))) as executor:
+            features = list(executor.map(_stripe_features, repeat(buffer.name), repeat(shape),
+                                         repeat(image.dtype.str), repeat(split_number), bounds))
+    finally:
+        buffer.close()
+        buffer.unlink()
+
+    return tuple(np.concatenate([stripe[channel] for stripe in features]) for channel in range(3))
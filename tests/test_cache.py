@@ -0,0 +1,35 @@
+import copy
+
+import numpy as np
+import pytest
+
+import cache
+import conversion
+import keys
+import musicgen
+
+"""
+The cached encode against conversion.encode_image, when it reports its progress
+"""
+
+# Rows of 24 blocks, the runs of 16 blocks of a RunLengthTriadBaroqueCypher cross them
+SPLIT_NUMBER = (8, 24)
+
+CYPHERS = ['TriadBaroqueCypher', 'CompiledTriadBaroqueCypher', 'RunLengthTriadBaroqueCypher',
+           'MultiVoiceTriadBaroqueCypher']
+
+
+def fresh_cypher(cypher_name: str) -> 'musicgen.rules.TriadBaroqueCypher':
+    # The first chord moves the tonic of the key in place, every encode starts from the key of keys.py
+    return getattr(musicgen.rules, cypher_name)(copy.deepcopy(keys.A_MINOR))
+
+
+@pytest.mark.parametrize('cypher_name', CYPHERS)
+def test_encode_with_progress_is_encode_image(tmp_path, cypher_name: str) -> None:
+    image = np.full((SPLIT_NUMBER[0] * 10, SPLIT_NUMBER[1] * 10, 3), 120, dtype=np.uint8)
+    image[40:] = 200
+    notes = conversion.key_notes(keys.A_MINOR)
+
+    music = cache.ConversionCache(str(tmp_path)).encode_image(image, SPLIT_NUMBER, fresh_cypher(cypher_name), notes,
+                                                              progress=lambda done, total: None)
+    assert music == conversion.encode_image(image, SPLIT_NUMBER, fresh_cypher(cypher_name), notes)
@@ -0,0 +1,36 @@
+import copy
+import os
+
+import cv2
+import pytest
+
+import conversion
+import incremental
+import keys
+import musicgen
+
+"""
+The incremental encode against a full encode, in keys whose first chord moves the tonic of the key
+"""
+
+IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images', 'Mona_Lisa.jpg')
+SPLIT_NUMBER = (32, 32)
+
+
+def fresh_cypher(key_name: str) -> 'musicgen.rules.CompiledTriadBaroqueCypher':
+    # The first chord moves the tonic of the key in place, every encode starts from the key of keys.py
+    return musicgen.rules.CompiledTriadBaroqueCypher(copy.deepcopy(getattr(keys, key_name)))
+
+
+@pytest.mark.parametrize('key_name', ['A_MINOR', 'C_MAJOR', 'Fs_MAJOR'])
+def test_incremental_encode_is_a_full_encode(key_name: str) -> None:
+    notes = conversion.key_notes(getattr(keys, key_name))
+    image = cv2.imread(IMAGE)
+    music, sidecar = incremental.encode_with_sidecar(image, SPLIT_NUMBER, fresh_cypher(key_name), notes, 64)
+    assert music == conversion.encode_image(image, SPLIT_NUMBER, fresh_cypher(key_name), notes)
+
+    changed = image.copy()
+    changed[500:600, 300:400] = 255
+    music, sidecar, blocks = incremental.reencode(changed, music, sidecar, SPLIT_NUMBER, fresh_cypher(key_name), notes)
+    assert music == conversion.encode_image(changed, SPLIT_NUMBER, fresh_cypher(key_name), notes)
+    assert blocks < SPLIT_NUMBER[0] * SPLIT_NUMBER[1]
@@ -1,39 +1,55 @@
+import io
 import os
 import platform
+import queue
 import subprocess
+import threading
 from io import TextIOWrapper
 from tkinter.filedialog import askopenfile, asksaveasfile
-from typing import List, Tuple
+from typing import List, NamedTuple, Optional, Tuple, Union
 
 import cv2
 import numpy as np
 import pygubu
+from music21.stream import Stream
 
+import cache
+import conversion
 import musicgen
-from keys import *
-
-KEY = A_MINOR
-NOTES_LIST = list(map(lambda note: note.name[0], KEY.getPitches()))
-CYPHER = musicgen.rules.TriadBaroqueCypher(KEY)
-min_quarter_length = .25
-max_quarter_length = 2
-
-min_vol = 20
-max_vol = 127
+from conversion import KEY, NOTES_LIST, CYPHER, min_quarter_length, max_quarter_length, min_vol, max_vol
+from musicgen.instrumentation import profile, span
 
 """
 Python GUI that allows you convert an image to a *.mid music file and also allow you convert an *.mid file to an image
+
+The conversions run one after the other on a background thread, so that the window stays responsive. The thread reports
+its progress and its results through a queue that the Tk main loop polls.
 """
 
+# Milliseconds between two polls of the messages of the conversion thread
+POLL_INTERVAL = 50
+
+
+class Conversion(NamedTuple):
+    """
+    A conversion queued from the GUI
+    """
+    file: str
+    split_number: Tuple[int, int]
+
 
 class ImageAudioConverter:
-    SPLIT_NUMBER = (64, 64)  # (rows, cols)
+    SPLIT_NUMBER = conversion.SPLIT_NUMBER  # (rows, cols)
 
-    def __init__(self, notes: List[str]) -> None:
+    def __init__(self, notes: List[str], conversion_cache: Optional[cache.ConversionCache] = None,
+                 profile_output: Optional[str] = None) -> None:
         """
         The initialization function were we setup the GUI interface and the different instance variable
 
         :param notes: the available notes for the audio conversion to use
+        :param conversion_cache: the cache the conversions go through, None to always convert
+        :param profile_output: if set, the next conversion runs under cProfile and its statistics are dumped to this
+        file (see musicgen.instrumentation.profile)
         """
 
         # Operating system type (Windows, Linux of Mac)
@@ -42,6 +58,8 @@ class ImageAudioConverter:
         # 1: Create a builder
         self.notes = notes
         self.available_notes = notes
+        self.cache = conversion_cache
+        self.profile_output = profile_output
         self.builder = builder = pygubu.Builder()
 
         # 2: Load an ui file
@@ -56,6 +74,15 @@ class ImageAudioConverter:
         builder.connect_callbacks(self)
         self.file = None
 
+        # The conversions waiting for the conversion thread, and the messages it sends back to the main loop
+        self.conversions: queue.Queue = queue.Queue()
+        self.messages: queue.Queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.pending = 0
+
+        threading.Thread(target=self._conversion_worker, daemon=True).start()
+        self.mainwindow.after(POLL_INTERVAL, self._poll_messages)
+
     def run(self) -> None:
         """
         Starts the GUI main loop, keeps the GUI alive
@@ -80,13 +107,15 @@ class ImageAudioConverter:
         :param img_loc: location of the image
         :return: the converted image
         """
-        return cv2.imread(img_loc)
+        with span('image.read'):
+            return cv2.imread(img_loc)
 
     def convert(self) -> None:
         """
         Function that select the appropriate transformation function depending on if the selected file is an image or
         an audio file. If it is an image it will convert it to a *.mid and if it is an audio file then it will be
-        converted to an *.jpeg.
+        converted to an *.jpeg. The conversion is queued, it runs on the conversion thread once the previous ones are
+        done.
         """
 
         if self.file is not None:
@@ -94,74 +123,165 @@ class ImageAudioConverter:
                 self.builder.tkvariables['row_size'].get(), self.builder.tkvariables['col_size'].get())
             # print("rows: ", ImageAudioConverter.SPLIT_NUMBER[0], "cols: ", ImageAudioConverter.SPLIT_NUMBER[1])
 
-            # If the file is an image
-            if self.file.name.endswith('jpg') or self.file.name.endswith('png'):
-                self.convert_img_to_music()
-            else:  # If the file is an audio file
-                self.convert_music_to_img(self.file.name)
+            self.conversions.put(Conversion(self.file.name, ImageAudioConverter.SPLIT_NUMBER))
+            self.pending += 1
+            self.builder.get_object('cancel_button').configure(state='normal')
+            self._set_status(f"Queued {os.path.basename(self.file.name)}")
+
+    def cancel(self) -> None:
+        """
+        Cancels the running conversion, the queued ones still run
+        """
+        self.cancelled.set()
+
+    def _set_status(self, status: str) -> None:
+        self.builder.tkvariables['status_var'].set(f"{status} ({self.pending} queued)" if self.pending > 1 else status)
 
-    def convert_img_to_music(self, cypher: musicgen.rules.Rules = CYPHER) -> None:
+    def _conversion_worker(self) -> None:
+        """
+        Runs the queued conversions one after the other, on the conversion thread. Tk can only be used from the main
+        loop, so everything is reported through the messages queue.
+        """
+        while True:
+            task: Conversion = self.conversions.get()
+            self.cancelled.clear()
+            self.messages.put(('started', task, None))
+
+            try:
+                if self.profile_output is not None:
+                    # Only a single conversion is profiled
+                    profile_output, self.profile_output = self.profile_output, None
+                    with profile(profile_output):
+                        result = self._run_conversion(task)
+                else:
+                    result = self._run_conversion(task)
+            except conversion.ConversionCancelled:
+                self.messages.put(('cancelled', task, None))
+            except Exception as error:
+                self.messages.put(('failed', task, error))
+            else:
+                self.messages.put(('done', task, result))
+
+    def _run_conversion(self, task: Conversion) -> Union[bytes, np.ndarray]:
+        """
+        Converts an image to the content of a *.mid file, or a *.mid file to an image, on the conversion thread
+        """
+        def progress(done: int, total: int) -> None:
+            if self.cancelled.is_set():
+                raise conversion.ConversionCancelled()
+            self.messages.put(('progress', task, (done, total)))
+
+        with open(task.file, 'rb') as file:
+            content = file.read()
+
+        # If the file is an image
+        if task.file.endswith('jpg') or task.file.endswith('png'):
+            if self.cache is not None:
+                return self.cache.encode_image(content, task.split_number, CYPHER, self.available_notes,
+                                               progress=progress)
+
+            music = io.BytesIO()
+            conversion.stream_image_to_music(conversion.read_image_bytes(content), music, task.split_number, CYPHER,
+                                             self.available_notes, progress=progress)
+            return music.getvalue()
+
+        # If the file is an audio file
+        if self.cache is not None:
+            return self.cache.decode_midi(content, task.split_number, CYPHER, self.notes, progress)
+        return conversion.decode_midi(content, task.split_number, CYPHER, self.notes, progress)
+
+    def _poll_messages(self) -> None:
+        """
+        Handles the messages of the conversion thread on the main loop, the save dialogs are opened from here
+        """
+        try:
+            while True:
+                kind, task, payload = self.messages.get_nowait()
+                name = os.path.basename(task.file)
+
+                if kind == 'started':
+                    self.builder.tkvariables['progress_var'].set(0)
+                    self._set_status(f"Converting {name}")
+                elif kind == 'progress':
+                    done, total = payload
+                    self.builder.tkvariables['progress_var'].set(100 * done / total)
+                else:
+                    self.pending -= 1
+                    if self.pending == 0:
+                        self.builder.get_object('cancel_button').configure(state='disabled')
+
+                    if kind == 'done':
+                        self.builder.tkvariables['progress_var'].set(100)
+                        self._set_status(f"Converted {name}")
+                        if isinstance(payload, bytes):
+                            self.save_music(payload)
+                        else:
+                            self.save_image(payload)
+                    elif kind == 'cancelled':
+                        self.builder.tkvariables['progress_var'].set(0)
+                        self._set_status(f"Cancelled {name}")
+                    else:
+                        self._set_status(f"Could not convert {name}: {payload}")
+        except queue.Empty:
+            pass
+
+        self.mainwindow.after(POLL_INTERVAL, self._poll_messages)
+
+    def convert_img_to_music(self, cypher: musicgen.rules.Rules = CYPHER, backend: str = 'music21') -> None:
         """
         Function that converts an image (*.png or *.jpeg) to a music file (*.mid)
         :param cypher: It is the cypher used to convert from the music and back
+        :param backend: 'music21' to write the file through a music21 Stream, 'midi' to write it directly. The cached
+        conversions are always written directly.
         """
         if self.file is not None:
-            image = self._read_image(self.file.name)
-
-            # Gets the split data channels
-            notes, quarter_length, volume = self.split_image_transform(image)
-
-            # Normalizes the notes to be between 0-1 and converts the range to be one of the available notes
-            notes /= 255
-            notes *= (len(self.available_notes) - 1)
-            notes = np.rint(notes).astype(int)
-            notes = np.vectorize(lambda x: self.available_notes[x])(notes)
-            # print(notes.shape)
+            if self.cache is not None:
+                with open(self.file.name, 'rb') as file:
+                    chords = self.cache.encode_image(file.read(), ImageAudioConverter.SPLIT_NUMBER, cypher,
+                                                     self.available_notes)
+            else:
+                image = self._read_image(self.file.name)
 
-            # Normalizes the quarter-length between the min and max value
-            quarter_length /= 255
-            quarter_length = quarter_length * (max_quarter_length - min_quarter_length) + min_quarter_length
+                # Converts the image into a chord progression
+                chords = conversion.image_to_music(image, ImageAudioConverter.SPLIT_NUMBER, cypher,
+                                                   self.available_notes, backend)
 
-            # Makes sure that the quarter-length are increments of 0.25
-            quarter_length /= .25
-            quarter_length = np.rint(quarter_length)
-            quarter_length *= .25
+            self.save_music(chords)
 
-            # Normalizes the volumes to be within a certain range
-            volume /= 255
-            volume = volume * (max_vol - min_vol) + min_vol
-
-            # Converts the list of notes into a chord progression
-            chords = musicgen.create_chords([(note, vel, vol) for note, vel, vol in zip(notes, quarter_length, volume)],
-                                            cypher)
-
-            # Asks for the user to save their files
-            file_types = [('Midi', '*.mid')]
-            file = asksaveasfile(filetypes=file_types, defaultextension=file_types)
+    def save_music(self, chords: Union[Stream, bytes]) -> None:
+        """
+        Asks the user where to save the generated *.mid file and opens it
+        :param chords: the Stream of chords or the content of the *.mid file
+        """
+        # Asks for the user to save their files
+        file_types = [('Midi', '*.mid')]
+        file = asksaveasfile(filetypes=file_types, defaultextension=file_types)
 
-            if file is not None:
-                chords.write("midi", file.name)
-                self.open_file_in_system(file.name)
+        if file is not None:
+            conversion.write_music(chords, file.name)
+            self.open_file_in_system(file.name)
 
-    def convert_music_to_img(self, music_in: str, cypher: musicgen.rules.Cypher = CYPHER) -> None:
+    def convert_music_to_img(self, music_in: str, cypher: musicgen.rules.Cypher = CYPHER,
+                             backend: str = 'music21') -> None:
         """
         Function that converts a music file (*.mid) to an image (*.png or *.jpeg)
         :param music_in: the input music file to decode
         :param cypher: It is the cypher used to convert from the music and back
+        :param backend: 'music21' to parse the file with music21, 'midi' to stream its note events. The cached
+        conversions always stream the note events.
         """
+        if self.cache is not None:
+            with open(music_in, 'rb') as file:
+                self.save_image(self.cache.decode_midi(file.read(), ImageAudioConverter.SPLIT_NUMBER, cypher,
+                                                       self.notes))
+            return
 
-        # Retrieves the music data from the *.mid file
-        note_identifiers = musicgen.decode(music_in, cypher)
-        notes = []
-        quarter_lengths = []
-        volumes = []
-        for note_identifier in note_identifiers:
-            notes.append(note_identifier[0])
-            quarter_lengths.append(note_identifier[1])
-            volumes.append(note_identifier[2])
+        # Retrieves the music data from the *.mid file, in raster order
+        batch = conversion.raster_batch(musicgen.decode(music_in, cypher, backend, self.notes),
+                                        ImageAudioConverter.SPLIT_NUMBER)
 
         # Runs the decode routine
-        self.decode_music(np.asarray(notes), np.asarray(quarter_lengths), np.asarray(volumes))
+        self.decode_music(batch.note_names(), batch.quarter_lengths, batch.velocities)
 
     def decode_music(self, notes: np.ndarray, quarter_lengths: np.ndarray, volumes: np.ndarray) -> None:
         """
@@ -172,33 +292,24 @@ class ImageAudioConverter:
         :return:
         """
 
-        # Inverses the normalization for the notes, the quarter_lengths and the volumes using the opposite
-        # steps of convert_img_to_music
-        notes = np.array([NOTES_LIST.index(note[0]) for note in notes])
-        notes = notes / (len(NOTES_LIST) - 1)
-        notes *= 255
-
-        volumes = (volumes - min_vol) * 255 / (max_vol - min_vol)
-
-        quarter_lengths = (quarter_lengths - min_quarter_length) * 255 / (max_quarter_length - min_quarter_length)
-
-        # Reshapes the flattened image to an image
-        shape = (ImageAudioConverter.SPLIT_NUMBER[0], ImageAudioConverter.SPLIT_NUMBER[1], 1)
+        with span('image.reconstruct'):
+            new_image = conversion.notes_to_image(notes, quarter_lengths, volumes, ImageAudioConverter.SPLIT_NUMBER,
+                                                  NOTES_LIST)
 
-        notes = notes.reshape(shape)
-        quarter_lengths = quarter_lengths.reshape(shape)
-        volumes = volumes.reshape(shape)
-
-        # Joins all the image channels into one
-        new_image = np.concatenate((notes, quarter_lengths, volumes), axis=2)
-        new_image = new_image.astype(np.uint8)
+        self.save_image(new_image)
 
+    def save_image(self, new_image: np.ndarray) -> None:
+        """
+        Asks the user where to save the decoded image and opens it
+        :param new_image: the reconstructed image
+        """
         # Asks user where to save file
         file_types = [('PNG', "*.png"), ('JPEG', '*.jpeg')]
         file = asksaveasfile(filetypes=file_types, defaultextension=file_types)
 
         if file is not None:
-            cv2.imwrite(file.name, new_image)
+            with span('image.write'):
+                cv2.imwrite(file.name, new_image)
             self.open_file_in_system(file.name)
 
     def split_image_transform(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
@@ -207,32 +318,7 @@ class ImageAudioConverter:
         :param image: the input image to retrieve the features from
         :return: the three raw extracted features: the notes, the volume and the quarter_length
         """
-        note = []
-        quarter_length = []
-        volume = []
-
-        d_height = image.shape[0] / ImageAudioConverter.SPLIT_NUMBER[0]
-        d_width = image.shape[1] / ImageAudioConverter.SPLIT_NUMBER[1]
-
-        ratio_h = np.floor(d_height) * ImageAudioConverter.SPLIT_NUMBER[0]
-        ratio_w = np.floor(d_width) * ImageAudioConverter.SPLIT_NUMBER[1]
-
-        # Resises the image if it is too large and causes issues in the splitting
-        image = cv2.resize(image, (int(ratio_w), int(ratio_h)))
-
-        d_height = int(image.shape[0] / ImageAudioConverter.SPLIT_NUMBER[0])
-        d_width = int(image.shape[1] / ImageAudioConverter.SPLIT_NUMBER[1])
-
-        # Logic for splitting and getting the average of each section block
-        for r in range(0, image.shape[0], d_height):
-            for c in range(0, image.shape[1], d_width):
-                crop = image[r:r + d_height, c:c + d_width]
-
-                note.append(np.median(crop[:, :, 0]))
-                quarter_length.append(np.median(crop[:, :, 1]))
-                volume.append(np.median(crop[:, :, 2]))
-
-        return np.array(note), np.array(quarter_length), np.array(volume)
+        return conversion.split_image_transform(image, ImageAudioConverter.SPLIT_NUMBER)
 
     def open_file_in_system(self, file: str) -> None:
         """
@@ -248,5 +334,6 @@ class ImageAudioConverter:
 
 
 if __name__ == '__main__':
-    app = ImageAudioConverter(NOTES_LIST)
+    # SOUNDSAWFUL_PROFILE=convert.prof python ui.py profiles the first conversion
+    app = ImageAudioConverter(NOTES_LIST, cache.ConversionCache(), os.environ.get('SOUNDSAWFUL_PROFILE'))
     app.run()